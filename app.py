@@ -1,51 +1,327 @@
-from flask import Flask, request, session, render_template, jsonify
+from flask import Flask, Request, Response, g, request, session, render_template, jsonify
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_etags
 from flask_limiter import Limiter
 from flask_limiter.util import get_remote_address
 from services.billing import BillingService
+from services.pricing import PricingEngine
 from services.print_server import PrintService
+from services.session_registry import SessionRegistry, SessionChargeFailed
+from services.log_pipeline import LogPipeline
+from services.print_spool import PrintSpool, SpoolUpload
+from services.print_queue import PrintQueue
+from services.lazy import LazyService
+from services.document_inspector import DocumentInspector, InspectorUnavailable
+from services.rate_limit_storage import SharedMemoryStorage  # registers shm:// for the limiter
+from security.auth import Auth
+from security.password_pool import PasswordHasher, HasherBusy
+from services.dashboard_stats import DashboardStats
+from services.metrics import Metrics
+from services.station_table import StationTable, StationTableFull, StationThrottled, StationUnverified, station_token
 import logging
-from datetime import datetime
+import atexit
+import csv
+import hmac
+import io
+import json
+import threading
+import time
 import os
+from datetime import datetime
+from concurrent.futures import BrokenExecutor, CancelledError, TimeoutError as FutureTimeoutError
+
+class SpoolingRequest(Request):
+    #stream uploaded files straight into the print spool
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return print_spool.open_upload()
 
 #init flask app
 app = Flask(__name__)
+app.request_class = SpoolingRequest
 app.config.from_object('config.config.Config')
 limiter = Limiter(app, key_func=get_remote_address)
-billing_service = BillingService()
-print_service = PrintService()
+#stations poll the balance all day, so it has its own window instead of the
+#daily default; async_app applies the same limit to its native route
+BALANCE_RATE_LIMIT = "60 per minute"
+
+#forks its worker processes now, before any background thread exists
+document_inspector = DocumentInspector(**app.config['PRINT_INSPECTION'])
+atexit.register(document_inspector.close)
+password_hasher = PasswordHasher(**app.config['PASSWORD_HASHING'])
+atexit.register(password_hasher.close)
+auth = Auth(app.config['SECRET_KEY'], hasher=password_hasher)
 
 if not os.path.exists('logs'):
     os.makedirs('logs')
 
-#logs setup
-logging.basicConfig(
-    filename='logs/cafe.log',
-    level=logging.INFO,
-    format='%(asctime)s [%(levelname)s] - %(message)s'
+#logs setup: records are queued and written by a background thread,
+#registered first so it is the last thing closed at exit
+log_pipeline = LogPipeline(**app.config['LOG_CONFIG']).install()
+atexit.register(log_pipeline.close)
+
+#request and MySQL/CUPS latency, served on /metrics for every worker process
+metrics = None
+if app.config['METRICS']['enabled']:
+    metrics = Metrics(app.config['METRICS']['directory'], app.config['METRICS']['flush_interval'])
+    atexit.register(metrics.close)
+
+#one engine prices internet time for both charges and live previews
+pricing_engine = PricingEngine(app.config['BILLING_RATES'])
+
+def create_billing_service():
+    return BillingService(
+        connect=app.config['DB_CONNECT'],
+        on_transaction=dashboard_stats.record_transaction,
+        metrics=metrics,
+        pricing=pricing_engine,
+        rates=app.config['BILLING_RATES']
+    )
+
+def create_print_service():
+    service = PrintService(connect=app.config['CUPS_CONNECT'], metrics=metrics)
+    service.start_state_cache(**app.config['CUPS_STATE'])
+    return service
+
+def reconcile_dashboard():
+    values = {'sessions': session_registry.active_sessions()}
+    if billing_service.is_ready():
+        #queued ledger charges are not in the table until flushed
+        billing_service.flush_ledger(timeout=5.0)
+        totals = billing_service.get_daily_totals(datetime.combine(datetime.now().date(), datetime.min.time()))
+        if totals:
+            values.update(totals)
+    return values
+
+#admin dashboard figures, updated by events rather than queried per view
+dashboard_stats = DashboardStats(
+    reconcile_dashboard,
+    app.config['DASHBOARD']['reconcile_interval'],
+    price_sessions=pricing_engine.preview_sessions
+)
+dashboard_streams = threading.BoundedSemaphore(app.config['DASHBOARD']['max_streams'])
+
+#services connect to MySQL/CUPS on first use, so import never blocks on them
+billing_service = LazyService('billing', create_billing_service)
+print_service = LazyService('print', create_print_service)
+print_spool = PrintSpool(**app.config['PRINT_SPOOL'])
+print_queue = PrintQueue(print_service, **app.config['PRINT_QUEUE'])
+session_registry = SessionRegistry(
+    billing_service,
+    lifetime=app.config['PERMANENT_SESSION_LIFETIME'].total_seconds(),
+    idle_timeout=app.config['SESSION_IDLE_TIMEOUT'].total_seconds(),
+    on_start=dashboard_stats.session_started,
+    on_end=dashboard_stats.session_ended
 )
 
+#client-side events carried by heartbeats go to the activity log
+def record_station_event(station_id, user_id, event):
+    event_id, kind, at, data = event
+    try:
+        logging.info(
+            "Station %s reported %s", station_id, kind,
+            extra={'activity': {'user_id': user_id, 'action': f"station_{kind}", 'station': station_id, 'at': at, 'data': data}}
+        )
+    except Exception as e:
+        logging.error("Activity logging error: %s", e)
+
+#live view of the stations, folded from their heartbeats
+station_table = StationTable(**app.config['HEARTBEAT'], on_event=record_station_event)
+atexit.register(dashboard_stats.close)
+atexit.register(billing_service.close)
+atexit.register(print_service.close)
+atexit.register(session_registry.close)
+atexit.register(print_queue.close)
+
+if app.config['SERVICE_WARMUP']:
+    billing_service.warm_up()
+    print_service.warm_up()
+
+#stand-in user store until accounts are read from the database
+USERS = {
+    "test@example.com": {"id": 1, "password_hash": "scrypt:32768:8:1$kObNO5BdGpJxO4CL$015d35d720e67ea06cacb81d27b8d78b64a6aaebd1565cf427b2eded0b82f05278d657b1c417cd4fd219e3e261f0f1a3579fe9c405f9fd5b0eb2c82dff8dc7d8"}
+}
+
+#the hasher could not give an answer (overloaded, timed out, pool gone):
+#a server problem for /login to report, not bad credentials
+HASHER_UNAVAILABLE = (HasherBusy, TimeoutError, FutureTimeoutError, BrokenExecutor, CancelledError)
+
 def authenticate_user(email,password):
     try:
-        if email == "test@example.com" and password == "password":
-            return {"id": 1, "email": email}
+        user = USERS.get(email)
+        if user and auth.verify_password(user['password_hash'], password):
+            return {"id": user['id'], "email": email}
         return None
+    except HASHER_UNAVAILABLE:
+        raise
     except Exception as e:
-        logging.error(f"Authentication error: {e}")
+        logging.error("Authentication error: %s", e)
         return None
 
-def create_session(user_id):
+def create_session(user_id, ip_address=None):
     try:
-        session_id = str(datetime.now().timestamp())
-        return session_id
+        return session_registry.start(user_id, ip_address)['id']
     except Exception as e:
-        logging.error(f"Session creation error: {e}")
+        logging.error("Session creation error: %s", e)
         return None
 
 def log_activity(user_id, action, ip_address):
     try:
-        logging.info(f"User {user_id} performed {action} from {ip_address}")
+        logging.info(
+            "User %s performed %s from %s", user_id, action, ip_address,
+            extra={'activity': {'user_id': user_id, 'action': action, 'ip': ip_address}}
+        )
     except Exception as e:
-        logging.error(f"Activity logging error: {e}")
+        logging.error("Activity logging error: %s", e)
+
+def finish_session(user_id, ip_address):
+    #shared by the Flask and async /end_session routes; returns (body, status)
+    try:
+        ended = session_registry.end(user_id)
+    except SessionChargeFailed as e:
+        #ended, but the minutes are only billed once the retry succeeds
+        logging.error("Session end error: %s", e)
+        log_activity(user_id, 'end_session', ip_address)
+        return {
+            'error': 'Session ended but could not be charged yet; it will be retried',
+            'session_id': e.session['id'],
+            'duration_minutes': e.session['duration_minutes']
+        }, 503
+    if not ended:
+        return {'error': 'No active session'}, 400
+    log_activity(user_id, 'end_session', ip_address)
+    return {
+        'status': 'success',
+        'session_id': ended['id'],
+        'duration_minutes': ended['duration_minutes'],
+        'cost': ended['cost']
+    }, 200
+
+def fold_heartbeat(beat, user_id, ip_address):
+    #shared by the Flask and async /heartbeat routes; returns (body, status, headers)
+    station_id = beat.get('station') if isinstance(beat, dict) else None
+    if not isinstance(station_id, str) or not 0 < len(station_id) <= 64:
+        return {'error': 'Missing station id'}, 400, {}
+    #a station proves its id with its token; without one, only a logged-in
+    #user can heartbeat, and only for a station registered from their address
+    verified = valid_station_token(station_id, beat.get('token'))
+    if not verified and (user_id is None or beat.get('token')):
+        return {'error': 'Unknown station'}, 401, {}
+    try:
+        reply = station_table.heartbeat(station_id, ip_address, user_id, beat, verified=verified)
+    except ValueError as e:
+        return {'error': str(e)}, 400, {}
+    except StationUnverified:
+        return {'error': 'Unknown station'}, 401, {}
+    except StationThrottled:
+        return {'error': 'Too many new stations'}, 503, {'Retry-After': str(int(station_table.min_interval))}
+    except StationTableFull:
+        return {'error': 'Too many stations'}, 503, {'Retry-After': str(int(station_table.max_interval))}
+
+    if user_id is not None:
+        #a running client keeps its session from idling out; a crashed one
+        #stops heartbeating and the idle timeout ends it
+        if (beat.get('session') or {}).get('active'):
+            session_registry.touch(user_id)
+        current = session_registry.get_by_user(user_id)
+        reply['session'] = {'active': current is not None, 'id': current['id'] if current else None}
+    return reply, 200, {}
+
+def valid_station_token(station_id, token):
+    key = app.config['STATION_KEY']
+    if not key or not isinstance(token, str):
+        return False
+    return hmac.compare_digest(token, station_token(key, station_id))
+
+def unchanged_balance_tag(user_id, if_none_match):
+    #a conditional balance poll is answered from memory while the tag the
+    #client holds is still current; None means the balance must be sent
+    if not if_none_match or not billing_service.is_ready():
+        return None
+    etag = billing_service.balance_tag(user_id)
+    if etag and parse_etags(if_none_match).contains(etag):
+        return etag
+    return None
+
+def balance_headers(etag):
+    #clients must revalidate, and shared caches must not keep a balance
+    headers = {'Cache-Control': 'private, no-cache'}
+    if etag:
+        headers['ETag'] = f'"{etag}"'
+    return headers
+
+def check_database():
+    start = time.monotonic()
+    try:
+        with billing_service.pool.connection(timeout=1.0) as conn:
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+        return {'state': 'ready', 'latency': time.monotonic() - start}
+    except Exception as e:
+        return {'state': 'failed', 'error': str(e)}
+
+def check_cups():
+    stats = print_service.state_cache.stats()
+    max_age = 3 * print_service.state_cache.poll_interval + 1
+    if stats['staleness'] is None or stats['staleness'] > max_age:
+        return {'state': 'failed', 'error': 'CUPS state is stale', 'staleness': stats['staleness']}
+    return {'state': 'ready', 'staleness': stats['staleness']}
+
+def route_label():
+    #the rule, not the path, so /print_status/<job_id> is one series
+    return request.url_rule.rule if request.url_rule else 'unmatched'
+
+@app.before_request
+def start_request_timer():
+    if metrics:
+        g.request_timer = (route_label(), time.perf_counter())
+        metrics.add('cafe_http_requests_in_flight', (('route', g.request_timer[0]),), 1)
+
+@app.after_request
+def record_request_time(response):
+    #streamed bodies (exports, SSE) are timed until the response is returned,
+    #not until the last byte is sent
+    timer = g.get('request_timer')
+    if timer:
+        route, start = timer
+        labels = (('route', route), ('method', request.method))
+        metrics.observe('cafe_http_request_duration_seconds', labels, time.perf_counter() - start)
+        metrics.inc('cafe_http_requests_total', labels + (('status', str(response.status_code)),))
+        if response.status_code >= 500:
+            metrics.inc('cafe_http_request_errors_total', labels)
+    return response
+
+@app.teardown_request
+def end_request_timer(exc=None):
+    timer = g.get('request_timer')
+    if timer:
+        metrics.add('cafe_http_requests_in_flight', (('route', timer[0]),), -1)
+
+@app.route('/metrics')
+@limiter.exempt
+def metrics_endpoint():
+    if not metrics:
+        return jsonify({'error': 'Metrics are disabled'}), 404
+    if request.remote_addr not in app.config['METRICS']['allowed_ips']:
+        return jsonify({'error': 'Forbidden'}), 403
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/ready')
+def ready():
+    checks = {
+        'billing': billing_service.status(),
+        'print': print_service.status(),
+        'inspection': document_inspector.status()
+    }
+    #dependency probes only run once their service is built
+    if billing_service.is_ready():
+        checks['database'] = check_database()
+    if print_service.is_ready():
+        checks['cups'] = check_cups()
+
+    is_ready = all(check['state'] == 'ready' for check in checks.values())
+    return jsonify({'ready': is_ready, 'checks': checks}), 200 if is_ready else 503
 
 @app.route('/')
 def index():
@@ -59,11 +335,18 @@ def login():
         user = authenticate_user(data['email'], data['password'])
         if user:
            session['user_id'] = user['id']
+           dashboard_stats.record_login(user['id'])
            log_activity(user['id'], 'login', request.remote_addr)
            return jsonify({'status': 'success'})
         return jsonify({'error': 'Invalid credentials'}), 401
+    except HasherBusy:
+        #shed the burst instead of letting it queue behind the KDF
+        return jsonify({'error': 'Server busy, try again'}), 503, {'Retry-After': '1'}
+    except HASHER_UNAVAILABLE as e:
+        logging.error("Login error: password check failed: %r", e)
+        return jsonify({'error': 'Login unavailable, try again later'}), 503, {'Retry-After': '5'}
     except Exception as e:
-        logging.error(f"Login error: {e}")
+        logging.error("Login error: %s", e)
         return jsonify({'error': 'Server error'}), 500
 
 @app.route('/start_session', methods=['POST'])
@@ -72,10 +355,13 @@ def start_session():
        return jsonify({'error': 'Not authenticated'}), 401
 
     try:
-        session_id = create_session(session['user_id'])
+        session_id = create_session(session['user_id'], request.remote_addr)
+        if not session_id:
+            return jsonify({'error': 'Server error'}), 500
+        log_activity(session['user_id'], 'start_session', request.remote_addr)
         return jsonify({'session_id': session_id})
     except Exception as e:
-        logging.error(f"Session start error: {e}")
+        logging.error("Session start error: %s", e)
         return jsonify({'error': 'Server error'}), 500
 
 @app.route('/end_session', methods=['POST'])
@@ -84,50 +370,137 @@ def end_session():
         return jsonify({'error': 'Not authenticated'}), 401
 
     try:
-        log_activity(session['user_id'], 'end_session', request.remote_addr)
-        return jsonify({'status': 'success'})
+        body, status = finish_session(session['user_id'], request.remote_addr)
+        return jsonify(body), status
     except Exception as e:
-        logging.error(f"Session end error: {e}")
+        logging.error("Session end error: %s", e)
         return jsonify({'error': 'Server error'}), 500
 
+def finish_print_job(job, spool_path, cost):
+    print_spool.release(spool_path)
+    dashboard_stats.print_finished(job)
+    if cost and job['status'] in ('failed', 'cancelled'):
+        billing_service.add_credit(job['user_id'], cost, f"Refund for print job {job['id']}", 'refund')
+
+def submit_print_job(user_id, spool_path, digest, document, printer):
+    #shared by the Flask and async /print routes once the upload is spooled
+    #and inspected; returns (body, status). The spool file is released unless
+    #the job took it, and a charge whose job was never submitted is refunded
+    cost = billing_service.calculate_print_cost(document['pages'], document['color_pages'])
+    charged = False
+    try:
+        description = f"Printing: {document['pages']} pages ({document['color_pages']} color)"
+        outcome = billing_service.charge_print_if_covered(user_id, cost, description)
+        if outcome is False:
+            print_spool.release(spool_path)
+            return {'error': 'Insufficient balance', 'cost': cost}, 402
+        if outcome is None:
+            print_spool.release(spool_path)
+            return {'error': 'Print charge failed'}, 500
+        charged = True
+
+        #counted before submitting: a fast job can finish before submit returns
+        dashboard_stats.print_submitted({'user_id': user_id, 'printer': printer})
+        try:
+            job = print_queue.submit(
+                user_id,
+                spool_path,
+                printer,
+                on_finish=lambda job: finish_print_job(job, spool_path, cost)
+            )
+        except Exception:
+            dashboard_stats.print_finished({'status': 'failed'})
+            raise
+    except Exception:
+        print_spool.release(spool_path)
+        if charged:
+            billing_service.add_credit(user_id, cost, "Refund for unsubmitted print job", 'refund')
+        raise
+
+    print_spool.remember_job(user_id, digest, printer, job['id'])
+    return {
+        'job_id': job['id'],
+        'status': job['status'],
+        'pages': document['pages'],
+        'color_pages': document['color_pages'],
+        'cost': cost
+    }, 202
+
 @app.route('/print', methods=['POST'])
 def print_document():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
     try:
+        session_registry.touch(session['user_id'])
         file = request.files['file']
         printer = request.form.get('printer')
 
-        temp_path = f"/tmp/{file.filename}"
-        file.save(temp_path)
-
-        job_id = print_service.submit_print_job(
-            session['user_id'],
-            temp_path,
-            printer
-        )
-
+        spool_path, digest = print_spool.commit(file.stream, file.filename)
+        job_id = print_spool.recent_job(session['user_id'], digest, printer)
         if job_id:
-            return jsonify({'job_id': job_id})
-        return jsonify({'error': 'Print failed'}), 500
+            print_spool.release(spool_path)
+            return jsonify({'job_id': job_id, 'duplicate': True})
+
+        try:
+            document = document_inspector.inspect(spool_path, digest)
+        except Exception:
+            print_spool.release(spool_path)
+            raise
+        body, status = submit_print_job(session['user_id'], spool_path, digest, document, printer)
+        return jsonify(body), status
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'File too large'}), 413
+    except InspectorUnavailable as e:
+        logging.error("Print error: %s", e)
+        return jsonify({'error': 'Printing unavailable, try again later'}), 503
     except Exception as e:
-        logging.error(f"Print error: {e}")
+        logging.error("Print error: %s", e)
         return jsonify({'error': 'Server error'}), 500
-    finally:
-        if 'temp_path' in locals() and os.path.exists(temp_path):
-            os.remove(temp_path)
+
+@app.route('/print_status/<job_id>', methods=['GET'])
+def print_status(job_id):
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    job = print_queue.get_job(job_id)
+    if not job or job['user_id'] != session['user_id']:
+        return jsonify({'error': 'Job not found'}), 404
+    if job['cups_job_id']:
+        job['cups_state'] = print_service.get_job_status(job['cups_job_id'])
+    return jsonify(job)
+
+@app.teardown_request
+def discard_uploads(exc=None):
+    #drop any spooled upload that was parsed but never committed
+    files = request.__dict__.get('files')
+    if files:
+        for file in files.values():
+            if isinstance(file.stream, SpoolUpload):
+                file.stream.discard()
+
+@app.route('/heartbeat', methods=['POST'])
+@limiter.exempt
+def heartbeat():
+    #stations that are up but logged out heartbeat too
+    reply, status, headers = fold_heartbeat(request.get_json(silent=True), session.get('user_id'), request.remote_addr)
+    return jsonify(reply), status, headers
 
 @app.route('/get_balance', methods=['GET'])
+@limiter.limit(BALANCE_RATE_LIMIT)
 def get_balance():
     if 'user_id' not in session:
         return jsonify({'error': 'Not authenticated'}), 401
 
     try:
-        balance = billing_service.get_balance(session['user_id'])
-        return jsonify({'balance': balance})
+        session_registry.touch(session['user_id'])
+        etag = unchanged_balance_tag(session['user_id'], request.headers.get('If-None-Match'))
+        if etag:
+            return '', 304, balance_headers(etag)
+        balance, etag = billing_service.get_balance_tagged(session['user_id'])
+        return jsonify({'balance': balance}), 200, balance_headers(etag)
     except Exception as e:
-        logging.error(f"Balance check error: {e}")
+        logging.error("Balance check error: %s", e)
         return jsonify({'error': 'Server error'}), 500
 
 @app.route('/add_credit', methods=['POST'])
@@ -140,10 +513,149 @@ def add_credit():
         if billing_service.add_credit(session['user_id'], amount):
             log_activity(session['user_id'], f'add_credit_{amount}', request.remote_addr)
             return jsonify({'status': 'success'})
-        return jsonify({'status': 'success'})
+        return jsonify({'error': 'Add credit failed'}), 400
+    except Exception as e:
+        logging.error("Add credit error: %s", e)
+        return jsonify({'error': 'Server error'}), 500
+
+@app.route('/transactions', methods=['GET'])
+def transactions():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    try:
+        page = billing_service.get_transaction_page(
+            session['user_id'],
+            limit=request.args.get('limit', 10),
+            cursor=request.args.get('cursor')
+        )
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     except Exception as e:
-        logging.error(f"Add credit error: {e}")
+        logging.error("Transaction history error: %s", e)
         return jsonify({'error': 'Server error'}), 500
+    page['transactions'] = [export_row(row) for row in page['transactions']]
+    return jsonify(page)
+
+EXPORT_FIELDS = ['id', 'created_at', 'transaction_type', 'amount', 'description']
+
+def export_row(row):
+    return {
+        'id': row.get('id'),
+        'created_at': row['created_at'].isoformat() if row.get('created_at') else None,
+        'transaction_type': row.get('transaction_type'),
+        'amount': str(row.get('amount')),
+        'description': row.get('description')
+    }
+
+def export_csv(rows):
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=EXPORT_FIELDS)
+    writer.writeheader()
+    for count, row in enumerate(rows, 1):
+        writer.writerow(export_row(row))
+        #hand chunks to the server every few hundred rows, not per row
+        if count % 500 == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+    yield buffer.getvalue()
+
+def export_ndjson(rows):
+    chunk = []
+    for row in rows:
+        chunk.append(json.dumps(export_row(row)) + '\n')
+        if len(chunk) == 500:
+            yield ''.join(chunk)
+            chunk = []
+    yield ''.join(chunk)
+
+@app.route('/transactions/export', methods=['GET'])
+def export_transactions():
+    if 'user_id' not in session:
+        return jsonify({'error': 'Not authenticated'}), 401
+
+    export_format = request.args.get('format', 'csv')
+    if export_format not in ('csv', 'ndjson'):
+        return jsonify({'error': 'format must be csv or ndjson'}), 400
+
+    user_id = session['user_id']
+    log_activity(user_id, f'export_transactions_{export_format}', request.remote_addr)
+    #rows are pulled from the database only as the response is sent
+    rows = billing_service.iter_transactions(user_id)
+    if export_format == 'csv':
+        body, mimetype = export_csv(rows), 'text/csv'
+    else:
+        body, mimetype = export_ndjson(rows), 'application/x-ndjson'
+    response = Response(body, mimetype=mimetype, headers={
+        'Content-Disposition': f'attachment; filename=transactions-{user_id}.{export_format}'
+    })
+    #a client that disconnects mid-download stops the page queries at once
+    response.call_on_close(rows.close)
+    return response
+
+def is_admin():
+    return session.get('user_id') in app.config['DASHBOARD']['admin_user_ids']
+
+@app.route('/admin', methods=['GET'])
+def admin_dashboard():
+    if not is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+
+    stats = dashboard_stats.snapshot()
+    return render_template(
+        'admin/dashboard.html',
+        admin_name=session['user_id'],
+        active_users=stats['active_users'],
+        revenue=f"{stats['revenue']:.2f}",
+        print_jobs=stats['print_jobs'],
+        active_sessions=[
+            {
+                'id': row['id'],
+                'user': row['user'],
+                'start_time': datetime.fromtimestamp(row['started_at']).strftime('%H:%M:%S'),
+                'started_at': row['started_at'],
+                'duration': f"{row['duration_minutes']} min",
+                'cost': f"{row['cost']:.2f}"
+            }
+            for row in stats['active_sessions']
+        ]
+    )
+
+@app.route('/admin/stream', methods=['GET'])
+def admin_stream():
+    if not is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+    #each open dashboard holds a server thread, so their number is capped
+    if not dashboard_streams.acquire(blocking=False):
+        return jsonify({'error': 'Too many dashboard streams'}), 503, {'Retry-After': '30'}
+
+    config = app.config['DASHBOARD']
+    def stream():
+        version = None
+        while True:
+            stats = dashboard_stats.wait(version, config['keepalive'])
+            if stats is None:
+                yield ': keepalive\n\n'
+                continue
+            version = stats['version']
+            yield f"id: {version}\nevent: stats\ndata: {json.dumps(stats)}\n\n"
+            #bursts of events go out as one push per interval
+            time.sleep(config['min_push_interval'])
+
+    response = Response(stream(), mimetype='text/event-stream', headers={
+        'Cache-Control': 'no-cache',
+        'X-Accel-Buffering': 'no'
+    })
+    #runs once the client goes away, even if the stream never started
+    response.call_on_close(dashboard_streams.release)
+    return response
+
+@app.route('/admin/stations', methods=['GET'])
+def admin_stations():
+    if not is_admin():
+        return jsonify({'error': 'Forbidden'}), 403
+    return jsonify({'stations': station_table.snapshot(), 'stats': station_table.stats()})
 
 @app.route('/logout', methods=['POST'])
 def logout():
@@ -153,16 +665,20 @@ def logout():
             session.clear()
         return jsonify({'status': 'success'})
     except Exception as e:
-        logging.error(f"Logout error: {e}")
+        logging.error("Logout error: %s", e)
         return jsonify({'error': 'Server error'}), 500
 
 @app.errorhandler(429)
 def ratelimit_handler(e):
     return jsonify({'error': 'Rate limit exceeded'}), 429
 
+@app.errorhandler(413)
+def too_large_handler(e):
+    return jsonify({'error': 'File too large'}), 413
+
 @app.errorhandler(500)
 def internal_error(e):
-    logging.error(f"Internal server error: {e}")
+    logging.error("Internal server error: %s", e)
     return jsonify({'error': 'Internal server error'}), 500
 
 if __name__ == '__main__':
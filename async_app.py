@@ -0,0 +1,225 @@
+from concurrent.futures import ThreadPoolExecutor
+from itsdangerous import BadSignature
+from limits import parse_many
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.http import parse_cookie, parse_options_header
+from werkzeug.sansio.multipart import Data, Epilogue, Field, File, MultipartDecoder, NeedData
+from app import (
+    app, limiter, metrics, billing_service, print_spool, session_registry, document_inspector,
+    create_session, log_activity, submit_print_job, fold_heartbeat, finish_session,
+    unchanged_balance_tag, balance_headers, BALANCE_RATE_LIMIT
+)
+from services.async_http import AsyncHTTPServer, HTTPError, json_response
+from services.document_inspector import InspectorUnavailable
+import asyncio
+import logging
+import ssl
+import time
+
+#Async serving mode: the station endpoints below run as coroutines on one
+#event loop, so an open station connection holds no thread while it idles
+#or uploads. Blocking work (MySQL reads, ledger journal writes) runs on a
+#small executor; every other route is served by the Flask app on the same
+#executor. Run with `python async_app.py`.
+
+config = app.config['ASYNC_SERVER']
+blocking = ThreadPoolExecutor(max_workers=config['blocking_workers'], thread_name_prefix='async-blocking')
+session_serializer = app.session_interface.get_signing_serializer(app)
+
+async def run_blocking(fn, *args):
+    return await asyncio.get_running_loop().run_in_executor(blocking, fn, *args)
+
+def session_user(request):
+    #the same signed cookie Flask's session reads
+    cookie = parse_cookie(request.headers.get('cookie', '')).get(app.config['SESSION_COOKIE_NAME'])
+    if not cookie:
+        return None
+    try:
+        data = session_serializer.loads(cookie, max_age=int(app.permanent_session_lifetime.total_seconds()))
+    except BadSignature:
+        return None
+    return data.get('user_id')
+
+def cached_balance(user_id):
+    #(balance, etag), answered on the loop when the billing service is
+    #built and has the balance cached
+    if billing_service.is_ready():
+        return billing_service.get_cached_balance_tagged(user_id)
+    return None
+
+async def get_balance(request):
+    user_id = session_user(request)
+    if user_id is None:
+        return json_response({'error': 'Not authenticated'}, 401)
+
+    try:
+        session_registry.touch(user_id)
+        etag = unchanged_balance_tag(user_id, request.headers.get('if-none-match'))
+        if etag:
+            return 304, balance_headers(etag), b''
+        tagged = cached_balance(user_id)
+        if tagged is None:
+            tagged = await run_blocking(billing_service.get_balance_tagged, user_id)
+        balance, etag = tagged
+        return json_response({'balance': balance}, 200, balance_headers(etag))
+    except Exception as e:
+        logging.error("Balance check error: %s", e)
+        return json_response({'error': 'Server error'}, 500)
+
+async def start_session(request):
+    user_id = session_user(request)
+    if user_id is None:
+        return json_response({'error': 'Not authenticated'}, 401)
+
+    #registry and dashboard updates are in memory
+    session_id = create_session(user_id, request.remote_addr)
+    if not session_id:
+        return json_response({'error': 'Server error'}, 500)
+    log_activity(user_id, 'start_session', request.remote_addr)
+    return json_response({'session_id': session_id})
+
+async def end_session(request):
+    user_id = session_user(request)
+    if user_id is None:
+        return json_response({'error': 'Not authenticated'}, 401)
+
+    try:
+        #charging the session writes the ledger journal
+        body, status = await run_blocking(finish_session, user_id, request.remote_addr)
+        return json_response(body, status)
+    except Exception as e:
+        logging.error("Session end error: %s", e)
+        return json_response({'error': 'Server error'}, 500)
+
+async def heartbeat(request):
+    #folded in memory, so it never leaves the loop
+    reply, status, headers = fold_heartbeat(await request.json(), session_user(request), request.remote_addr)
+    return json_response(reply, status, headers)
+
+async def receive_upload(request):
+    #parses the multipart body as it arrives; the file part is streamed
+    #into the print spool, the other (small) fields are kept
+    mimetype, options = parse_options_header(request.headers.get('content-type', ''))
+    if mimetype != 'multipart/form-data' or not options.get('boundary'):
+        raise HTTPError(400, "Expected a multipart/form-data upload")
+
+    decoder = MultipartDecoder(options['boundary'].encode(), max_form_memory_size=1024 * 1024)
+    upload = filename = None
+    fields = {}
+    part = None
+    try:
+        while True:
+            chunk = await request.read()
+            decoder.receive_data(chunk or None)
+            event = decoder.next_event()
+            while not isinstance(event, NeedData):
+                if isinstance(event, File):
+                    part = None
+                    if event.name == 'file' and upload is None:
+                        upload, filename, part = print_spool.open_upload(), event.filename, 'file'
+                elif isinstance(event, Field):
+                    part = event.name
+                    fields[part] = b''
+                elif isinstance(event, Data) and part == 'file':
+                    upload.write(event.data)
+                elif isinstance(event, Data) and part:
+                    fields[part] += event.data
+                    if len(fields[part]) > 4096:
+                        raise HTTPError(413, "Form field too large")
+                elif isinstance(event, Epilogue):
+                    return upload, filename, {name: value.decode('utf-8', 'replace') for name, value in fields.items()}
+                event = decoder.next_event()
+            if not chunk:
+                raise HTTPError(400, "Incomplete multipart body")
+    except BaseException:
+        if upload:
+            upload.discard()
+        raise
+
+async def print_document(request):
+    user_id = session_user(request)
+    if user_id is None:
+        return json_response({'error': 'Not authenticated'}, 401)
+
+    try:
+        session_registry.touch(user_id)
+        upload, filename, fields = await receive_upload(request)
+    except RequestEntityTooLarge:
+        return json_response({'error': 'File too large'}, 413)
+    if upload is None:
+        return json_response({'error': 'No file uploaded'}, 400)
+    printer = fields.get('printer')
+
+    try:
+        spool_path, digest = await run_blocking(print_spool.commit, upload, filename)
+        job_id = print_spool.recent_job(user_id, digest, printer)
+        if job_id:
+            print_spool.release(spool_path)
+            return json_response({'job_id': job_id, 'duplicate': True})
+
+        try:
+            document = await document_inspector.inspect_async(spool_path, digest)
+        except Exception:
+            print_spool.release(spool_path)
+            raise
+        #one executor hop for the charge, the submit and any refund
+        body, status = await run_blocking(submit_print_job, user_id, spool_path, digest, document, printer)
+        return json_response(body, status)
+    except InspectorUnavailable as e:
+        logging.error("Print error: %s", e)
+        return json_response({'error': 'Printing unavailable, try again later'}, 503)
+    except Exception as e:
+        logging.error("Print error: %s", e)
+        return json_response({'error': 'Server error'}, 500)
+
+def rate_limited(handler, endpoint, limit):
+    #the limit flask_limiter puts on the Flask view, checked against the same
+    #storage and keyed by remote address and endpoint; the limiter's storage
+    #is in shared memory, so the check does not block the loop
+    items = parse_many(limit) if limit else []
+
+    async def limited(request):
+        if limiter.enabled:
+            for item in items:
+                if not limiter.limiter.hit(item, request.remote_addr, endpoint):
+                    reset_at, _ = limiter.limiter.get_window_stats(item, request.remote_addr, endpoint)
+                    retry_after = str(max(int(reset_at - time.time()), 1))
+                    return json_response({'error': 'Rate limit exceeded'}, 429, {'Retry-After': retry_after})
+        return await handler(request)
+    return limited
+
+ROUTES = {
+    ('GET', '/get_balance'): rate_limited(get_balance, 'get_balance', BALANCE_RATE_LIMIT),
+    ('POST', '/start_session'): rate_limited(start_session, 'start_session', app.config['RATELIMIT_DEFAULT']),
+    ('POST', '/end_session'): rate_limited(end_session, 'end_session', app.config['RATELIMIT_DEFAULT']),
+    #exempt on the Flask side too
+    ('POST', '/heartbeat'): heartbeat,
+    ('POST', '/print'): rate_limited(print_document, 'print_document', app.config['RATELIMIT_DEFAULT'])
+}
+
+def create_server():
+    return AsyncHTTPServer(
+        ROUTES,
+        wsgi_app=app,
+        executor=blocking,
+        max_connections=config['max_connections'],
+        keepalive_timeout=config['keepalive_timeout'],
+        body_timeout=config['body_timeout'],
+        max_body=app.config['MAX_CONTENT_LENGTH'],
+        max_wsgi_body=config['max_wsgi_body'],
+        metrics=metrics
+    )
+
+async def serve(host, port, ssl_context=None):
+    server = create_server()
+    listener = await server.start(host, port, ssl=ssl_context)
+    logging.info("Async server listening on %s:%s", host, port)
+    async with listener:
+        await listener.serve_forever()
+
+if __name__ == '__main__':
+    ssl_context = None
+    if config['certfile']:
+        ssl_context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+        ssl_context.load_cert_chain(config['certfile'], config['keyfile'])
+    asyncio.run(serve(config['host'], config['port'], ssl_context))
@@ -0,0 +1,238 @@
+import argparse
+import asyncio
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+def main():
+    parser = argparse.ArgumentParser(
+        description="Many long-lived station connections against the sync (threaded WSGI) and async servers"
+    )
+    parser.add_argument('--mode', choices=['sync', 'async', 'both'], default='both')
+    parser.add_argument('--stations', type=int, default=1000, help="concurrent keep-alive connections")
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--interval', type=float, default=2.0, help="seconds between a station's balance polls")
+    parser.add_argument('--db-latency', type=float, default=0.002, help="added seconds per stand-in query")
+    parser.add_argument('--client', action='store_true', help=argparse.SUPPRESS)
+    parser.add_argument('--port', type=int, help=argparse.SUPPRESS)
+    parser.add_argument('--cookies', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.client:
+        with open(args.cookies) as f:
+            cookies = json.load(f)
+        print(json.dumps(asyncio.run(run_stations(args.port, cookies, args))))
+        return
+
+    workdir = tempfile.mkdtemp(prefix='cafe-async-bench-')
+    app_module = load_app(workdir, args)
+    serializer = app_module.app.session_interface.get_signing_serializer(app_module.app)
+    cookie_name = app_module.app.config['SESSION_COOKIE_NAME']
+    cookies = [f"{cookie_name}={serializer.dumps({'user_id': user_id})}" for user_id in range(1, args.stations + 1)]
+    cookies_path = os.path.join(workdir, 'cookies.json')
+    with open(cookies_path, 'w') as f:
+        json.dump(cookies, f)
+
+    print(f"{args.stations} stations polling every {args.interval}s for {args.duration:.0f}s, "
+          f"{os.cpu_count()} CPUs")
+    modes = ['sync', 'async'] if args.mode == 'both' else [args.mode]
+    for mode in modes:
+        start_server = start_sync_server if mode == 'sync' else start_async_server
+        port, stop = start_server(app_module)
+        sampler = Sampler()
+        try:
+            result = run_client(port, cookies_path, args)
+        finally:
+            sampler.stop()
+            stop()
+        expected = args.stations * args.duration / args.interval
+        print(f"{mode}:")
+        print(f"  connected:      {result['connected']}/{args.stations}  ({result['connect_errors']} refused or failed)")
+        print(f"  balance polls:  {result['polls']:8d}  ({result['polls'] / expected * 100:.0f}% of schedule), "
+              f"{result['errors']} errors")
+        print(f"  reconnects:     {result['reconnects']:8d}")
+        print(f"  latency ms:     p50 {result['p50_ms']}  p95 {result['p95_ms']}  p99 {result['p99_ms']}")
+        print(f"  server threads: peak {sampler.peak_threads}, RSS peak {sampler.peak_rss_mb:.0f} MB")
+
+
+def load_app(workdir, args):
+    from benchmarks.bench_endpoints import load_app as load_endpoints_app
+    # logins are not part of this scenario, so session cookies are minted
+    # directly; a short print time keeps the CUPS stand-in quiet
+    options = argparse.Namespace(users=args.stations, db_latency=args.db_latency, print_time=0.1, no_metrics=False)
+    return load_endpoints_app(workdir, options)
+
+
+def start_sync_server(app_module):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app_module.app, threaded=True)
+    server.socket.listen(1024)
+    thread = threading.Thread(target=server.serve_forever, name='bench-sync', daemon=True)
+    thread.start()
+
+    def stop():
+        server.shutdown()
+        server.server_close()
+    return server.server_port, stop
+
+
+def start_async_server(app_module):
+    import async_app
+    loop = asyncio.new_event_loop()
+    server = async_app.create_server()
+    listener = loop.run_until_complete(server.start('127.0.0.1', 0))
+    thread = threading.Thread(target=loop.run_forever, name='bench-async', daemon=True)
+    thread.start()
+
+    def stop():
+        loop.call_soon_threadsafe(listener.close)
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join()
+    return listener.sockets[0].getsockname()[1], stop
+
+
+def run_client(port, cookies_path, args):
+    command = [
+        sys.executable, os.path.abspath(__file__), '--client',
+        '--port', str(port), '--cookies', cookies_path,
+        '--stations', str(args.stations), '--duration', str(args.duration), '--interval', str(args.interval)
+    ]
+    output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+    return json.loads(output)
+
+
+class Sampler:
+    # peak thread count and resident memory of this (server) process
+    def __init__(self, interval=0.2):
+        self.peak_threads = 0
+        self.peak_rss_mb = 0.0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, args=(interval,), daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        self._thread.join()
+
+    def _run(self, interval):
+        while not self._stop.wait(interval):
+            self.peak_threads = max(self.peak_threads, threading.active_count())
+            self.peak_rss_mb = max(self.peak_rss_mb, rss_mb())
+
+
+def rss_mb():
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return 0.0
+
+
+async def run_stations(port, cookies, args):
+    latencies = []
+    counts = {'connected': 0, 'connect_errors': 0, 'errors': 0, 'reconnects': 0}
+    deadline = time.monotonic() + args.duration
+
+    async def station(cookie):
+        connection = Connection(port)
+        try:
+            await connection.open()
+        except OSError:
+            counts['connect_errors'] += 1
+            return
+        counts['connected'] += 1
+        try:
+            await connection.request('POST', '/start_session', cookie, b'{}')
+            # spread the first polls over one interval
+            await asyncio.sleep(random.uniform(0, args.interval))
+            while time.monotonic() < deadline:
+                start = time.perf_counter()
+                status = await connection.request('GET', '/get_balance', cookie)
+                latencies.append(time.perf_counter() - start)
+                if status != 200:
+                    counts['errors'] += 1
+                await asyncio.sleep(args.interval)
+            await connection.request('POST', '/end_session', cookie, b'{}')
+        except (OSError, asyncio.IncompleteReadError, ValueError):
+            counts['errors'] += 1
+        finally:
+            counts['reconnects'] += connection.reconnects
+            connection.close()
+
+    await asyncio.gather(*(station(cookie) for cookie in cookies))
+    latencies.sort()
+    return dict(
+        counts,
+        polls=len(latencies),
+        p50_ms=percentile(latencies, 50),
+        p95_ms=percentile(latencies, 95),
+        p99_ms=percentile(latencies, 99)
+    )
+
+
+class Connection:
+    # one station's HTTP/1.1 connection; when the server answers with
+    # Connection: close (werkzeug always does) the next request reconnects,
+    # and that connect is part of its latency
+    def __init__(self, port):
+        self.port = port
+        self.reader = self.writer = None
+        self.reconnects = 0
+
+    async def open(self):
+        self.reader, self.writer = await asyncio.open_connection('127.0.0.1', self.port)
+
+    async def request(self, method, path, cookie, body=b''):
+        if self.writer is None:
+            self.reconnects += 1
+            await self.open()
+        head = (
+            f"{method} {path} HTTP/1.1\r\nHost: localhost\r\nCookie: {cookie}\r\n"
+            f"Content-Type: application/json\r\nContent-Length: {len(body)}\r\n\r\n"
+        )
+        self.writer.write(head.encode() + body)
+        await self.writer.drain()
+        response = await self.reader.readuntil(b'\r\n\r\n')
+        lines = response.decode('latin-1').split('\r\n')
+        length = 0
+        keep_alive = True
+        for line in lines[1:]:
+            name, _, value = line.partition(':')
+            name = name.strip().lower()
+            if name == 'content-length':
+                length = int(value)
+            elif name == 'connection' and value.strip().lower() == 'close':
+                keep_alive = False
+        if length:
+            await self.reader.readexactly(length)
+        if not keep_alive:
+            self.close()
+        return int(lines[0].split(' ', 2)[1])
+
+    def close(self):
+        if self.writer:
+            self.writer.close()
+            self.writer = None
+
+
+def percentile(latencies, pct):
+    if not latencies:
+        return None
+    index = min(int(len(latencies) * pct / 100), len(latencies) - 1)
+    return round(latencies[index] * 1000, 2)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+import argparse
+import os
+import random
+import subprocess
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.config import Config
+from services.domain_filter import DomainPolicy, normalize
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TLDS = ['com', 'org', 'net', 'edu', 'gov', 'io', 'co.uk', 'de', 'info']
+WORDS = ['mail', 'news', 'shop', 'video', 'cdn', 'api', 'static', 'login', 'img', 'blog', 'app', 'm']
+
+
+def naive_is_allowed(host, allowed, blocked):
+    # what evaluating the lists directly looks like: scan both per request
+    host = normalize(host)
+    for domain in blocked:
+        if host == domain or host.endswith('.' + domain):
+            return False
+    return any(host == domain or host.endswith('.' + domain) for domain in allowed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Domain policy lookups over a hostname corpus")
+    parser.add_argument('--hosts', type=int, default=1000000)
+    parser.add_argument('--sites', type=int, default=50000, help="distinct registered domains in the corpus")
+    parser.add_argument('--blocklist', type=int, default=20000, help="extra synthetic blocked domains")
+    parser.add_argument('--naive-sample', type=int, default=20000)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    sites = [f'site{i}.{rng.choice(TLDS)}' for i in range(args.sites)]
+    blocked = list(Config.PROXY_CONFIG['blocked_domains']) + rng.sample(sites, min(args.blocklist, len(sites)))
+    allowed = Config.PROXY_CONFIG['allowed_domains']
+    # browsing is heavily skewed towards a few sites
+    weights = [1 / (rank + 1) for rank in range(len(sites))]
+    picks = rng.choices(sites, weights, k=args.hosts)
+    corpus = [f'{rng.choice(WORDS)}.{site}' if rng.random() < 0.7 else site for site in picks]
+
+    start = time.perf_counter()
+    policy = DomainPolicy(allowed, blocked)
+    compile_time = time.perf_counter() - start
+
+    sample = corpus[:args.naive_sample]
+    start = time.perf_counter()
+    expected = [naive_is_allowed(host, allowed, blocked) for host in sample]
+    naive = (time.perf_counter() - start) / len(sample)
+
+    uncached = DomainPolicy(allowed, blocked, cache_size=0)
+    start = time.perf_counter()
+    for host in corpus:
+        uncached.is_allowed(host)
+    trie = (time.perf_counter() - start) / len(corpus)
+
+    start = time.perf_counter()
+    verdicts = [policy.is_allowed(host) for host in corpus]
+    cached = (time.perf_counter() - start) / len(corpus)
+
+    if verdicts[:len(sample)] != expected:
+        print("MISMATCH: trie verdicts differ from the list scan")
+        sys.exit(1)
+
+    lines = ''.join(f'{i % 100} {host}\n' for i, host in enumerate(corpus)).encode()
+    start = time.perf_counter()
+    output = subprocess.run(
+        [sys.executable, os.path.join(ROOT, 'services', 'domain_filter.py')],
+        input=lines, capture_output=True, check=True
+    ).stdout
+    helper = time.perf_counter() - start
+    if output.count(b'\n') != len(corpus):
+        print("MISMATCH: helper did not answer every request")
+        sys.exit(1)
+
+    stats = policy.stats()
+    print(f"corpus:               {len(corpus)} hosts, {len(blocked)} blocked domains")
+    print(f"compile:              {compile_time * 1000:8.1f} ms")
+    print(f"list scan:            {naive * 1e6:8.2f} us/lookup (on {len(sample)} hosts)")
+    print(f"trie, no cache:       {trie * 1e6:8.2f} us/lookup")
+    print(f"trie + LRU:           {cached * 1e6:8.2f} us/lookup (hit rate {stats['hit_rate']:.1%})")
+    print(f"squid helper (pipe):  {len(corpus) / helper:8.0f} lookups/s end to end (config lists)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,291 @@
+import argparse
+import http.client
+import json
+import logging
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.standins import StandInCups, StandInDatabase
+
+ROUTES = ['/login', '/start_session', '/get_balance', '/print', '/end_session']
+# statuses that mean the route did its job; 503 is load shedding, counted apart
+EXPECTED = {
+    '/login': (200,),
+    '/start_session': (200,),
+    '/get_balance': (200, 304),
+    '/print': (200, 202),
+    '/end_session': (200,)
+}
+PDF = (
+    b"%PDF-1.4\n1 0 obj << /Type /Catalog /Pages 2 0 R >> endobj\n"
+    b"2 0 obj << /Type /Pages /Kids [3 0 R] /Count 1 >> endobj\n"
+    b"3 0 obj << /Type /Page /Parent 2 0 R /MediaBox [0 0 595 842] >> endobj\n"
+    b"trailer << /Root 1 0 R >>\n%%EOF\n"
+)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test app.py routes against MySQL/CUPS stand-ins")
+    parser.add_argument('--users', type=int, default=16, help="concurrent virtual users")
+    parser.add_argument('--duration', type=float, default=20.0)
+    parser.add_argument('--balance-polls', type=int, default=10, help="/get_balance calls per session")
+    parser.add_argument('--conditional', action='store_true', help="poll the balance with If-None-Match")
+    parser.add_argument('--print-ratio', type=float, default=0.2, help="chance of a print after each poll")
+    parser.add_argument('--think', type=float, default=0.05, help="mean pause between a user's requests")
+    parser.add_argument('--db-latency', type=float, default=0.001, help="added seconds per stand-in query")
+    parser.add_argument('--print-time', type=float, default=0.5, help="seconds a stand-in print job takes")
+    parser.add_argument('--no-metrics', action='store_true', help="run without /metrics instrumentation")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="results file (default benchmarks/results/endpoints-<time>.json)")
+    parser.add_argument('--compare', help="earlier results file to compare against")
+    parser.add_argument('--threshold', type=float, default=10.0, help="percent change flagged as a regression")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix='cafe-bench-')
+    app_module = load_app(workdir, args)
+    server = start_server(app_module.app)
+    port = server.server_port
+
+    stop = threading.Event()
+    samples = []
+    lock = threading.Lock()
+
+    def record(route, status, elapsed):
+        with lock:
+            samples.append((route, status, elapsed))
+
+    users = [
+        threading.Thread(target=virtual_user, args=(port, user_id, args, stop, record, random.Random(args.seed + user_id)))
+        for user_id in range(1, args.users + 1)
+    ]
+    start = time.perf_counter()
+    for user in users:
+        user.start()
+    time.sleep(args.duration)
+    stop.set()
+    for user in users:
+        user.join()
+    elapsed = time.perf_counter() - start
+    server.shutdown()
+
+    results = summarize(samples, elapsed, args)
+    print_results(results)
+    output = args.output or os.path.join(
+        ROOT, 'benchmarks', 'results', time.strftime('endpoints-%Y%m%d-%H%M%S.json')
+    )
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"results saved to {output}")
+
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if compare(baseline, results, args.threshold):
+            sys.exit(1)
+
+
+def load_app(workdir, args):
+    # app.py reads its configuration and creates its spool, logs and ledger
+    # journal relative to the working directory at import time
+    from config.config import Config
+
+    users = range(1, args.users + 1)
+    database = StandInDatabase(os.path.join(workdir, 'cafe.db'), users, latency=args.db_latency)
+    cups = StandInCups(print_time=args.print_time)
+    Config.DB_CONNECT = database.connect
+    Config.CUPS_CONNECT = cups.connect
+    Config.RATELIMIT_ENABLED = False
+    Config.SESSION_COOKIE_SECURE = False
+    # the instrumentation overhead is the difference between a run with
+    # and a run without it (see --compare)
+    Config.METRICS = dict(Config.METRICS, enabled=not args.no_metrics)
+
+    os.chdir(workdir)
+    import app as app_module
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+
+    from werkzeug.security import generate_password_hash
+    password_hash = generate_password_hash('password')
+    for user_id in users:
+        app_module.USERS[f'user{user_id}@bench.local'] = {'id': user_id, 'password_hash': password_hash}
+    return app_module
+
+
+def start_server(app):
+    from werkzeug.serving import make_server
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    return server
+
+
+def virtual_user(port, user_id, args, stop, record, rng):
+    # login, start a session, poll the balance with the odd print job,
+    # end the session; repeated until the run is over
+    client = Client(port, record)
+    while not stop.is_set():
+        status = client.post_json('/login', {'email': f'user{user_id}@bench.local', 'password': 'password'})
+        if status != 200:
+            stop.wait(0.5)
+            continue
+        client.post_json('/start_session', {})
+        for _ in range(args.balance_polls):
+            if stop.wait(rng.expovariate(1 / args.think) if args.think else 0):
+                break
+            client.get('/get_balance', conditional=args.conditional)
+            if rng.random() < args.print_ratio:
+                # unique bytes, so the spool's duplicate check does not short-circuit
+                document = PDF + f'% {uuid.uuid4()}\n'.encode()
+                client.post_file('/print', document, {'printer': rng.choice(['Office', 'Lab'])})
+        client.post_json('/end_session', {})
+        client.request('POST', '/logout', b'', {}, record_as=None)
+
+
+class Client:
+    def __init__(self, port, record):
+        self.port = port
+        self.record = record
+        self.cookie = None
+        self.etags = {}
+
+    def get(self, path, conditional=False):
+        headers = {}
+        if conditional and path in self.etags:
+            headers['If-None-Match'] = self.etags[path]
+        return self.request('GET', path, None, headers)
+
+    def post_json(self, path, data):
+        return self.request('POST', path, json.dumps(data).encode(), {'Content-Type': 'application/json'})
+
+    def post_file(self, path, content, fields):
+        boundary = uuid.uuid4().hex
+        parts = [
+            f'--{boundary}\r\nContent-Disposition: form-data; name="{name}"\r\n\r\n{value}\r\n'.encode()
+            for name, value in fields.items()
+        ]
+        parts.append(
+            f'--{boundary}\r\nContent-Disposition: form-data; name="file"; filename="doc.pdf"\r\n'
+            f'Content-Type: application/pdf\r\n\r\n'.encode() + content + b'\r\n'
+        )
+        parts.append(f'--{boundary}--\r\n'.encode())
+        return self.request('POST', path, b''.join(parts), {'Content-Type': f'multipart/form-data; boundary={boundary}'})
+
+    def request(self, method, path, body, headers, record_as=''):
+        if self.cookie:
+            headers = dict(headers, Cookie=self.cookie)
+        conn = http.client.HTTPConnection('127.0.0.1', self.port, timeout=60)
+        start = time.perf_counter()
+        try:
+            conn.request(method, path, body, headers)
+            response = conn.getresponse()
+            response.read()
+            status = response.status
+            cookie = response.getheader('Set-Cookie')
+            if cookie:
+                self.cookie = cookie.split(';', 1)[0]
+            etag = response.getheader('ETag')
+            if etag:
+                self.etags[path] = etag
+        except (OSError, http.client.HTTPException):
+            status = 0
+        finally:
+            conn.close()
+        if record_as is not None:
+            self.record(record_as or path, status, time.perf_counter() - start)
+        return status
+
+
+def summarize(samples, elapsed, args):
+    routes = {}
+    for route in ROUTES:
+        latencies = sorted(sample[2] for sample in samples if sample[0] == route)
+        statuses = [sample[1] for sample in samples if sample[0] == route]
+        ok = sum(1 for status in statuses if status in EXPECTED[route])
+        rejected = statuses.count(503)
+        routes[route] = {
+            'requests': len(statuses),
+            'ok': ok,
+            'rejected': rejected,
+            'errors': len(statuses) - ok - rejected,
+            'throughput': round(ok / elapsed, 2),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99)
+        }
+    return {
+        'meta': {
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'cpus': os.cpu_count(),
+            'elapsed': round(elapsed, 2),
+            'args': {key: value for key, value in vars(args).items() if key not in ('output', 'compare')}
+        },
+        'total': {
+            'requests': len(samples),
+            'throughput': round(sum(route['ok'] for route in routes.values()) / elapsed, 2)
+        },
+        'routes': routes
+    }
+
+
+def percentile(latencies, pct):
+    if not latencies:
+        return None
+    index = min(int(len(latencies) * pct / 100), len(latencies) - 1)
+    return round(latencies[index] * 1000, 2)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ['git', '-C', ROOT, 'rev-parse', '--short', 'HEAD'],
+            capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def print_results(results):
+    print(f"{results['meta']['args']['users']} users for {results['meta']['elapsed']}s: "
+          f"{results['total']['throughput']} ok requests/s")
+    print(f"{'route':15} {'ok':>7} {'503':>5} {'err':>5} {'req/s':>8} {'p50 ms':>8} {'p95 ms':>8} {'p99 ms':>8}")
+    for route, stats in results['routes'].items():
+        print(f"{route:15} {stats['ok']:7} {stats['rejected']:5} {stats['errors']:5} {stats['throughput']:8} "
+              f"{fmt(stats['p50_ms'])} {fmt(stats['p95_ms'])} {fmt(stats['p99_ms'])}")
+
+
+def fmt(value):
+    return f"{value:8.2f}" if value is not None else f"{'-':>8}"
+
+
+def compare(baseline, results, threshold):
+    # flags a route whose p99 grew, or whose throughput fell, by more
+    # than threshold percent; returns True if any did
+    regressed = False
+    print(f"compared with {baseline['meta'].get('commit')} ({baseline['meta']['timestamp']}):")
+    for route, stats in results['routes'].items():
+        before = baseline['routes'].get(route)
+        if not before or not before['p99_ms'] or not stats['p99_ms'] or not before['throughput']:
+            continue
+        p99_change = (stats['p99_ms'] - before['p99_ms']) / before['p99_ms'] * 100
+        throughput_change = (stats['throughput'] - before['throughput']) / before['throughput'] * 100
+        flag = p99_change > threshold or throughput_change < -threshold
+        regressed = regressed or flag
+        print(f"  {route:15} p99 {p99_change:+7.1f}%  throughput {throughput_change:+7.1f}%"
+              f"{'  REGRESSION' if flag else ''}")
+    return regressed
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,99 @@
+import argparse
+import json
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.station_table import StationTable
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-heartbeat cost of the station table")
+    parser.add_argument('--stations', type=int, default=500)
+    parser.add_argument('--heartbeats', type=int, default=100000)
+    parser.add_argument('--events', type=float, default=0.1, help="average events per heartbeat")
+    parser.add_argument('--threads', type=int, default=4, help="concurrent senders in the contended run")
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args()
+
+    rng = random.Random(1)
+    bodies = []
+    seqs = {}
+    event_ids = {}
+    for _ in range(args.heartbeats):
+        station = f"station-{rng.randrange(args.stations)}"
+        seqs[station] = seqs.get(station, 0) + 1
+        events = []
+        while rng.random() < args.events / (1 + args.events) and len(events) < 5:
+            event_ids[station] = event_ids.get(station, 0) + 1
+            events.append([event_ids[station], 'reconnected', time.time(), {'offline_seconds': 12}])
+        bodies.append((station, json.dumps({
+            'station': station,
+            'boot': 'b0',
+            'seq': seqs[station],
+            'session': {'active': True, 'id': 'abc-1', 'elapsed': 1234.5},
+            'events': events
+        }).encode()))
+    decoded = [(station, json.loads(body)) for station, body in bodies]
+
+    def fold(table, beats):
+        def run():
+            for station, beat in beats:
+                table.heartbeat(station, '10.0.0.1', 7, beat)
+        return run
+
+    def fresh_table():
+        table = StationTable(max_stations=args.stations, new_station_burst=args.stations)
+        fold(table, decoded)()
+        return table
+
+    table = fresh_table()
+    fold_time = best_of(args.repeat, lambda: (reset(table), fold(table, decoded)()))
+    decode_time = best_of(args.repeat, lambda: [json.loads(body) for _, body in bodies])
+
+    table = fresh_table()
+    chunks = [decoded[i::args.threads] for i in range(args.threads)]
+
+    def contended():
+        reset(table)
+        threads = [threading.Thread(target=fold(table, chunk)) for chunk in chunks]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+    contended_time = best_of(args.repeat, contended)
+    snapshot_time = best_of(args.repeat, table.snapshot)
+
+    size = sum(len(body) for _, body in bodies) / len(bodies)
+    print(f"{args.stations} stations, {args.heartbeats} heartbeats of {size:.0f} bytes on average")
+    print(f"heartbeat():            {fold_time / args.heartbeats * 1e6:8.2f} us/heartbeat")
+    print(f"  + JSON decode:        {(fold_time + decode_time) / args.heartbeats * 1e6:8.2f} us/heartbeat")
+    print(f"{args.threads} threads:              {contended_time / args.heartbeats * 1e6:8.2f} us/heartbeat")
+    print(f"snapshot():             {snapshot_time * 1000:8.2f} ms")
+    print(f"interval handed out:    {table.stats()['interval']:8.1f} s")
+
+
+def reset(table):
+    # each replay repeats the same sequence numbers and event ids, which
+    # would otherwise count as stale heartbeats and duplicate events
+    for station in table._stations.values():
+        station.seq = 0
+        station.last_event_id = 0
+
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    main()
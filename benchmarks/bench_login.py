@@ -0,0 +1,118 @@
+import argparse
+import http.client
+import json
+import logging
+import os
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from flask import Flask, jsonify, request
+from werkzeug.security import check_password_hash, generate_password_hash
+from werkzeug.serving import make_server
+
+from security.password_pool import PasswordHasher, HasherBusy
+
+
+def build_app(hasher, password_hash):
+    # the KDF on its own is enough to reproduce the problem, so this skips
+    # Auth (and its jwt import) and calls the hasher the same way it does
+    app = Flask(__name__)
+
+    @app.route('/login', methods=['POST'])
+    def login():
+        password = request.json['password']
+        try:
+            if hasher:
+                ok = hasher.verify(password_hash, password).result(hasher.timeout)
+            else:
+                ok = check_password_hash(password_hash, password)
+        except HasherBusy:
+            return jsonify({'error': 'Server busy, try again'}), 503
+        return jsonify({'status': 'success'}) if ok else (jsonify({'error': 'Invalid credentials'}), 401)
+
+    @app.route('/get_balance')
+    def get_balance():
+        return jsonify({'balance': 12.5})
+
+    return app
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Login throughput and latency of other routes during a login burst")
+    parser.add_argument('--duration', type=float, default=5.0)
+    parser.add_argument('--login-clients', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 2)
+    parser.add_argument('--max-pending', type=int, default=16)
+    args = parser.parse_args()
+
+    logging.getLogger('werkzeug').setLevel(logging.ERROR)
+    password_hash = generate_password_hash('password')
+    # forked before the server thread exists
+    hasher = PasswordHasher(workers=args.workers, max_pending=args.max_pending)
+
+    print(f"{args.login_clients} login clients for {args.duration:.0f}s, {os.cpu_count()} CPUs")
+    for label, mode_hasher in (('inline KDF', None), ('worker pool', hasher)):
+        result = run(build_app(mode_hasher, password_hash), args)
+        print(f"{label}:")
+        print(f"  logins:       {result['logins'] / args.duration:8.1f}/s  ({result['rejected']} rejected with 503)")
+        print(f"  /get_balance: p50 {result['p50'] * 1000:8.2f} ms   p99 {result['p99'] * 1000:8.2f} ms"
+              f"   ({result['probes']} requests)")
+    hasher.close()
+
+
+def run(app, args):
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    port = server.server_port
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+
+    stop = threading.Event()
+    counts = {'logins': 0, 'rejected': 0}
+    lock = threading.Lock()
+    latencies = []
+
+    def login_client():
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        body = json.dumps({'email': 'test@example.com', 'password': 'password'})
+        while not stop.is_set():
+            conn.request('POST', '/login', body, {'Content-Type': 'application/json'})
+            response = conn.getresponse()
+            response.read()
+            with lock:
+                counts['logins' if response.status == 200 else 'rejected'] += 1
+            if response.status == 503:
+                time.sleep(0.05)
+
+    def probe():
+        conn = http.client.HTTPConnection('127.0.0.1', port)
+        while not stop.is_set():
+            start = time.perf_counter()
+            conn.request('GET', '/get_balance')
+            conn.getresponse().read()
+            latencies.append(time.perf_counter() - start)
+            time.sleep(0.01)
+
+    threads = [threading.Thread(target=login_client) for _ in range(args.login_clients)]
+    threads.append(threading.Thread(target=probe))
+    for thread in threads:
+        thread.start()
+    time.sleep(args.duration)
+    stop.set()
+    for thread in threads:
+        thread.join()
+    server.shutdown()
+
+    latencies.sort()
+    return {
+        'logins': counts['logins'],
+        'rejected': counts['rejected'],
+        'probes': len(latencies),
+        'p50': latencies[len(latencies) // 2],
+        'p99': latencies[min(int(len(latencies) * 0.99), len(latencies) - 1)]
+    }
+
+
+if __name__ == '__main__':
+    main()
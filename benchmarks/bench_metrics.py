@@ -0,0 +1,90 @@
+import argparse
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.metrics import Metrics
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Cost of recording metrics and of rendering /metrics")
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--processes', type=int, default=8, help="worker files merged by render()")
+    parser.add_argument('--routes', type=int, default=20)
+    args = parser.parse_args()
+
+    directory = tempfile.mkdtemp(prefix='cafe-metrics-')
+    metrics = Metrics(directory, flush_interval=0)
+    labels = (('route', '/get_balance'), ('method', 'GET'))
+    calls = range(args.calls)
+
+    def observe():
+        for _ in calls:
+            metrics.observe('cafe_http_request_duration_seconds', labels, 0.004)
+
+    def request_hooks():
+        # what the before/after/teardown hooks in app.py do per request
+        for _ in calls:
+            start = time.perf_counter()
+            metrics.add('cafe_http_requests_in_flight', (('route', '/get_balance'),), 1)
+            metrics.observe('cafe_http_request_duration_seconds', labels, time.perf_counter() - start)
+            metrics.inc('cafe_http_requests_total', labels + (('status', '200'),))
+            metrics.add('cafe_http_requests_in_flight', (('route', '/get_balance'),), -1)
+
+    observe_time = best_of(args.repeat, observe)
+    hooks_time = best_of(args.repeat, request_hooks)
+
+    conn = sqlite3.connect(':memory:')
+    timed = metrics.timed_database(lambda: sqlite3.connect(':memory:'))()
+    query_calls = range(args.calls // 10)
+
+    def query(connection):
+        def run():
+            cursor = connection.cursor()
+            for _ in query_calls:
+                cursor.execute("SELECT 1")
+                cursor.fetchone()
+        return run
+
+    raw_query = best_of(args.repeat, query(conn))
+    timed_query = best_of(args.repeat, query(timed))
+
+    # other workers' files, each with every route and both dependencies
+    for pid in range(1, args.processes + 1):
+        other = Metrics(None, flush_interval=0)
+        for route in range(args.routes):
+            route_labels = (('route', f'/route{route}'), ('method', 'GET'))
+            other.observe('cafe_http_request_duration_seconds', route_labels, 0.01)
+            other.inc('cafe_http_requests_total', route_labels + (('status', '200'),))
+        other.observe('cafe_dependency_duration_seconds', (('dependency', 'mysql'), ('operation', 'select')), 0.002)
+        other.directory = directory
+        other.flush()
+        os.rename(os.path.join(directory, f'{os.getpid()}.json'), os.path.join(directory, f'{10 ** 6 + pid}.json'))
+    render_time = best_of(args.repeat, metrics.render)
+
+    print(f"observe():              {observe_time / args.calls * 1e9:8.0f} ns/call")
+    print(f"per-request hooks:      {hooks_time / args.calls * 1e9:8.0f} ns/request")
+    print(f"SELECT 1 (sqlite):      {raw_query / len(query_calls) * 1e9:8.0f} ns/query")
+    print(f"SELECT 1 timed:         {timed_query / len(query_calls) * 1e9:8.0f} ns/query "
+          f"(+{(timed_query - raw_query) / len(query_calls) * 1e9:.0f} ns)")
+    print(f"render(), {args.processes} processes: {render_time * 1000:8.2f} ms "
+          f"({len(metrics.render().splitlines())} lines)")
+
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    main()
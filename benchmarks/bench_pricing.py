@@ -0,0 +1,60 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config.config import Config
+from services.pricing import PricingEngine
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Scalar vs vectorized session pricing")
+    parser.add_argument('--sessions', type=int, default=100000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = np.random.default_rng(args.seed)
+    # mostly short sessions with a long tail past the hourly and daily tiers
+    durations = rng.exponential(75, args.sessions)
+    durations[:args.sessions // 100] *= 30
+    user_ids = rng.integers(1, 500, args.sessions)
+    start_times = time.time() - rng.uniform(0, 86400, args.sessions)
+
+    engine = PricingEngine(Config.BILLING_RATES)
+    tariff_engine = PricingEngine(Config.BILLING_RATES, tariff=[(22, 6, 0.8), (17, 22, 1.25)])
+
+    duration_list = durations.tolist()
+    scalar = best_of(args.repeat, lambda: [engine.price(d) for d in duration_list])
+    batch = best_of(args.repeat, lambda: engine.price_batch(durations))
+    tariff = best_of(args.repeat, lambda: tariff_engine.price_batch(durations, start_times))
+    by_user = best_of(args.repeat, lambda: engine.price_by_user(user_ids, durations))
+
+    expected = np.array([engine.price(d) for d in duration_list])
+    if not np.array_equal(expected, engine.price_batch(durations)):
+        print("MISMATCH: vectorized costs differ from the scalar path")
+        sys.exit(1)
+
+    print(f"sessions:            {args.sessions}")
+    print(f"scalar loop:         {scalar * 1000:9.2f} ms")
+    print(f"price_batch:         {batch * 1000:9.2f} ms  ({scalar / batch:.1f}x)")
+    print(f"price_batch+tariff:  {tariff * 1000:9.2f} ms")
+    print(f"price_by_user:       {by_user * 1000:9.2f} ms")
+
+
+def best_of(repeat, fn):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,131 @@
+import argparse
+import multiprocessing
+import os
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.shared_window import SharedWindowTable
+
+
+class LockedDict:
+    # what memory:// amounts to: a per-process dict behind a lock
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counts = {}
+
+    def acquire(self, key, window, limit, amount=1):
+        with self.lock:
+            count = self.counts.get(key, 0)
+            if count + amount > limit:
+                return False
+            self.counts[key] = count + amount
+            return True
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-request overhead of the shared-memory limiter storage")
+    parser.add_argument('--calls', type=int, default=200000)
+    parser.add_argument('--keys', type=int, default=1000)
+    parser.add_argument('--processes', type=int, default=4)
+    parser.add_argument('--limit', type=int, default=500)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'ratelimit.shm')
+        table = SharedWindowTable(path)
+        keys = [f'LIMITER/10.0.{i // 256}.{i % 256}/login/5/1/minute' for i in range(args.keys)]
+
+        baseline = LockedDict()
+        locked = per_call(args.calls, lambda i: baseline.acquire(keys[i % args.keys], 60, 1 << 30))
+        acquire = per_call(args.calls, lambda i: table.acquire(keys[i % args.keys], 60, 1 << 30))
+        read = per_call(args.calls, lambda i: table.window(keys[i % args.keys], 60))
+        hit = per_call(args.calls, lambda i: table.hit(keys[i % args.keys], 60))
+
+        print(f"calls:                   {args.calls} over {args.keys} keys")
+        print(f"dict + lock (memory://): {locked * 1e6:7.2f} us/call")
+        print(f"shm acquire (moving):    {acquire * 1e6:7.2f} us/call")
+        print(f"shm window (lock-free):  {read * 1e6:7.2f} us/call")
+        print(f"shm hit (fixed):         {hit * 1e6:7.2f} us/call")
+
+        storage = limits_storage(path)
+        if storage:
+            from limits import parse
+            from limits.storage import MemoryStorage
+            from limits.strategies import MovingWindowRateLimiter
+            item = parse('1000000 per minute')
+            shm_limiter = MovingWindowRateLimiter(storage)
+            memory_limiter = MovingWindowRateLimiter(MemoryStorage())
+            calls = args.calls // 10
+            shm = per_call(calls, lambda i: shm_limiter.hit(item, keys[i % args.keys]))
+            memory = per_call(calls, lambda i: memory_limiter.hit(item, keys[i % args.keys]))
+            print(f"limits hit, memory://:   {memory * 1e6:7.2f} us/call")
+            print(f"limits hit, shm://:      {shm * 1e6:7.2f} us/call")
+
+        # distinct keys measure cross-process throughput; on the hot key,
+        # exactly `limit` hits may be granted across all processes
+        table.reset()
+        per_process = args.calls // args.processes
+        for label, hot in (('distinct keys', False), ('one hot key', True)):
+            granted, elapsed = contend(path, args.processes, per_process, args.limit if hot else None, keys)
+            total = per_process * args.processes
+            print(f"{args.processes} processes, {label + ':':14} {total / elapsed:10.0f} calls/s, granted {granted}")
+            if hot and granted != args.limit:
+                print(f"MISMATCH: {granted} hits granted against a limit of {args.limit}")
+                sys.exit(1)
+        table.close()
+
+
+def per_call(calls, fn):
+    start = time.perf_counter()
+    for i in range(calls):
+        fn(i)
+    return (time.perf_counter() - start) / calls
+
+
+def contend(path, processes, calls, limit, keys):
+    ctx = multiprocessing.get_context('fork')
+    results = ctx.Queue()
+    start_event = ctx.Event()
+    workers = [
+        ctx.Process(target=worker, args=(path, calls, limit, keys, n, start_event, results))
+        for n in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    start = time.perf_counter()
+    start_event.set()
+    granted = sum(results.get() for _ in workers)
+    elapsed = time.perf_counter() - start
+    for process in workers:
+        process.join()
+    return granted, elapsed
+
+
+def worker(path, calls, limit, keys, n, start_event, results):
+    table = SharedWindowTable(path)
+    start_event.wait()
+    granted = 0
+    if limit is None:
+        for i in range(calls):
+            granted += table.acquire(keys[(i + n) % len(keys)], 60, 1 << 30)
+    else:
+        for _ in range(calls):
+            granted += table.acquire('hot', 86400, limit)
+    results.put(granted)
+
+
+def limits_storage(path):
+    try:
+        from services.rate_limit_storage import SharedMemoryStorage
+    except ImportError:
+        print("limits is not installed; skipping the storage-level comparison")
+        return None
+    return SharedMemoryStorage('shm://' + path)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,67 @@
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# runs in a fresh interpreter per sample so module caches do not carry over
+PROBE = """
+import json, sys, time
+t0 = time.perf_counter()
+import config.config
+config.config.Config.SERVICE_WARMUP = {warmup}
+import app
+t1 = time.perf_counter()
+client = app.app.test_client()
+response = client.get('/ready')
+t2 = time.perf_counter()
+while response.status_code != 200 and time.perf_counter() - t0 < {ready_timeout}:
+    time.sleep(0.01)
+    response = client.get('/ready')
+t3 = time.perf_counter()
+print(json.dumps({{
+    'import': t1 - t0,
+    'first_request': t2 - t1,
+    'import_to_first_response': t2 - t0,
+    'ready': t3 - t0 if response.status_code == 200 else None
+}}))
+sys.stdout.flush()
+"""
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Import-to-first-request latency of app.py")
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--no-warmup', action='store_true', help="build services on first use only")
+    parser.add_argument('--ready-timeout', type=float, default=30.0)
+    args = parser.parse_args()
+
+    code = PROBE.format(warmup=not args.no_warmup, ready_timeout=args.ready_timeout)
+    samples = []
+    for _ in range(args.runs):
+        result = subprocess.run(
+            [sys.executable, '-c', code],
+            cwd=ROOT,
+            capture_output=True,
+            text=True
+        )
+        if result.returncode != 0:
+            print(result.stderr)
+            sys.exit(result.returncode)
+        samples.append(json.loads(result.stdout.strip().splitlines()[-1]))
+
+    print(f"runs: {args.runs}  warmup: {not args.no_warmup}")
+    for key in ('import', 'first_request', 'import_to_first_response', 'ready'):
+        values = [sample[key] for sample in samples if sample[key] is not None]
+        if not values:
+            print(f"{key:26s} never")
+            continue
+        print(f"{key:26s} median {statistics.median(values) * 1000:8.1f} ms"
+              f"  max {max(values) * 1000:8.1f} ms  ({len(values)}/{len(samples)})")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,155 @@
+import itertools
+import sqlite3
+import threading
+import time
+
+# In-process stand-ins for MySQL and CUPS, for driving app.py without either
+# server. They implement only what the services call, with the same
+# semantics, so the app's own code paths (pool, ledger, caches, CUPS state
+# polling) are what gets measured.
+
+SCHEMA = """
+    CREATE TABLE IF NOT EXISTS users (
+        id INTEGER PRIMARY KEY,
+        credit_balance NUMERIC NOT NULL DEFAULT 0
+    );
+    CREATE TABLE IF NOT EXISTS billing (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        user_id INTEGER NOT NULL,
+        amount NUMERIC NOT NULL,
+        description TEXT,
+        transaction_type TEXT,
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        ledger_key TEXT UNIQUE
+    );
+    CREATE INDEX IF NOT EXISTS billing_user_created ON billing (user_id, created_at, id);
+"""
+
+
+class StandInDatabase:
+    # a sqlite file behind a DB-API shim that accepts mysql.connector's
+    # %s placeholders and dictionary/buffered cursor arguments;
+    # database.connect is the zero-argument factory for BillingService
+    def __init__(self, path, users=(), balance=1000.0, latency=0.0):
+        self.path = path
+        self.latency = latency
+        conn = sqlite3.connect(path)
+        conn.executescript(SCHEMA)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.executemany(
+            "INSERT OR REPLACE INTO users (id, credit_balance) VALUES (?, ?)",
+            [(user_id, balance) for user_id in users]
+        )
+        conn.commit()
+        conn.close()
+
+    def connect(self):
+        return _Connection(sqlite3.connect(
+            self.path, timeout=30, check_same_thread=False, detect_types=sqlite3.PARSE_DECLTYPES
+        ), self.latency)
+
+
+class _Connection:
+    def __init__(self, conn, latency):
+        self._conn = conn
+        self._latency = latency
+
+    def cursor(self, dictionary=False, buffered=True):
+        return _Cursor(self._conn.cursor(), dictionary, self._latency)
+
+    def commit(self):
+        self._conn.commit()
+
+    def rollback(self):
+        self._conn.rollback()
+
+    def close(self):
+        self._conn.close()
+
+
+class _Cursor:
+    def __init__(self, cursor, dictionary, latency):
+        self._cursor = cursor
+        self._dictionary = dictionary
+        self._latency = latency
+
+    def execute(self, query, params=()):
+        if self._latency:
+            # a network round trip to the database server
+            time.sleep(self._latency)
+        self._cursor.execute(query.replace('%s', '?'), tuple(params))
+
+    def executemany(self, query, rows):
+        if self._latency:
+            time.sleep(self._latency)
+        self._cursor.executemany(query.replace('%s', '?'), rows)
+
+    def fetchone(self):
+        row = self._cursor.fetchone()
+        return self._row(row) if row is not None else None
+
+    def fetchmany(self, size):
+        return [self._row(row) for row in self._cursor.fetchmany(size)]
+
+    def fetchall(self):
+        return [self._row(row) for row in self._cursor.fetchall()]
+
+    def close(self):
+        self._cursor.close()
+
+    def _row(self, row):
+        if not self._dictionary:
+            return row
+        return {column[0]: value for column, value in zip(self._cursor.description, row)}
+
+
+class StandInCups:
+    # pycups Connection look-alike shared by every connection it hands
+    # out; jobs complete print_time seconds after they are submitted
+    def __init__(self, printers=('Office', 'Lab'), print_time=0.5):
+        self.printers = {
+            name: {'printer-state': 3, 'printer-info': name, 'device-uri': f'ipp://localhost/printers/{name}'}
+            for name in printers
+        }
+        self.print_time = print_time
+        self._lock = threading.Lock()
+        self._jobs = {}  # job id -> (printer, submitted_at)
+        self._ids = itertools.count(1)
+
+    def connect(self):
+        return self
+
+    def getPrinters(self):
+        return dict(self.printers)
+
+    def printFile(self, printer, filename, title, options):
+        if printer not in self.printers:
+            raise RuntimeError(f"client-error-not-found: {printer}")
+        with self._lock:
+            job_id = next(self._ids)
+            self._jobs[job_id] = (printer, time.time())
+        return job_id
+
+    def getJobs(self, which_jobs='not-completed', requested_attributes=None):
+        now = time.time()
+        with self._lock:
+            jobs = {job_id: self._attributes(job_id, now) for job_id in self._jobs}
+        if which_jobs == 'not-completed':
+            return {job_id: attrs for job_id, attrs in jobs.items() if attrs['job-state'] < 7}
+        return jobs
+
+    def getJobAttributes(self, job_id, requested_attributes=None):
+        with self._lock:
+            if job_id not in self._jobs:
+                raise RuntimeError(f"client-error-not-found: job {job_id}")
+            return self._attributes(job_id, time.time())
+
+    def _attributes(self, job_id, now):
+        printer, submitted_at = self._jobs[job_id]
+        return {
+            'job-id': job_id,
+            'job-state': 9 if now - submitted_at >= self.print_time else 5,
+            'job-printer-uri': f'ipp://localhost/printers/{printer}',
+            'job-name': f'job-{job_id}',
+            'job-k-octets': 1
+        }
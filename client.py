@@ -1,11 +1,19 @@
 import tkinter as tk
 from tkinter import ttk, messagebox, simpledialog
 import requests
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection
 import threading
+import itertools
+import queue
 import re
 import logging
 import json
 import os
+import random
+import socket
+import time
+import uuid
 from datetime import datetime
 import urllib3
 import configparser
@@ -28,7 +36,8 @@ class ConfigManager:
         'Server': {
             'url': 'https://192.168.107.20:5000',
             'timeout': '10',
-            'verify_ssl': 'False'
+            'verify_ssl': 'False',
+            'workers': '2'
         },
         'Billing': {
             'rate_per_minute': '0.05',
@@ -36,8 +45,23 @@ class ConfigManager:
         },
         'UI': {
             'window_width': '400',
-            'window_height': '350',
+            'window_height': '380',
             'font_size': '12'
+        },
+        'Station': {
+            'id': '',
+            # station_token(STATION_KEY, id) from the server, so heartbeats
+            # are accepted while nobody is logged in
+            'token': ''
+        },
+        'Heartbeat': {
+            'enabled': 'True',
+            'interval': '15',
+            'max_interval': '300'
+        },
+        'Balance': {
+            'min_interval': '2',
+            'max_interval': '60'
         }
     }
 
@@ -77,9 +101,143 @@ class ConfigManager:
         return self.config.getboolean(section, option, fallback=fallback)
 
 
+# TCP keep-alive probes stop idle pooled connections from being dropped by
+# NAT and firewalls between heartbeats
+KEEPALIVE_SOCKET_OPTIONS = HTTPConnection.default_socket_options + [(socket.SOL_SOCKET, socket.SO_KEEPALIVE, 1)]
+if hasattr(socket, 'TCP_KEEPIDLE'):
+    KEEPALIVE_SOCKET_OPTIONS += [
+        (socket.IPPROTO_TCP, socket.TCP_KEEPIDLE, 30),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPINTVL, 10),
+        (socket.IPPROTO_TCP, socket.TCP_KEEPCNT, 3)
+    ]
+
+
+class KeepAliveAdapter(HTTPAdapter):
+    """HTTP adapter whose pooled connections send TCP keep-alive probes"""
+
+    def init_poolmanager(self, *args, **kwargs):
+        kwargs['socket_options'] = KEEPALIVE_SOCKET_OPTIONS
+        super().init_poolmanager(*args, **kwargs)
+
+
+class RequestTask:
+    """A submitted request; a cancelled task's callback is never run"""
+
+    def __init__(self, method, path, callback, tag, kwargs):
+        self.method = method
+        self.path = path
+        self.callback = callback
+        self.tag = tag
+        self.kwargs = kwargs
+        self.cancelled = False
+
+    def cancel(self):
+        """Drop the request if it has not been sent, and its result if it has"""
+        self.cancelled = True
+
+
+class RequestExecutor:
+    """Runs HTTP requests on a few long-lived worker threads
+
+    Requests wait in a priority queue, so user actions go out before queued
+    background requests, and a slow request holds only its own worker. Each
+    worker keeps one keep-alive connection to the server; all of them share
+    the login cookies. Finished requests go onto one queue that the Tk
+    thread empties with drain(), so callbacks run on the Tk thread.
+    """
+
+    HIGH, NORMAL, LOW = 0, 1, 2
+
+    def __init__(self, base_url, timeout, verify, workers=2):
+        """Start the worker threads"""
+        self.base_url = base_url
+        self.timeout = timeout
+        self.verify = verify
+        self.cookies = requests.cookies.RequestsCookieJar()
+        self.tasks = queue.PriorityQueue()
+        self.results = queue.SimpleQueue()
+        self.pending = set()
+        self.pending_lock = threading.Lock()
+        self.counter = itertools.count()
+
+        self.workers = [
+            threading.Thread(target=self._worker, name=f'request-worker-{i}', daemon=True)
+            for i in range(workers)
+        ]
+        for worker in self.workers:
+            worker.start()
+
+    def submit(self, method, path, callback, priority=NORMAL, tag=None, **kwargs):
+        """Queue a request; callback(response, error) runs on the Tk thread"""
+        task = RequestTask(method, path, callback, tag, kwargs)
+        with self.pending_lock:
+            self.pending.add(task)
+        # The counter keeps requests of equal priority in submission order
+        self.tasks.put((priority, next(self.counter), task))
+        return task
+
+    def cancel(self, tag=None):
+        """Cancel the outstanding requests with this tag, or all of them"""
+        with self.pending_lock:
+            for task in self.pending:
+                if tag is None or task.tag == tag:
+                    task.cancel()
+
+    def drain(self, limit=20):
+        """Run the callbacks of finished requests; call from the Tk thread"""
+        for _ in range(limit):
+            try:
+                task, response, error = self.results.get_nowait()
+            except queue.Empty:
+                return
+            with self.pending_lock:
+                self.pending.discard(task)
+            if not task.cancelled:
+                task.callback(response, error)
+
+    def close(self):
+        """Cancel outstanding requests and stop the workers"""
+        self.cancel()
+        for _ in self.workers:
+            self.tasks.put((self.LOW + 1, next(self.counter), None))
+
+    def _worker(self):
+        """Send queued requests over this worker's connection"""
+        session = requests.Session()
+        session.cookies = self.cookies
+        adapter = KeepAliveAdapter(pool_connections=1, pool_maxsize=1, max_retries=0)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        while True:
+            _, _, task = self.tasks.get()
+            if task is None:
+                session.close()
+                return
+            if task.cancelled:
+                self.results.put((task, None, None))
+                continue
+
+            kwargs = dict(task.kwargs)
+            kwargs.setdefault('timeout', self.timeout)
+            try:
+                response = session.request(
+                    task.method,
+                    f'{self.base_url}{task.path}',
+                    verify=self.verify,
+                    **kwargs
+                )
+                self.results.put((task, response, None))
+            except Exception as e:
+                self.results.put((task, None, e))
+
+
 class CafeClient:
     """Internet Cafe Client Application"""
 
+    # How often the Tk thread collects finished requests
+    DRAIN_INTERVAL_MS = 50
+
     def __init__(self, root):
         """Initialize the cafe client application"""
         self.root = root
@@ -88,9 +246,9 @@ class CafeClient:
         # Window setup
         self.root.title("Internet Cafe Client")
         width = self.config.get_int('UI', 'window_width', 400)
-        height = self.config.get_int('UI', 'window_height', 350)
+        height = self.config.get_int('UI', 'window_height', 380)
         self.root.geometry(f"{width}x{height}")
-        self.root.minsize(400, 350)
+        self.root.minsize(400, 380)
 
         # Server configuration
         self.SERVER_URL = self.config.get('Server', 'url')
@@ -101,8 +259,13 @@ class CafeClient:
         self.RATE_PER_MINUTE = self.config.get_float('Billing', 'rate_per_minute', 0.05)
         self.CURRENCY = self.config.get('Billing', 'currency', '$')
 
-        # Create a session to maintain cookies
-        self.session = requests.Session()
+        # Background requests; cookies are kept across all of them
+        self.executor = RequestExecutor(
+            self.SERVER_URL,
+            self.TIMEOUT,
+            self.VERIFY_SSL,
+            workers=self.config.get_int('Server', 'workers', 2)
+        )
 
         # Session state
         self.active_session = False
@@ -111,8 +274,29 @@ class CafeClient:
         self.logged_in = False
         self.update_timer_id = None
 
-        # Threading lock
-        self.request_lock = threading.Lock()
+        # Heartbeat state: one payload carries the session state and the
+        # events not yet acknowledged by the server
+        self.STATION_ID = self.config.get('Station', 'id', '') or socket.gethostname()
+        self.STATION_TOKEN = self.config.get('Station', 'token', '')
+        self.HEARTBEAT_ENABLED = self.config.get_bool('Heartbeat', 'enabled', True)
+        self.HEARTBEAT_MAX_INTERVAL = self.config.get_float('Heartbeat', 'max_interval', 300)
+        self.heartbeat_interval = self.config.get_float('Heartbeat', 'interval', 15)
+        self.heartbeat_boot = uuid.uuid4().hex
+        self.heartbeat_seq = 0
+        self.heartbeat_failures = 0
+        self.heartbeat_offline_since = None
+        self.heartbeat_timer_id = None
+        self.pending_events = []
+        self.next_event_id = 1
+
+        # Balance polling: conditional requests, backing off while the
+        # balance is unchanged
+        self.BALANCE_MIN_INTERVAL = self.config.get_float('Balance', 'min_interval', 2)
+        self.BALANCE_MAX_INTERVAL = self.config.get_float('Balance', 'max_interval', 60)
+        self.balance = None
+        self.balance_etag = None
+        self.balance_interval = self.BALANCE_MIN_INTERVAL
+        self.balance_timer_id = None
 
         # Create GUI elements
         self.setup_gui()
@@ -120,9 +304,18 @@ class CafeClient:
         # Handle window closing
         self.root.protocol("WM_DELETE_WINDOW", self.on_closing)
 
+        # Deliver request results on the Tk thread
+        self.drain_timer_id = self.root.after(self.DRAIN_INTERVAL_MS, self._drain_results)
+
         # Test server connection on startup
         self.root.after(1000, self.test_server_connection)
 
+        # Start heartbeats, spreading stations that start together over
+        # the first interval
+        self.record_event('started')
+        if self.HEARTBEAT_ENABLED:
+            self._schedule_heartbeat(random.uniform(1, max(1, self.heartbeat_interval)))
+
         logging.info("Application initialized")
 
     def setup_gui(self):
@@ -183,11 +376,18 @@ class CafeClient:
 
         self.cost_label = ttk.Label(
             info_frame,
-            text=f"Cost: {self.CURRENCY}0.00",
+            text=f"Estimated cost: {self.CURRENCY}0.00",
             font=("Arial", 12)
         )
         self.cost_label.pack(pady=5)
 
+        self.balance_label = ttk.Label(
+            info_frame,
+            text="Balance: --",
+            font=("Arial", 12)
+        )
+        self.balance_label.pack(pady=5)
+
         # Progress indicator
         self.progress_var = tk.IntVar()
         self.progress = ttk.Progressbar(
@@ -218,64 +418,106 @@ class CafeClient:
             self.progress.stop()
             self.progress.pack_forget()
 
+    def _drain_results(self):
+        """Run the callbacks of finished requests"""
+        try:
+            self.executor.drain()
+        except Exception as e:
+            logging.error(f"Request callback error: {str(e)}")
+        self.drain_timer_id = self.root.after(self.DRAIN_INTERVAL_MS, self._drain_results)
+
+    def _json_body(self, response):
+        """The response's JSON object, or {} if it has none"""
+        try:
+            body = response.json()
+        except ValueError:
+            return {}
+        return body if isinstance(body, dict) else {}
+
+    def _error_message(self, response):
+        """Extract the error message from a failed response"""
+        try:
+            return response.json().get('error', 'Unknown error')
+        except ValueError:
+            return f"Invalid server response (Status: {response.status_code})"
+
+    def _show_request_error(self, error, action):
+        """Report a request that got no response"""
+        if isinstance(error, requests.exceptions.ConnectionError):
+            self.status_var.set("Connection failed")
+            messagebox.showerror(
+                "Error",
+                "Cannot connect to server. Please check if the server is running."
+            )
+        elif isinstance(error, requests.exceptions.Timeout):
+            self.status_var.set("Connection timeout")
+            messagebox.showerror(
+                "Error",
+                "Connection timed out. Server might be busy or unreachable."
+            )
+        else:
+            self.status_var.set("Connection error")
+            messagebox.showerror(
+                "Error",
+                f"Connection error: {str(error)}"
+            )
+            logging.error(f"{action} error: {str(error)}")
+
     def test_server_connection(self):
         """Test connection to the server"""
         self.status_var.set("Testing connection to server...")
         self.show_loading(True)
 
-        # Run in a separate thread to avoid blocking UI
-        threading.Thread(
-            target=self._test_server_connection_thread,
-            daemon=True
-        ).start()
+        # A newer test replaces one still outstanding
+        self.executor.cancel('connection_test')
+        self.executor.submit(
+            'GET', '/',
+            self._server_connection_done,
+            tag='connection_test'
+        )
 
-    def _test_server_connection_thread(self):
-        """Test server connection in a background thread"""
+    def _server_connection_done(self, response, error):
+        """Report the result of the connection test"""
         success = False
-        try:
-            with self.request_lock:
-                response = self.session.get(
-                    f'{self.SERVER_URL}/',
-                    verify=self.VERIFY_SSL,
-                    timeout=self.TIMEOUT
-                )
+        self.show_loading(False)
 
+        if error is None:
             if response.status_code == 200:
                 status_msg = "Server connection successful"
                 success = True
+                self.status_var.set(status_msg)
             else:
                 status_msg = f"Server returned status code: {response.status_code}"
-
-                # Update UI from main thread
-                self.root.after(0, lambda: messagebox.showwarning(
+                self.status_var.set(status_msg)
+                messagebox.showwarning(
                     "Warning",
                     f"Server connection returned status code: {response.status_code}"
-                ))
-
-        except requests.exceptions.ConnectionError:
+                )
+        elif isinstance(error, requests.exceptions.ConnectionError):
             status_msg = "Cannot connect to server"
-            self.root.after(0, lambda: messagebox.showerror(
+            self.status_var.set(status_msg)
+            messagebox.showerror(
                 "Error",
                 "Cannot connect to server. Please check the server address and ensure the server is running."
-            ))
-        except requests.exceptions.Timeout:
+            )
+        elif isinstance(error, requests.exceptions.Timeout):
             status_msg = "Connection timeout"
-            self.root.after(0, lambda: messagebox.showerror(
+            self.status_var.set(status_msg)
+            messagebox.showerror(
                 "Error",
                 "Connection timed out. Server might be busy or unreachable."
-            ))
-        except Exception as e:
-            status_msg = f"Connection error: {str(e)}"
-            self.root.after(0, lambda: messagebox.showerror(
+            )
+        else:
+            status_msg = f"Connection error: {str(error)}"
+            self.status_var.set(status_msg)
+            messagebox.showerror(
                 "Error",
-                f"Connection error: {str(e)}"
-            ))
-            logging.error(f"Server connection error: {str(e)}")
-
-        # Update UI from main thread
-        self.root.after(0, lambda: self.status_var.set(status_msg))
-        self.root.after(0, lambda: self.show_loading(False))
+                f"Connection error: {str(error)}"
+            )
+            logging.error(f"Server connection error: {str(error)}")
 
+        if not success:
+            self.record_event('connection_test_failed', {'status': status_msg})
         logging.info(f"Server connection test: {status_msg}")
         return success
 
@@ -304,75 +546,39 @@ class CafeClient:
         # Disable login button during login process
         self.login_button.config(state='disabled')
 
-        # Run in a separate thread to avoid blocking UI
-        threading.Thread(
-            target=self._login_thread,
-            args=(email, password),
-            daemon=True
-        ).start()
-
-    def _login_thread(self, email, password):
-        """Handle login in a background thread"""
-        try:
-            with self.request_lock:
-                response = self.session.post(
-                    f'{self.SERVER_URL}/login',
-                    json={"email": email, "password": password},
-                    verify=self.VERIFY_SSL,
-                    timeout=self.TIMEOUT
-                )
+        self.executor.submit(
+            'POST', '/login',
+            lambda response, error: self._login_done(email, response, error),
+            priority=RequestExecutor.HIGH,
+            tag='login',
+            json={"email": email, "password": password}
+        )
 
-            if response.status_code == 200:
-                self.logged_in = True
-
-                # Update UI from main thread
-                self.root.after(0, lambda: self.login_button.config(state='disabled'))
-                self.root.after(0, lambda: self.start_button.config(state='normal'))
-                self.root.after(0, lambda: self.status_var.set(f"Connected - Logged in as {email}"))
-                self.root.after(0, lambda: messagebox.showinfo(
-                    "Success",
-                    "Logged in successfully"
-                ))
-            else:
-                error_msg = "Unknown error"
-                try:
-                    error_msg = response.json().get('error', 'Unknown error')
-                except ValueError:
-                    error_msg = f"Invalid server response (Status: {response.status_code})"
-
-                # Update UI from main thread
-                self.root.after(0, lambda: self.status_var.set("Authentication failed"))
-                self.root.after(0, lambda: self.login_button.config(state='normal'))
-                self.root.after(0, lambda: messagebox.showerror(
-                    "Error",
-                    f"Login failed: {error_msg}"
-                ))
-
-        except requests.exceptions.ConnectionError:
-            self.root.after(0, lambda: self.status_var.set("Connection failed"))
-            self.root.after(0, lambda: self.login_button.config(state='normal'))
-            self.root.after(0, lambda: messagebox.showerror(
-                "Error",
-                "Cannot connect to server. Please check if the server is running."
-            ))
-        except requests.exceptions.Timeout:
-            self.root.after(0, lambda: self.status_var.set("Connection timeout"))
-            self.root.after(0, lambda: self.login_button.config(state='normal'))
-            self.root.after(0, lambda: messagebox.showerror(
-                "Error",
-                "Connection timed out. Server might be busy or unreachable."
-            ))
-        except Exception as e:
-            self.root.after(0, lambda: self.status_var.set("Connection error"))
-            self.root.after(0, lambda: self.login_button.config(state='normal'))
-            self.root.after(0, lambda: messagebox.showerror(
+    def _login_done(self, email, response, error):
+        """Handle the login response"""
+        self.show_loading(False)
+
+        if error is not None:
+            self.login_button.config(state='normal')
+            self._show_request_error(error, "Login")
+        elif response.status_code == 200:
+            self.logged_in = True
+            self.login_button.config(state='disabled')
+            self.start_button.config(state='normal')
+            self.status_var.set(f"Connected - Logged in as {email}")
+            self.poll_balance_now()
+            messagebox.showinfo(
+                "Success",
+                "Logged in successfully"
+            )
+        else:
+            error_msg = self._error_message(response)
+            self.status_var.set("Authentication failed")
+            self.login_button.config(state='normal')
+            messagebox.showerror(
                 "Error",
-                f"Connection error: {str(e)}"
-            ))
-            logging.error(f"Login error: {str(e)}")
-
-        # Hide loading indicator
-        self.root.after(0, lambda: self.show_loading(False))
+                f"Login failed: {error_msg}"
+            )
 
     def start_session(self):
         """Start a new session"""
@@ -386,97 +592,58 @@ class CafeClient:
         # Disable start button during process
         self.start_button.config(state='disabled')
 
-        # Run in a separate thread to avoid blocking UI
-        threading.Thread(
-            target=self._start_session_thread,
-            daemon=True
-        ).start()
-
-    def _start_session_thread(self):
-        """Handle session start in a background thread"""
-        try:
-            with self.request_lock:
-                response = self.session.post(
-                    f'{self.SERVER_URL}/start_session',
-                    verify=self.VERIFY_SSL,
-                    timeout=self.TIMEOUT
-                )
+        self.executor.submit(
+            'POST', '/start_session',
+            self._start_session_done,
+            priority=RequestExecutor.HIGH,
+            tag='session'
+        )
 
-            if response.status_code == 200:
-                self.active_session = True
-                self.session_start_time = datetime.now()
-
-                # Safely get session ID
-                try:
-                    response_data = response.json()
-                    self.session_id = response_data.get('session_id', 'unknown')
-                except ValueError:
-                    self.session_id = 'unknown'
-                    logging.warning("Could not parse session ID from server response")
-
-                # Update UI from main thread
-                self.root.after(0, lambda: self.start_button.config(state='disabled'))
-                self.root.after(0, lambda: self.end_button.config(state='normal'))
-                self.root.after(0, lambda: self.status_var.set(
-                    f"Session active - ID: {self.session_id}"
-                ))
-
-                # Start session timer
-                self.root.after(0, self.update_session_info)
-
-            elif response.status_code == 401:
-                # Authentication issue
-                self.logged_in = False
-
-                # Update UI from main thread
-                self.root.after(0, lambda: self.status_var.set("Not authenticated"))
-                self.root.after(0, lambda: self.login_button.config(state='normal'))
-                self.root.after(0, lambda: self.start_button.config(state='disabled'))
-                self.root.after(0, lambda: messagebox.showerror(
-                    "Error",
-                    "Not authenticated. Please login again."
-                ))
-            else:
-                # Other error
-                error_msg = "Unknown error"
-                try:
-                    error_msg = response.json().get('error', 'Unknown error')
-                except ValueError:
-                    error_msg = f"Invalid server response (Status: {response.status_code})"
-
-                # Update UI from main thread
-                self.root.after(0, lambda: self.status_var.set("Failed to start session"))
-                self.root.after(0, lambda: self.start_button.config(state='normal'))
-                self.root.after(0, lambda: messagebox.showerror(
-                    "Error",
-                    f"Failed to start session: {error_msg}"
-                ))
-
-        except requests.exceptions.ConnectionError:
-            self.root.after(0, lambda: self.status_var.set("Connection failed"))
-            self.root.after(0, lambda: self.start_button.config(state='normal'))
-            self.root.after(0, lambda: messagebox.showerror(
-                "Error",
-                "Cannot connect to server. Please check if the server is running."
-            ))
-        except requests.exceptions.Timeout:
-            self.root.after(0, lambda: self.status_var.set("Connection timeout"))
-            self.root.after(0, lambda: self.start_button.config(state='normal'))
-            self.root.after(0, lambda: messagebox.showerror(
+    def _start_session_done(self, response, error):
+        """Handle the session start response"""
+        self.show_loading(False)
+
+        if error is not None:
+            self.start_button.config(state='normal')
+            self._show_request_error(error, "Start session")
+        elif response.status_code == 200:
+            self.active_session = True
+            self.session_start_time = datetime.now()
+
+            # Safely get session ID
+            try:
+                response_data = response.json()
+                self.session_id = response_data.get('session_id', 'unknown')
+            except ValueError:
+                self.session_id = 'unknown'
+                logging.warning("Could not parse session ID from server response")
+
+            self.start_button.config(state='disabled')
+            self.end_button.config(state='normal')
+            self.status_var.set(f"Session active - ID: {self.session_id}")
+
+            # Start session timer
+            self.update_session_info()
+
+        elif response.status_code == 401:
+            # Authentication issue
+            self.logged_in = False
+            self.status_var.set("Not authenticated")
+            self.login_button.config(state='normal')
+            self.start_button.config(state='disabled')
+            messagebox.showerror(
                 "Error",
-                "Connection timed out. Server might be busy or unreachable."
-            ))
-        except Exception as e:
-            self.root.after(0, lambda: self.status_var.set("Connection error"))
-            self.root.after(0, lambda: self.start_button.config(state='normal'))
-            self.root.after(0, lambda: messagebox.showerror(
+                "Not authenticated. Please login again."
+            )
+        else:
+            # Other error
+            error_msg = self._error_message(response)
+            self.status_var.set("Failed to start session")
+            self.start_button.config(state='normal')
+            messagebox.showerror(
                 "Error",
-                f"Connection error: {str(e)}"
-            ))
-            logging.error(f"Start session error: {str(e)}")
-
-        # Hide loading indicator
-        self.root.after(0, lambda: self.show_loading(False))
+                f"Failed to start session: {error_msg}"
+            )
 
     def end_session(self):
         """End the current session"""
@@ -486,106 +653,71 @@ class CafeClient:
         # Disable end button during process
         self.end_button.config(state='disabled')
 
-        # Run in a separate thread to avoid blocking UI
-        threading.Thread(
-            target=self._end_session_thread,
-            daemon=True
-        ).start()
-
-    def _end_session_thread(self):
-        """Handle session end in a background thread"""
-        try:
-            with self.request_lock:
-                response = self.session.post(
-                    f'{self.SERVER_URL}/end_session',
-                    verify=self.VERIFY_SSL,
-                    timeout=self.TIMEOUT
-                )
+        self.executor.submit(
+            'POST', '/end_session',
+            self._end_session_done,
+            priority=RequestExecutor.HIGH,
+            tag='session'
+        )
 
-            if response.status_code == 200:
-                self.active_session = False
-                end_time = datetime.now()
-
-                # Calculate session time and cost
-                if self.session_start_time:
-                    diff = end_time - self.session_start_time
-                    minutes = diff.total_seconds() / 60
-                    final_cost = minutes * self.RATE_PER_MINUTE
-
-                    # Show session summary
-                    self.root.after(0, lambda: messagebox.showinfo(
-                        "Session Ended",
-                        f"Session time: {int(minutes)}:{int((minutes % 1) * 60):02d}\n"
-                        f"Total cost: {self.CURRENCY}{final_cost:.2f}"
-                    ))
-
-                # Update UI from main thread
-                self.root.after(0, lambda: self.start_button.config(state='normal'))
-                self.root.after(0, lambda: self.end_button.config(state='disabled'))
-                self.root.after(0, lambda: self.status_var.set("Session ended"))
-
-                # Reset session state
-                self.session_id = None
-                self.session_start_time = None
-
-                # Update session info UI
-                self.root.after(0, self.update_session_info)
-
-            elif response.status_code == 401:
-                # Authentication issue
-                self.logged_in = False
-                self.active_session = False
-
-                # Update UI from main thread
-                self.root.after(0, lambda: self.status_var.set("Not authenticated"))
-                self.root.after(0, lambda: self.login_button.config(state='normal'))
-                self.root.after(0, lambda: self.start_button.config(state='disabled'))
-                self.root.after(0, lambda: self.end_button.config(state='disabled'))
-                self.root.after(0, lambda: messagebox.showerror(
-                    "Error",
-                    "Not authenticated. Please login again."
-                ))
+    def _end_session_done(self, response, error):
+        """Handle the session end response"""
+        self.show_loading(False)
+
+        if error is not None:
+            self.end_button.config(state='normal')
+            self._show_request_error(error, "End session")
+        elif response.status_code == 200 or (
+                response.status_code == 503 and 'session_id' in self._json_body(response)):
+            # A 503 naming the session means it ended but the server could
+            # not charge it yet; it retries the charge itself
+            result = self._json_body(response)
+            self.active_session = False
+
+            self.start_button.config(state='normal')
+            self.end_button.config(state='disabled')
+            self.status_var.set("Session ended")
+
+            self.session_id = None
+            self.session_start_time = None
+            self.update_session_info()
+
+            # The session charge changes the balance
+            self.poll_balance_now()
+
+            # Show the session summary as billed by the server
+            minutes = float(result.get('duration_minutes') or 0)
+            if result.get('cost') is not None:
+                cost_line = f"Total cost: {self.CURRENCY}{float(result['cost']):.2f}"
             else:
-                # Other error
-                error_msg = "Unknown error"
-                try:
-                    error_msg = response.json().get('error', 'Unknown error')
-                except ValueError:
-                    error_msg = f"Invalid server response (Status: {response.status_code})"
-
-                # Update UI from main thread
-                self.root.after(0, lambda: self.status_var.set("Failed to end session"))
-                self.root.after(0, lambda: self.end_button.config(state='normal'))
-                self.root.after(0, lambda: messagebox.showerror(
-                    "Error",
-                    f"Failed to end session: {error_msg}"
-                ))
-
-        except requests.exceptions.ConnectionError:
-            self.root.after(0, lambda: self.status_var.set("Connection failed"))
-            self.root.after(0, lambda: self.end_button.config(state='normal'))
-            self.root.after(0, lambda: messagebox.showerror(
-                "Error",
-                "Cannot connect to server. Please check if the server is running."
-            ))
-        except requests.exceptions.Timeout:
-            self.root.after(0, lambda: self.status_var.set("Connection timeout"))
-            self.root.after(0, lambda: self.end_button.config(state='normal'))
-            self.root.after(0, lambda: messagebox.showerror(
+                cost_line = "Total cost: pending, the session will be charged shortly"
+            messagebox.showinfo(
+                "Session Ended",
+                f"Session time: {int(minutes)}:{int((minutes % 1) * 60):02d}\n"
+                f"{cost_line}"
+            )
+
+        elif response.status_code == 401:
+            # Authentication issue
+            self.logged_in = False
+            self.active_session = False
+            self.status_var.set("Not authenticated")
+            self.login_button.config(state='normal')
+            self.start_button.config(state='disabled')
+            self.end_button.config(state='disabled')
+            messagebox.showerror(
                 "Error",
-                "Connection timed out. Server might be busy or unreachable."
-            ))
-        except Exception as e:
-            self.root.after(0, lambda: self.status_var.set("Connection error"))
-            self.root.after(0, lambda: self.end_button.config(state='normal'))
-            self.root.after(0, lambda: messagebox.showerror(
+                "Not authenticated. Please login again."
+            )
+        else:
+            # Other error
+            error_msg = self._error_message(response)
+            self.status_var.set("Failed to end session")
+            self.end_button.config(state='normal')
+            messagebox.showerror(
                 "Error",
-                f"Connection error: {str(e)}"
-            ))
-            logging.error(f"End session error: {str(e)}")
-
-        # Hide loading indicator
-        self.root.after(0, lambda: self.show_loading(False))
+                f"Failed to end session: {error_msg}"
+            )
 
     def update_session_info(self):
         """Update the session information display"""
@@ -604,8 +736,9 @@ class CafeClient:
             self.time_label.config(
                 text=f"Time: {int(minutes)}:{int((minutes % 1) * 60):02d}"
             )
+            # A flat-rate estimate; the server prices the session when it ends
             self.cost_label.config(
-                text=f"Cost: {self.CURRENCY}{minutes * self.RATE_PER_MINUTE:.2f}"
+                text=f"Estimated cost: {self.CURRENCY}{minutes * self.RATE_PER_MINUTE:.2f}"
             )
 
             # Schedule next update
@@ -613,7 +746,171 @@ class CafeClient:
         else:
             # Reset labels
             self.time_label.config(text="Time: 0:00")
-            self.cost_label.config(text=f"Cost: {self.CURRENCY}0.00")
+            self.cost_label.config(text=f"Estimated cost: {self.CURRENCY}0.00")
+
+    def poll_balance_now(self):
+        """Poll the balance at once and restart the backoff"""
+        if self.balance_timer_id:
+            self.root.after_cancel(self.balance_timer_id)
+            self.balance_timer_id = None
+        self.executor.cancel('balance')
+        self.balance_interval = self.BALANCE_MIN_INTERVAL
+        self.poll_balance()
+
+    def poll_balance(self):
+        """Ask for the balance unless it is unchanged since the last poll"""
+        self.balance_timer_id = None
+        headers = {'If-None-Match': self.balance_etag} if self.balance_etag else {}
+        self.executor.submit(
+            'GET', '/get_balance',
+            self._balance_done,
+            priority=RequestExecutor.NORMAL,
+            tag='balance',
+            headers=headers
+        )
+
+    def _balance_done(self, response, error):
+        """Show a changed balance and schedule the next poll"""
+        changed = False
+        if error is None and response.status_code == 200:
+            try:
+                balance = float(response.json()['balance'])
+            except (ValueError, KeyError, TypeError):
+                logging.warning("Invalid balance response from server")
+            else:
+                changed = balance != self.balance
+                self.balance = balance
+                self.balance_etag = response.headers.get('ETag')
+                self.balance_label.config(text=f"Balance: {self.CURRENCY}{balance:.2f}")
+        elif error is None and response.status_code == 401:
+            # Logged out on the server; polling resumes after the next login
+            self.balance_etag = None
+            return
+        elif error is not None:
+            logging.warning(f"Balance poll failed: {str(error)}")
+        elif response.status_code != 304:
+            logging.warning(f"Balance poll returned status {response.status_code}")
+
+        # Poll quickly after a change, then back off while nothing changes
+        if changed:
+            self.balance_interval = self.BALANCE_MIN_INTERVAL
+        else:
+            self.balance_interval = min(self.balance_interval * 2, self.BALANCE_MAX_INTERVAL)
+
+        # Rate limited: wait at least as long as the server asks
+        delay = self.balance_interval
+        if error is None and response.status_code == 429:
+            retry_after = response.headers.get('Retry-After', '')
+            if retry_after.isdigit():
+                delay = max(delay, float(retry_after))
+        self.balance_timer_id = self.root.after(int(delay * 1000), self.poll_balance)
+
+    def record_event(self, kind, data=None):
+        """Queue an event for the next heartbeat"""
+        self.pending_events.append([self.next_event_id, kind, time.time(), data])
+        self.next_event_id += 1
+        # While the server is unreachable only the latest events are kept
+        del self.pending_events[:-100]
+
+    def _heartbeat_payload(self):
+        """Build one heartbeat from the current session state"""
+        self.heartbeat_seq += 1
+        elapsed = 0.0
+        if self.active_session and self.session_start_time:
+            elapsed = (datetime.now() - self.session_start_time).total_seconds()
+        return {
+            'station': self.STATION_ID,
+            'token': self.STATION_TOKEN,
+            'boot': self.heartbeat_boot,
+            'seq': self.heartbeat_seq,
+            'session': {
+                'active': self.active_session,
+                'id': self.session_id,
+                'elapsed': round(elapsed, 1)
+            },
+            'events': self.pending_events[:20]
+        }
+
+    def _schedule_heartbeat(self, delay):
+        """Send the next heartbeat after about delay seconds"""
+        # Jitter keeps stations from falling into step
+        delay = min(delay, self.HEARTBEAT_MAX_INTERVAL) * random.uniform(0.9, 1.1)
+        self.heartbeat_timer_id = self.root.after(int(delay * 1000), self.send_heartbeat)
+
+    def send_heartbeat(self):
+        """Send the session state and pending events to the server"""
+        payload = self._heartbeat_payload()
+        self.executor.submit(
+            'POST', '/heartbeat',
+            lambda response, error: self._heartbeat_done(payload, response, error),
+            priority=RequestExecutor.LOW,
+            tag='heartbeat',
+            json=payload
+        )
+
+    def _heartbeat_done(self, payload, response, error):
+        """Handle the heartbeat reply and schedule the next heartbeat"""
+        reply = None
+        if error is None and response.status_code == 200:
+            try:
+                reply = response.json()
+            except ValueError:
+                logging.warning("Heartbeat reply is not JSON")
+
+        if reply is not None:
+            self._handle_heartbeat_reply(payload, reply)
+            if self.heartbeat_offline_since is not None:
+                self.record_event('reconnected', {'offline_seconds': round(time.time() - self.heartbeat_offline_since)})
+            self.heartbeat_failures = 0
+            self.heartbeat_offline_since = None
+            delay = self.heartbeat_interval
+        else:
+            self.heartbeat_failures += 1
+            retry_after = response.headers.get('Retry-After', '') if response is not None else ''
+            delay = float(retry_after) if retry_after.isdigit() else self._heartbeat_backoff(self.heartbeat_failures)
+            if error is not None:
+                if self.heartbeat_offline_since is None:
+                    self.heartbeat_offline_since = time.time()
+                logging.warning(f"Heartbeat failed: {str(error)}")
+            else:
+                logging.warning(f"Heartbeat rejected with status {response.status_code}")
+
+        self._schedule_heartbeat(delay)
+
+    def _heartbeat_backoff(self, failures):
+        """Double the wait after each failed heartbeat"""
+        return self.heartbeat_interval * 2 ** min(failures, 6)
+
+    def _handle_heartbeat_reply(self, payload, reply):
+        """Apply the server's acknowledgement and load hint"""
+        ack = reply.get('ack', 0)
+        self.pending_events = [event for event in self.pending_events if event[0] > ack]
+
+        interval = reply.get('interval')
+        if isinstance(interval, (int, float)) and interval > 0:
+            self.heartbeat_interval = min(float(interval), self.HEARTBEAT_MAX_INTERVAL)
+
+        # The server ended the session this heartbeat reported (idle
+        # timeout or session lifetime)
+        server_session = reply.get('session')
+        if server_session and payload['session']['active'] and not server_session.get('active'):
+            self._session_ended_by_server(payload['session']['id'])
+
+    def _session_ended_by_server(self, session_id):
+        """Reset the session display after the server ended the session"""
+        # An end_session request in flight disables the end button first
+        if not self.active_session or self.session_id != session_id or str(self.end_button['state']) == 'disabled':
+            return
+
+        self.active_session = False
+        self.session_id = None
+        self.session_start_time = None
+        self.start_button.config(state='normal')
+        self.end_button.config(state='disabled')
+        self.status_var.set("Session ended by server")
+        self.update_session_info()
+        self.poll_balance_now()
+        logging.info(f"Session {session_id} ended by server")
 
     def on_closing(self):
         """Handle application closing"""
@@ -622,31 +919,34 @@ class CafeClient:
                 "Confirm Exit",
                 "You have an active session. End the session and exit?"
             ):
-                # End the session first
-                threading.Thread(
-                    target=self._close_session_and_exit,
-                    daemon=True
-                ).start()
+                # Nothing else is worth waiting for; end the session first
+                self.executor.cancel()
+                self.executor.submit(
+                    'POST', '/end_session',
+                    self._close_session_and_exit,
+                    priority=RequestExecutor.HIGH,
+                    tag='session'
+                )
             else:
                 return
         else:
             logging.info("Application shutting down")
-            self.root.destroy()
-
-    def _close_session_and_exit(self):
-        """End current session and exit the application"""
-        try:
-            with self.request_lock:
-                self.session.post(
-                    f'{self.SERVER_URL}/end_session',
-                    verify=self.VERIFY_SSL,
-                    timeout=self.TIMEOUT
-                )
-        except Exception as e:
-            logging.error(f"Error ending session on exit: {str(e)}")
-        finally:
-            logging.info("Application shutting down after session end")
-            self.root.after(0, self.root.destroy)
+            self._shutdown()
+
+    def _close_session_and_exit(self, response, error):
+        """Exit once the session end request has finished"""
+        if error is not None:
+            logging.error(f"Error ending session on exit: {str(error)}")
+        logging.info("Application shutting down after session end")
+        self._shutdown()
+
+    def _shutdown(self):
+        """Stop background work and close the window"""
+        for timer_id in (self.heartbeat_timer_id, self.balance_timer_id, self.drain_timer_id, self.update_timer_id):
+            if timer_id:
+                self.root.after_cancel(timer_id)
+        self.executor.close()
+        self.root.destroy()
 
 
 if __name__ == "__main__":
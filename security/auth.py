@@ -1,16 +1,52 @@
 from werkzeug.security import generate_password_hash, check_password_hash
+from collections import OrderedDict
+from concurrent.futures import Future
 import jwt
 import datetime
+import hashlib
+import threading
+import time
 
 class Auth:
-    def __init__(self, secret_key):
+    def __init__(self, secret_key, token_cache_size=1024, hasher=None):
         self.secret_key = secret_key
+        self.token_cache_size = token_cache_size
+        #optional security.password_pool.PasswordHasher; without one the
+        #KDF runs on the calling thread
+        self.hasher = hasher
+
+        #verified tokens, keyed by SHA-256 of the token so the cache never
+        #holds a usable credential: digest -> (sub, exp or None)
+        self._lock = threading.Lock()
+        self._tokens = OrderedDict()
+        #digest -> exp of revoked tokens, kept until they would expire anyway
+        self._revoked = {}
+
+        self.metrics = {
+            'hits': 0,
+            'misses': 0,
+            'expired': 0,
+            'revoked': 0,
+            'evictions': 0
+        }
 
     def hash_password(self, password):
+        if self.hasher:
+            return self.hasher.hash(password).result(self.hasher.timeout)
         return generate_password_hash(password)
 
     def verify_password(self, hashed_password, password):
-        return check_password_hash(hashed_password, password)
+        return self.verify_password_async(hashed_password, password).result(
+            self.hasher.timeout if self.hasher else None
+        )
+
+    def verify_password_async(self, hashed_password, password):
+        #returns a Future; raises HasherBusy right away when the pool is full
+        if self.hasher:
+            return self.hasher.verify(hashed_password, password)
+        future = Future()
+        future.set_result(check_password_hash(hashed_password, password))
+        return future
 
     def generate_token(self, user_id):
         try:
@@ -28,10 +64,65 @@ class Auth:
             return None
 
     def verify_token(self, token):
+        digest = self._digest(token)
+        with self._lock:
+            if digest in self._revoked:
+                self.metrics['revoked'] += 1
+                return 'Token revoked'
+            entry = self._tokens.get(digest)
+            if entry is not None:
+                sub, exp = entry
+                #same boundary as jwt.decode: expired once now reaches exp
+                if exp is None or time.time() < exp:
+                    self._tokens.move_to_end(digest)
+                    self.metrics['hits'] += 1
+                    return sub
+                del self._tokens[digest]
+                self.metrics['expired'] += 1
+                return 'Token expired'
+            self.metrics['misses'] += 1
+
         try:
             payload = jwt.decode(token, self.secret_key, algorithms=['HS256'])
-            return payload['sub']
         except jwt.ExpiredSignatureError:
             return 'Token expired'
         except jwt.InvalidTokenError:
             return 'Invalid token'
+
+        with self._lock:
+            #a logout that raced with the decode must not be undone
+            if digest not in self._revoked:
+                self._tokens[digest] = (payload['sub'], payload.get('exp'))
+                while len(self._tokens) > self.token_cache_size:
+                    self._tokens.popitem(last=False)
+                    self.metrics['evictions'] += 1
+        return payload['sub']
+
+    def revoke_token(self, token):
+        #called on logout; the token is refused from now until it expires
+        digest = self._digest(token)
+        try:
+            exp = jwt.decode(token, self.secret_key, algorithms=['HS256'], options={'verify_exp': False}).get('exp')
+        except jwt.InvalidTokenError:
+            return False
+
+        now = time.time()
+        with self._lock:
+            self._tokens.pop(digest, None)
+            self._revoked = {key: until for key, until in self._revoked.items() if until is None or until > now}
+            self._revoked[digest] = exp
+        return True
+
+    def token_cache_stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['cached'] = len(self._tokens)
+            stats['revoked_tokens'] = len(self._revoked)
+        lookups = stats['hits'] + stats['misses']
+        stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _digest(self, token):
+        if isinstance(token, str):
+            token = token.encode()
+        return hashlib.sha256(token).digest()
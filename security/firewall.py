@@ -1,24 +1,244 @@
+import logging
 import subprocess
+import threading
+
+BUILTIN_CHAINS = ('INPUT', 'FORWARD', 'OUTPUT')
+
 
 class Firewall:
-    def __init__(self):
+    # Desired-state manager for the cafe's filter rules. Rules are written
+    # as before ('INPUT -p tcp ...'), but each built-in chain's rules live in
+    # a chain of our own (CAFE_INPUT, ...) reached by a single jump, so they
+    # can be replaced without touching anyone else's rules. apply() diffs
+    # the desired rules against iptables-save and, only if they differ,
+    # rewrites the managed chains in one atomic iptables-restore --noflush
+    # transaction.
+    #
+    # Stations allowed through the proxy are members of an ipset, so
+    # allowing or blocking one is a set update, not a rule change.
+    #
+    # Rules should be spelled the way iptables-save prints them
+    # (e.g. '-p tcp -m tcp --dport 5000'); any other spelling still works
+    # but is seen as changed, and re-applied, on every apply().
+    def __init__(self, prefix='CAFE', station_set='cafe_stations', binaries=None, sudo=True):
+        self.prefix = prefix
+        self.station_set = station_set
+        # paths to iptables-save, iptables-restore and ipset; point these
+        # at stand-in scripts to exercise the manager without root
+        self.binaries = {
+            'iptables-save': 'iptables-save',
+            'iptables-restore': 'iptables-restore',
+            'ipset': 'ipset'
+        }
+        self.binaries.update(binaries or {})
+        self.sudo = sudo
+
         self.rules = []
+        self.stations = set()
+        self._set_ready = False
+        self._lock = threading.Lock()
+
+        self.metrics = {
+            'applies': 0,
+            'noop_applies': 0,
+            'station_updates': 0,
+            'errors': 0
+        }
 
     def add_rule(self, rule):
-        try:
-            subprocess.run(['sudo', 'iptables', '-A'] + rule.split())
-            self.rules.append(rule)
+        if rule.split(None, 1)[0] not in BUILTIN_CHAINS:
+            logging.error(f"Firewall rule error: unsupported chain in {rule}")
+            return False
+        with self._lock:
+            if rule not in self.rules:
+                self.rules.append(rule)
+        return self.apply()['ok']
+
+    def remove_rule(self, rule):
+        with self._lock:
+            if rule in self.rules:
+                self.rules.remove(rule)
+        return self.apply()['ok']
+
+    def setup_basic_rules(self):
+        with self._lock:
+            self.rules = [
+                'INPUT -i lo -j ACCEPT',
+                'INPUT -m state --state RELATED,ESTABLISHED -j ACCEPT',
+                'INPUT -p tcp -m tcp --dport 5000 -j ACCEPT',  # Flask server
+                'INPUT -p tcp -m tcp --dport 631 -j ACCEPT',   # CUPS
+                # Squid, only for stations that have been allowed
+                f'INPUT -p tcp -m tcp --dport 3128 -m set --match-set {self.station_set} src -j ACCEPT',
+                'INPUT -j DROP'                                # Drop all other traffic
+            ]
+        return self.apply()['ok']
+
+    def apply(self):
+        # returns {'ok', 'changed', 'added', 'removed'}; rule order within a
+        # chain matters, so any difference rewrites the whole chain
+        with self._lock:
+            result = {'ok': False, 'changed': False, 'added': [], 'removed': []}
+            if not self._ensure_set():
+                return result
+            try:
+                current_rules, jumps = self._current()
+            except Exception as e:
+                self._error("Firewall read error", e)
+                return result
+
+            desired = self._desired()
+            chains = set(desired) | set(current_rules) | set(jumps)
+            for chain in chains:
+                want = desired.get(chain, [])
+                have = current_rules.get(chain, [])
+                result['added'] += [f'{chain} {spec}' for spec in want if spec not in have]
+                result['removed'] += [f'{chain} {spec}' for spec in have if spec not in want]
+
+            # each desired chain is jumped to exactly once, and a chain no
+            # longer desired (now empty) must not be jumped to at all
+            if all(desired.get(chain, []) == current_rules.get(chain, []) for chain in chains) \
+                    and all(jumps.get(chain, 0) == (1 if chain in desired else 0) for chain in chains):
+                self.metrics['noop_applies'] += 1
+                result['ok'] = True
+                return result
+
+            try:
+                self._run('iptables-restore', ['--noflush'], self._restore_payload(desired, chains, jumps))
+            except Exception as e:
+                self._error("Firewall apply error", e)
+                return result
+            self.metrics['applies'] += 1
+            result['ok'] = result['changed'] = True
+            return result
+
+    def allow_station(self, ip):
+        return self._update_station('add', ip)
+
+    def block_station(self, ip):
+        return self._update_station('del', ip)
+
+    def sync_stations(self, ips):
+        # makes the set hold exactly ips, in one ipset restore call
+        ips = set(ips)
+        with self._lock:
+            if not self._ensure_set():
+                return False
+            try:
+                current = self._current_stations()
+            except Exception as e:
+                self._error("Station list error", e)
+                return False
+            lines = [f'add {self.station_set} {ip} -exist' for ip in sorted(ips - current)]
+            lines += [f'del {self.station_set} {ip} -exist' for ip in sorted(current - ips)]
+            if lines:
+                try:
+                    self._run('ipset', ['restore'], '\n'.join(lines) + '\n')
+                except Exception as e:
+                    self._error("Station sync error", e)
+                    return False
+                self.metrics['station_updates'] += len(lines)
+            self.stations = ips
+            return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['rules'] = len(self.rules)
+            stats['stations'] = len(self.stations)
+        return stats
+
+    def _update_station(self, action, ip):
+        with self._lock:
+            if (ip in self.stations) == (action == 'add'):
+                return True
+            if not self._ensure_set():
+                return False
+            try:
+                self._run('ipset', [action, self.station_set, ip, '-exist'])
+            except Exception as e:
+                self._error("Station update error", e)
+                return False
+            if action == 'add':
+                self.stations.add(ip)
+            else:
+                self.stations.discard(ip)
+            self.metrics['station_updates'] += 1
             return True
+
+    def _ensure_set(self):
+        if self._set_ready:
+            return True
+        try:
+            self._run('ipset', ['create', self.station_set, 'hash:ip', '-exist'])
         except Exception as e:
-            logging.error(f"Firewall rule error: {e}")
+            self._error("ipset create error", e)
             return False
+        self._set_ready = True
+        return True
 
-    def setup_basic_rules(self):
-        rules = [
-            'INPUT -p tcp --dport 5000 -j ACCEPT',  # Flask server
-            'INPUT -p tcp --dport 631 -j ACCEPT',   # CUPS
-            'INPUT -p tcp --dport 3128 -j ACCEPT',  # Squid
-            'INPUT -j DROP'                         # Drop all other traffic
-        ]
-        for rule in rules:
-            self.add_rule(rule)
+    def _managed(self, chain):
+        return f'{self.prefix}_{chain}'
+
+    def _desired(self):
+        # managed chain -> ordered rule specs
+        desired = {}
+        for rule in self.rules:
+            chain, spec = rule.split(None, 1)
+            if chain not in BUILTIN_CHAINS:
+                raise ValueError(f"Unsupported chain in rule: {rule}")
+            desired.setdefault(self._managed(chain), []).append(' '.join(spec.split()))
+        return desired
+
+    def _current(self):
+        # managed chain -> rule specs, and managed chain -> number of jumps
+        # to it from its built-in chain
+        output = self._run('iptables-save', ['-t', 'filter'])
+        managed = {self._managed(chain): chain for chain in BUILTIN_CHAINS}
+        rules = {}
+        jumps = {}
+        for line in output.splitlines():
+            if line.startswith(':'):
+                chain = line[1:].split()[0]
+                if chain in managed:
+                    rules.setdefault(chain, [])
+            if not line.startswith('-A '):
+                continue
+            _, chain, spec = line.split(None, 2)
+            if chain in managed:
+                rules[chain].append(spec)
+            elif chain in BUILTIN_CHAINS and spec.startswith('-j ') and spec[3:] in managed:
+                jumps[spec[3:]] = jumps.get(spec[3:], 0) + 1
+        return rules, jumps
+
+    def _restore_payload(self, desired, chains, jumps):
+        # declaring a user chain under --noflush flushes just that chain, so
+        # the other tables and chains are left untouched
+        lines = ['*filter']
+        lines += [f':{chain} - [0:0]' for chain in sorted(chains)]
+        for chain in sorted(chains):
+            builtin = chain[len(self.prefix) + 1:]
+            if chain in desired and not jumps.get(chain):
+                lines.append(f'-I {builtin} 1 -j {chain}')
+            extra = jumps.get(chain, 0) - (1 if chain in desired else 0)
+            lines += [f'-D {builtin} -j {chain}'] * max(extra, 0)
+            lines += [f'-A {chain} {spec}' for spec in desired.get(chain, [])]
+        lines.append('COMMIT')
+        return '\n'.join(lines) + '\n'
+
+    def _current_stations(self):
+        output = self._run('ipset', ['save', self.station_set])
+        return {
+            line.split()[2] for line in output.splitlines()
+            if line.startswith('add ') and len(line.split()) >= 3
+        }
+
+    def _run(self, binary, args, stdin=None):
+        command = (['sudo'] if self.sudo else []) + [self.binaries[binary]] + args
+        completed = subprocess.run(command, input=stdin, capture_output=True, text=True, check=True)
+        return completed.stdout
+
+    def _error(self, message, error):
+        if isinstance(error, subprocess.CalledProcessError):
+            error = error.stderr.strip() or error
+        self.metrics['errors'] += 1
+        logging.error(f"{message}: {error}")
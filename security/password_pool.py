@@ -0,0 +1,132 @@
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from werkzeug.security import generate_password_hash, check_password_hash
+
+
+class HasherBusy(Exception):
+    pass
+
+
+class PasswordHasher:
+    # Runs werkzeug's KDF in worker processes so a burst of logins costs
+    # CPU on the workers instead of holding request threads. At most
+    # max_pending operations are queued or running; past that, hash() and
+    # verify() raise HasherBusy at once instead of queueing further.
+    #
+    # The pool is forked once, before the app starts any thread. If it
+    # breaks it is not forked again from the threaded server; pending and
+    # later operations run in process instead, still bounded by max_pending.
+    def __init__(self, workers=2, max_pending=16, timeout=10.0):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.timeout = timeout
+
+        self._lock = threading.Lock()
+        self._pending = 0
+        self._pool = self._start_pool()
+
+        self.metrics = {
+            'hashed': 0,
+            'verified': 0,
+            'rejected': 0,
+            'errors': 0,
+            'in_process': 0,
+            'peak_pending': 0
+        }
+
+    def hash(self, password):
+        # returns a concurrent.futures.Future; asyncio callers can await
+        # it through asyncio.wrap_future
+        return self._submit(generate_password_hash, 'hashed', password)
+
+    def verify(self, hashed_password, password):
+        return self._submit(check_password_hash, 'verified', hashed_password, password)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['pending'] = self._pending
+        return stats
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _submit(self, fn, metric, *args):
+        with self._lock:
+            if self._pending >= self.max_pending:
+                self.metrics['rejected'] += 1
+                raise HasherBusy(f"{self._pending} password operations already pending")
+            self._pending += 1
+            self.metrics[metric] += 1
+            self.metrics['peak_pending'] = max(self.metrics['peak_pending'], self._pending)
+            pool = self._pool
+
+        # callers get this future rather than the pool's, so an operation
+        # lost with a broken pool can still be finished in process
+        result = Future()
+        result.add_done_callback(self._release)
+        if pool is not None:
+            try:
+                future = pool.submit(fn, *args)
+            except BrokenProcessPool as e:
+                self._broken(e)
+            else:
+                future.add_done_callback(lambda f: self._done(f, result, fn, args))
+                return result
+        self._run_in_process(result, fn, args)
+        return result
+
+    def _done(self, future, result, fn, args):
+        if future.cancelled():
+            result.cancel()
+            return
+        error = future.exception()
+        if isinstance(error, BrokenProcessPool):
+            self._broken(error)
+            self._run_in_process(result, fn, args)
+        elif error is not None:
+            with self._lock:
+                self.metrics['errors'] += 1
+            logging.error(f"Password hashing error: {error}")
+            result.set_exception(error)
+        else:
+            result.set_result(future.result())
+
+    def _run_in_process(self, result, fn, args):
+        with self._lock:
+            self.metrics['in_process'] += 1
+        try:
+            result.set_result(fn(*args))
+        except Exception as e:
+            with self._lock:
+                self.metrics['errors'] += 1
+            logging.error(f"Password hashing error: {e}")
+            result.set_exception(e)
+
+    def _release(self, result):
+        with self._lock:
+            self._pending -= 1
+
+    def _broken(self, error):
+        with self._lock:
+            if self._pool is None:
+                return
+            pool, self._pool = self._pool, None
+        pool.shutdown(wait=False)
+        logging.error(f"Password hashing pool is broken, hashing in process from now on: {error}")
+
+    def _start_pool(self):
+        # forked up front like DocumentInspector, before the app starts any
+        # thread, and only from __init__; spawn would re-import app.py in
+        # every worker
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('fork')
+        )
+        pool.submit(os.getpid).result()
+        return pool
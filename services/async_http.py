@@ -0,0 +1,338 @@
+import asyncio
+import io
+import json
+import logging
+import sys
+import time
+from http import HTTPStatus
+from urllib.parse import unquote
+
+# marks the end of a WSGI response iterator advanced on the executor
+_END = object()
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message=None):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+
+class AsyncRequest:
+    # One parsed request. The body is not read up front: handlers pull it
+    # with read() (streaming) or body(), so an upload is consumed as it
+    # arrives instead of being buffered before the handler runs. A client
+    # that sends nothing for body_timeout seconds mid-body is dropped.
+    def __init__(self, method, target, version, headers, reader, writer, remote_addr, body_timeout=30):
+        self.method = method
+        path, _, self.query_string = target.partition('?')
+        self.path = unquote(path)
+        self.version = version
+        self.headers = headers  # lower-cased name -> value
+        self.remote_addr = remote_addr
+        self.content_length = int(headers.get('content-length') or 0)
+        self._reader = reader
+        self._writer = writer
+        self._remaining = self.content_length
+        self._continued = headers.get('expect', '').lower() != '100-continue'
+        self._body_timeout = body_timeout
+
+    async def read(self, size=65536):
+        # next chunk of the body, b'' once it has all been read
+        if not self._remaining:
+            return b''
+        if not self._continued:
+            self._continued = True
+            self._writer.write(b'HTTP/1.1 100 Continue\r\n\r\n')
+        try:
+            data = await asyncio.wait_for(self._reader.read(min(size, self._remaining)), self._body_timeout)
+        except TimeoutError:
+            raise ConnectionError(f"Client sent no body data for {self._body_timeout} s")
+        if not data:
+            raise ConnectionError("Client closed the connection mid-body")
+        self._remaining -= len(data)
+        return data
+
+    async def body(self):
+        chunks = []
+        while True:
+            chunk = await self.read()
+            if not chunk:
+                return b''.join(chunks)
+            chunks.append(chunk)
+
+    async def json(self):
+        try:
+            return json.loads(await self.body() or b'null')
+        except ValueError:
+            raise HTTPError(400, "Invalid JSON body")
+
+    @property
+    def body_consumed(self):
+        return not self._remaining
+
+
+def json_response(data, status=200, headers=None):
+    return status, dict(headers or {}, **{'Content-Type': 'application/json'}), json.dumps(data).encode()
+
+
+class AsyncHTTPServer:
+    # HTTP/1.1 server on asyncio streams. Each connection is a coroutine
+    # rather than a thread, so thousands of idle keep-alive or long-poll
+    # connections cost a few KB each.
+    #
+    # routes maps (method, path) to an async handler(request) returning
+    # (status, headers, body). Anything else is passed to wsgi_app on
+    # the executor, the way a threaded WSGI server would run it, with its
+    # response iterator advanced there too so streamed bodies (exports,
+    # SSE) are relayed as they are produced. A WSGI request body is read
+    # into memory first, so those are capped at max_wsgi_body; large
+    # uploads belong on native routes that stream them.
+    def __init__(self, routes, wsgi_app=None, executor=None, max_connections=10000,
+                 keepalive_timeout=75, header_timeout=10, body_timeout=30, max_body=64 * 1024 * 1024,
+                 max_wsgi_body=1024 * 1024, metrics=None):
+        self.routes = routes
+        self.wsgi_app = wsgi_app
+        self.executor = executor
+        self.max_connections = max_connections
+        self.keepalive_timeout = keepalive_timeout
+        self.header_timeout = header_timeout
+        self.body_timeout = body_timeout
+        self.max_body = max_body
+        self.max_wsgi_body = max_wsgi_body
+        # services.metrics.Metrics; the WSGI app records its own requests
+        self.request_metrics = metrics
+        self.url_scheme = 'http'
+        self.server = None
+
+        self.metrics = {
+            'connections': 0,
+            'open_connections': 0,
+            'max_open_connections': 0,
+            'refused': 0,
+            'requests': 0,
+            'native_requests': 0,
+            'wsgi_requests': 0,
+            'errors': 0
+        }
+
+    async def start(self, host, port, ssl=None):
+        self.url_scheme = 'https' if ssl else 'http'
+        self.server = await asyncio.start_server(self._serve_connection, host, port, ssl=ssl, backlog=1024)
+        return self.server
+
+    def stats(self):
+        return dict(self.metrics)
+
+    async def _serve_connection(self, reader, writer):
+        peer = writer.get_extra_info('peername') or ('', 0)
+        self.metrics['connections'] += 1
+        if self.metrics['open_connections'] >= self.max_connections:
+            self.metrics['refused'] += 1
+            writer.write(self._head(503, {'Content-Length': '0', 'Retry-After': '1'}, False))
+            await self._close(writer)
+            return
+
+        self.metrics['open_connections'] += 1
+        self.metrics['max_open_connections'] = max(
+            self.metrics['max_open_connections'], self.metrics['open_connections']
+        )
+        try:
+            keep_alive = True
+            first = True
+            while keep_alive:
+                # an idle keep-alive connection waits here without a thread
+                timeout = self.header_timeout if first else self.keepalive_timeout
+                first = False
+                try:
+                    head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), timeout)
+                except (asyncio.IncompleteReadError, TimeoutError, ConnectionError):
+                    break
+                except asyncio.LimitOverrunError:
+                    writer.write(self._head(431, {'Content-Length': '0'}, False))
+                    break
+
+                try:
+                    request = self._parse(head, reader, writer, peer)
+                except HTTPError as e:
+                    writer.write(self._head(e.status, {'Content-Length': '0'}, False))
+                    break
+                keep_alive = self._wants_keep_alive(request)
+                self.metrics['requests'] += 1
+
+                handler = self.routes.get((request.method, request.path))
+                if handler:
+                    keep_alive = await self._run_native(handler, request, writer, keep_alive)
+                elif self.wsgi_app:
+                    keep_alive = await self._run_wsgi(request, writer, keep_alive)
+                else:
+                    await self._send(writer, *json_response({'error': 'Not found'}, 404), keep_alive)
+                await writer.drain()
+        except ConnectionError:
+            pass
+        except Exception as e:
+            # the response may be half written, so the connection is dropped
+            self.metrics['errors'] += 1
+            logging.error(f"Async server error: {e}")
+        finally:
+            self.metrics['open_connections'] -= 1
+            await self._close(writer)
+
+    def _parse(self, head, reader, writer, peer):
+        lines = head.decode('latin-1').split('\r\n')
+        try:
+            method, target, version = lines[0].split(' ', 2)
+        except ValueError:
+            raise HTTPError(400)
+        headers = {}
+        for line in lines[1:]:
+            if not line:
+                continue
+            name, _, value = line.partition(':')
+            headers[name.strip().lower()] = value.strip()
+        if 'chunked' in headers.get('transfer-encoding', '').lower():
+            # station clients always send a length; refusing chunked
+            # bodies keeps the body reader simple
+            raise HTTPError(411)
+        try:
+            if int(headers.get('content-length') or 0) > self.max_body:
+                raise HTTPError(413)
+        except ValueError:
+            raise HTTPError(400)
+        return AsyncRequest(method, target, version, headers, reader, writer, peer[0], self.body_timeout)
+
+    def _wants_keep_alive(self, request):
+        connection = request.headers.get('connection', '').lower()
+        if request.version == 'HTTP/1.0':
+            return connection == 'keep-alive'
+        return connection != 'close'
+
+    async def _run_native(self, handler, request, writer, keep_alive):
+        self.metrics['native_requests'] += 1
+        metrics = self.request_metrics
+        if metrics:
+            metrics.add('cafe_http_requests_in_flight', (('route', request.path),), 1)
+        start = time.perf_counter()
+        try:
+            status, headers, body = await handler(request)
+        except HTTPError as e:
+            status, headers, body = json_response({'error': str(e)}, e.status)
+        except ConnectionError:
+            raise
+        except Exception as e:
+            self.metrics['errors'] += 1
+            logging.error(f"Async handler error on {request.path}: {e}")
+            status, headers, body = json_response({'error': 'Server error'}, 500)
+        finally:
+            if metrics:
+                metrics.add('cafe_http_requests_in_flight', (('route', request.path),), -1)
+
+        if metrics:
+            labels = (('route', request.path), ('method', request.method))
+            metrics.observe('cafe_http_request_duration_seconds', labels, time.perf_counter() - start)
+            metrics.inc('cafe_http_requests_total', labels + (('status', str(status)),))
+            if status >= 500:
+                metrics.inc('cafe_http_request_errors_total', labels)
+
+        # an unread body would be parsed as the next request: a small one
+        # is skipped, a large one costs the connection
+        if not request.body_consumed and request._remaining <= 65536:
+            await request.body()
+        keep_alive = keep_alive and request.body_consumed
+        await self._send(writer, status, headers, body, keep_alive)
+        return keep_alive
+
+    async def _run_wsgi(self, request, writer, keep_alive):
+        self.metrics['wsgi_requests'] += 1
+        if request.content_length > self.max_wsgi_body:
+            # refused before reading, so the unread body costs the connection
+            await self._send(writer, *json_response({'error': 'Request body too large'}, 413), False)
+            return False
+        loop = asyncio.get_running_loop()
+        environ = self._environ(request, await request.body())
+
+        def start():
+            state = {}
+
+            def start_response(status, headers, exc_info=None):
+                state['status'] = status
+                state['headers'] = headers
+                return lambda data: None
+
+            result = self.wsgi_app(environ, start_response)
+            iterator = iter(result)
+            return state, result, iterator, next(iterator, _END)
+
+        state, result, iterator, chunk = await loop.run_in_executor(self.executor, start)
+        try:
+            status = int(state['status'].split(' ', 1)[0])
+            headers = [(name, value) for name, value in state['headers'] if name.lower() != 'connection']
+            chunked = not any(name.lower() == 'content-length' for name, _ in headers)
+            if chunked:
+                headers.append(('Transfer-Encoding', 'chunked'))
+            writer.write(self._head(status, headers, keep_alive))
+
+            while chunk is not _END:
+                if chunk:
+                    writer.write(b'%x\r\n%s\r\n' % (len(chunk), chunk) if chunked else chunk)
+                    await writer.drain()
+                chunk = await loop.run_in_executor(self.executor, next, iterator, _END)
+            if chunked:
+                writer.write(b'0\r\n\r\n')
+        finally:
+            # releases what the response holds (DB cursors, stream slots)
+            if hasattr(result, 'close'):
+                await loop.run_in_executor(self.executor, result.close)
+        return keep_alive
+
+    def _environ(self, request, body):
+        sockname = request._writer.get_extra_info('sockname') or ('', 0)
+        environ = {
+            'REQUEST_METHOD': request.method,
+            'SCRIPT_NAME': '',
+            'PATH_INFO': request.path.encode('utf-8').decode('latin-1'),
+            'QUERY_STRING': request.query_string,
+            'SERVER_NAME': str(sockname[0]),
+            'SERVER_PORT': str(sockname[1]),
+            'SERVER_PROTOCOL': request.version,
+            'REMOTE_ADDR': request.remote_addr,
+            'CONTENT_TYPE': request.headers.get('content-type', ''),
+            'CONTENT_LENGTH': str(len(body)),
+            'wsgi.version': (1, 0),
+            'wsgi.url_scheme': self.url_scheme,
+            'wsgi.input': io.BytesIO(body),
+            'wsgi.errors': sys.stderr,
+            'wsgi.multithread': True,
+            'wsgi.multiprocess': False,
+            'wsgi.run_once': False,
+            'wsgi.input_terminated': True
+        }
+        for name, value in request.headers.items():
+            if name not in ('content-type', 'content-length'):
+                environ['HTTP_' + name.upper().replace('-', '_')] = value
+        return environ
+
+    async def _send(self, writer, status, headers, body, keep_alive):
+        headers = dict(headers, **{'Content-Length': str(len(body))})
+        writer.write(self._head(status, headers, keep_alive) + body)
+
+    def _head(self, status, headers, keep_alive):
+        if isinstance(headers, dict):
+            headers = headers.items()
+        lines = [f"HTTP/1.1 {status} {phrase(status)}"]
+        lines.extend(f"{name}: {value}" for name, value in headers)
+        lines.append(f"Connection: {'keep-alive' if keep_alive else 'close'}")
+        return ('\r\n'.join(lines) + '\r\n\r\n').encode('latin-1')
+
+    async def _close(self, writer):
+        try:
+            writer.close()
+            await writer.wait_closed()
+        except (ConnectionError, OSError):
+            pass
+
+
+def phrase(status):
+    try:
+        return HTTPStatus(status).phrase
+    except ValueError:
+        return ''
@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+
+
+class BalanceCache:
+    # Balances are also given ETags for conditional polling. A tag names
+    # one balance value and is dropped by any write for that user, so while
+    # it exists the balance is unchanged as far as this process knows.
+    # Writes made elsewhere (another worker, the reconciliation command) are
+    # not seen, so a tag is only trusted for tag_max_age seconds after the
+    # balance was last read. The epoch makes tags from another process or
+    # an earlier run never match.
+    def __init__(self, max_entries=1024, ttl=5.0, tag_max_age=60.0):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.tag_max_age = tag_max_age
+        self.epoch = os.urandom(4).hex()
+
+        self._lock = threading.Lock()
+        # user_id -> [balance or None, expires_at, write_gen]
+        self._entries = OrderedDict()
+        self._gen = 0
+        # highest write generation among evicted entries; an evicted user
+        # must not be refilled by a read that started before that write
+        self._evicted_gen = 0
+        # user_id -> [balance, tag, verified_at]
+        self._tags = OrderedDict()
+        self._tag_counter = 0
+
+        self.metrics = {
+            'hits': 0,
+            'misses': 0,
+            'fills': 0,
+            'stale_fills': 0,
+            'evictions': 0,
+            'invalidations': 0,
+            'updates': 0,
+            'tag_hits': 0,
+            'tag_misses': 0,
+            'new_tags': 0
+        }
+
+    def get(self, user_id):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is None or entry[0] is None or entry[1] < time.monotonic():
+                self.metrics['misses'] += 1
+                return None
+            self._entries.move_to_end(user_id)
+            self.metrics['hits'] += 1
+            return entry[0]
+
+    def begin_read(self):
+        # returned token is passed back to fill() once the DB read finishes
+        with self._lock:
+            return self._gen
+
+    def fill(self, user_id, balance, token):
+        with self._lock:
+            entry = self._entries.get(user_id)
+            last_write = entry[2] if entry is not None else self._evicted_gen
+            if last_write > token:
+                # a write landed while we were reading; our value is older
+                self.metrics['stale_fills'] += 1
+                return False
+            self._store(user_id, balance, last_write)
+            self.metrics['fills'] += 1
+            return True
+
+    def apply_delta(self, user_id, delta):
+        with self._lock:
+            self._gen += 1
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[0] is not None and entry[1] >= time.monotonic():
+                self._store(user_id, entry[0] + delta, self._gen)
+                self.metrics['updates'] += 1
+            else:
+                self._store(user_id, None, self._gen)
+                self.metrics['invalidations'] += 1
+            self._tags.pop(user_id, None)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._gen += 1
+            self._store(user_id, None, self._gen)
+            self._tags.pop(user_id, None)
+            self.metrics['invalidations'] += 1
+
+    def clear(self):
+        with self._lock:
+            self._gen += 1
+            self._evicted_gen = self._gen
+            self._entries.clear()
+            self._tags.clear()
+
+    def tag(self, user_id):
+        # the current tag, or None when a conditional read must go to the
+        # database
+        with self._lock:
+            entry = self._tags.get(user_id)
+            if entry is None or entry[2] + self.tag_max_age < time.monotonic():
+                self.metrics['tag_misses'] += 1
+                return None
+            self.metrics['tag_hits'] += 1
+            return entry[1]
+
+    def set_tag(self, user_id, balance, token):
+        # tags a balance read that started at begin_read() token; returns
+        # None if a write landed since, as fill() would refuse it
+        with self._lock:
+            entry = self._entries.get(user_id)
+            last_write = entry[2] if entry is not None else self._evicted_gen
+            if last_write > token:
+                return None
+            tagged = self._tags.get(user_id)
+            if tagged is None or tagged[0] != balance:
+                self._tag_counter += 1
+                tagged = [balance, f"{self.epoch}-{self._tag_counter}", 0]
+                self.metrics['new_tags'] += 1
+            tagged[2] = time.monotonic()
+            self._tags[user_id] = tagged
+            self._tags.move_to_end(user_id)
+            while len(self._tags) > self.max_entries:
+                self._tags.popitem(last=False)
+            return tagged[1]
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['size'] = len(self._entries)
+            stats['tags'] = len(self._tags)
+            lookups = stats['hits'] + stats['misses']
+            stats['hit_rate'] = stats['hits'] / lookups if lookups else 0.0
+        return stats
+
+    def _store(self, user_id, balance, gen):
+        self._entries[user_id] = [balance, time.monotonic() + self.ttl, gen]
+        self._entries.move_to_end(user_id)
+        while len(self._entries) > self.max_entries:
+            _, evicted = self._entries.popitem(last=False)
+            self._evicted_gen = max(self._evicted_gen, evicted[2])
+            self.metrics['evictions'] += 1
@@ -1,26 +1,55 @@
-import mysql.connector
+import base64
 import logging
+import threading
 from datetime import datetime
+from config.config import Config
+from services.db_pool import ConnectionPool
+from services.balance_cache import BalanceCache
+from services.ledger import LedgerWriter
+from services.pricing import PricingEngine
 
 class BillingService:
-    def __init__(self):
-        self.rates = {
-            'internet': {
-                'per_minute': 0.05,
-                'per_hour': 2.50,
-                'per_day': 15.00
-            },
-            'printing': {
-                'black_white': 0.10,
-                'color': 0.25
-            }
-        }
+    def __init__(self, connect=None, on_transaction=None, metrics=None, pricing=None, rates=None):
+        # on_transaction(user_id, amount, transaction_type) is called after
+        # each charge or credit is accepted; with a services.metrics.Metrics
+        # every MySQL statement is timed. Internet time is priced by pricing,
+        # a services.pricing.PricingEngine shared with the live previews.
+        # rates default to Config.BILLING_RATES
+        self.on_transaction = on_transaction
+        self.rates = rates or Config.BILLING_RATES
 
         self.db_config = {
              'host': 'localhost',
              'user': 'cafe_admin',
              'password': 'admin@123',
-             'cafe_db': 'cafe_db'
+             'database': 'cafe_db'
+        }
+
+        self.pool_config = {
+            'size': 10,
+            'timeout': 5.0,
+            'max_lifetime': 3600,
+            'health_check_interval': 30
+        }
+
+        self.cache_config = {
+            'max_entries': 1024,
+            'ttl': 5.0,
+            # seconds a balance ETag is trusted without re-reading the balance
+            'tag_max_age': 60.0
+        }
+
+        self.ledger_config = {
+            'enabled': True,
+            'journal_path': 'logs/ledger.journal',
+            'max_batch': 100,
+            'max_latency': 0.5
+        }
+
+        self.history_config = {
+            'max_page_size': 500,
+            # rows per export page; each page is one short query
+            'export_batch': 1000
         }
 
         self.test_data = {
@@ -28,46 +57,180 @@ class BillingService:
             2: {'balance': 50, 'name': 'Mike'}
         }
 
+        connect = connect or self._connect
+        if metrics:
+            connect = metrics.timed_database(connect, 'mysql')
+        self.pool = ConnectionPool(connect, **self.pool_config)
+        self.balance_cache = BalanceCache(**self.cache_config)
+        # striped per-user locks for charges that must stay within the balance
+        self._charge_locks = [threading.Lock() for _ in range(64)]
+        self.pricing = pricing or PricingEngine(self.rates)
+
+        self.ledger = None
+        if self.ledger_config['enabled']:
+            self.ledger = LedgerWriter(
+                self.pool,
+                self.ledger_config['journal_path'],
+                max_batch=self.ledger_config['max_batch'],
+                max_latency=self.ledger_config['max_latency']
+            )
+
+    def _connect(self):
+        # imported here so the service can be built (and tested) on a
+        # stand-in connection without the MySQL driver installed
+        import mysql.connector
+        return mysql.connector.connect(**self.db_config)
+
     def get_db_connection(self):
         try:
-            return mysql.connector.connect(**self.db_config)
+            return self.pool.get_connection()
         except Exception as e:
             logging.error(f"Database connection error: {e}")
             return None
 
+    def get_pool_stats(self):
+        return self.pool.stats()
+
+    def get_cache_stats(self):
+        return self.balance_cache.stats()
+
+    def get_ledger_stats(self):
+        return self.ledger.stats() if self.ledger else {}
+
+    def flush_ledger(self, timeout=None):
+        if self.ledger:
+            return self.ledger.flush(timeout)
+        return True
+
+    def close(self):
+        if self.ledger:
+            self.ledger.close()
+        self.pool.close()
+
+    def _query_balance(self, user_id):
+        conn = self.get_db_connection()
+        if not conn:
+            return None
+
+        with self.pool.release_on_exit(conn):
+            cursor = conn.cursor(dictionary=True)
+            cursor.execute("""
+                SELECT credit_balance
+                FROM users
+                WHERE id = %s
+            """, (user_id,))
+            result = cursor.fetchone()
+            cursor.close()
+
+        if result:
+            return float(result['credit_balance'])
+        return None
+
     def get_balance(self, user_id):
+        cached = self.balance_cache.get(user_id)
+        if cached is not None:
+            return cached
+
+        balance = self._read_balance(user_id)
+        if balance is not None:
+            return balance
+        return self.test_data.get(user_id, {}).get('balance', 0.00)
+
+    def _read_balance(self, user_id):
         try:
-            conn = self.get_db_connection()
-            if conn:
-                cursor = conn.cursor(dictionary=True)
-                cursor.execute("""
-                    SELECT credit_balance
-                    FROM users
-                    WHERE id = %s
-                """, (user_id,))
-                result = cursor.fetchone()
-                cursor.close()
-                conn.close()
+            token = self.balance_cache.begin_read()
+            if self.ledger:
+                # include charges still queued in the ledger
+                balance = self.ledger.read_through(user_id, lambda: self._query_balance(user_id))
+            else:
+                balance = self._query_balance(user_id)
 
-                if result:
-                    return float(result['credit_balance'])
+            if balance is not None:
+                self.balance_cache.fill(user_id, balance, token)
+                return balance
         except Exception as e:
             logging.error(f"Error getting balance: {e}")
-            
-        return self.test_data.get(user_id, {}).get('balance', 0.00)
-        
-    def charge_session(self, user_id, duration_minutes):
+        return None
+
+    def balance_tag(self, user_id):
+        # ETag of the user's current balance if it is known without a read
+        return self.balance_cache.tag(user_id)
+
+    def get_cached_balance_tagged(self, user_id):
+        # (balance, etag) from memory, or None on a cache miss
+        token = self.balance_cache.begin_read()
+        balance = self.balance_cache.get(user_id)
+        if balance is None:
+            return None
+        return balance, self.balance_cache.set_tag(user_id, balance, token)
+
+    def get_balance_tagged(self, user_id):
+        # (balance, etag); a balance that could not be read gets no tag
+        cached = self.get_cached_balance_tagged(user_id)
+        if cached is not None:
+            return cached
+
+        token = self.balance_cache.begin_read()
+        balance = self._read_balance(user_id)
+        if balance is None:
+            return self.test_data.get(user_id, {}).get('balance', 0.00), None
+        return balance, self.balance_cache.set_tag(user_id, balance, token)
+
+    def calculate_session_cost(self, duration_minutes, started_at=None):
+        # time-of-day bands apply only when the session's start is known
+        if started_at is None:
+            return self.pricing.price(duration_minutes)
+        return float(self.pricing.price_batch([duration_minutes], [started_at])[0])
+
+    def preview_session_costs(self, sessions, now=None):
+        # {session id: cost so far} for SessionRegistry.active_sessions() rows
+        return self.pricing.preview_sessions(sessions, now)
+
+    def calculate_print_cost(self, pages, color_pages, copies=1):
+        black_white_pages = max(pages - color_pages, 0)
+        return copies * (
+            black_white_pages * self.rates['printing']['black_white']
+            + color_pages * self.rates['printing']['color']
+        )
+
+    def charge_session(self, user_id, duration_minutes, started_at=None):
         try:
-            hours = duration_minutes / 60
-            if hours >= 24:
-                cost = self.rates['internet']['per_day'] * (hours / 24)
-            elif hours >= 1:
-                cost = self.rates['internet']['per_hour'] * hours
-            else:
-                cost = self.rates['internet']['per_minute'] * duration_minutes
+            cost = self.calculate_session_cost(duration_minutes, started_at)
+            description = f'INternet session: {duration_minutes} minutes'
+            return self._charge(user_id, cost, description)
+        except Exception as e:
+            logging.error(f"Charge calculation error: {e}")
+            self.balance_cache.invalidate(user_id)
+            return None
 
-            conn = self.ge_db_connection()
-            if conn:
+    def charge_print(self, user_id, cost, description):
+        try:
+            return self._charge(user_id, cost, description)
+        except Exception as e:
+            logging.error(f"Print charge error: {e}")
+            self.balance_cache.invalidate(user_id)
+            return None
+
+    def charge_print_if_covered(self, user_id, cost, description):
+        # the balance check and the charge under one lock, so two prints
+        # racing in this process cannot both spend the same credit. Returns
+        # the cost, False if the balance does not cover it, or None if the
+        # charge failed
+        with self._charge_locks[hash(user_id) % len(self._charge_locks)]:
+            if self.get_balance(user_id) < cost:
+                return False
+            return self.charge_print(user_id, cost, description)
+
+    def _charge(self, user_id, cost, description):
+        if self.ledger:
+            self.ledger.submit(user_id, cost, description)
+            self.balance_cache.apply_delta(user_id, -cost)
+            self._notify(user_id, cost, 'charge')
+            return cost
+
+        conn = self.get_db_connection()
+        if conn:
+            with self.pool.release_on_exit(conn):
                 cursor = conn.cursor()
 
                 cursor.execute("""
@@ -75,7 +238,7 @@ class BillingService:
                     SET credit_balance = credit_balance - %s
                     WHERE id = %s
                 """, (cost, user_id))
-                
+
                 cursor.execute("""
                     INSERT INTO billing (
                         user_id,
@@ -83,51 +246,198 @@ class BillingService:
                         description,
                         transaction_type
                     ) VALUES (%s, %s, %s, %s)
-               """, (
+                """, (
                     user_id,
                     cost,
-                    f'INternet session: {duration_minutes} minutes',
+                    description,
                     'charge'
-               ))
+                ))
 
                 conn.commit()
                 cursor.close()
-                conn.close()
+            self.balance_cache.apply_delta(user_id, -cost)
+        else:
+            if user_id in self.test_data:
+                self.test_data[user_id]['balance'] -= cost
+            self.balance_cache.invalidate(user_id)
+        self._notify(user_id, cost, 'charge')
+        return cost
+
+    def _notify(self, user_id, amount, transaction_type):
+        if self.on_transaction:
+            try:
+                self.on_transaction(user_id, amount, transaction_type)
+            except Exception as e:
+                logging.error(f"Transaction callback error: {e}")
+
+    def add_credit(self, user_id, amount, description='Credit top-up', transaction_type='deposit'):
+        try:
+            if amount <= 0:
+                return False
+
+            conn = self.get_db_connection()
+            if conn:
+                with self.pool.release_on_exit(conn):
+                    cursor = conn.cursor()
+
+                    cursor.execute("""
+                        UPDATE users
+                        SET credit_balance = credit_balance + %s
+                        WHERE id = %s
+                    """, (amount, user_id))
+
+                    cursor.execute("""
+                        INSERT INTO billing (
+                            user_id,
+                            amount,
+                            description,
+                            transaction_type
+                        ) VALUES (%s, %s, %s, %s)
+                    """, (
+                        user_id,
+                        amount,
+                        description,
+                        transaction_type
+                    ))
+
+                    conn.commit()
+                    cursor.close()
+                self.balance_cache.apply_delta(user_id, amount)
             else:
                 if user_id in self.test_data:
-                    self.test_data[user_id]['balance'] -= cost
-            return cost
+                    self.test_data[user_id]['balance'] += amount
+                self.balance_cache.invalidate(user_id)
+            self._notify(user_id, amount, transaction_type)
+            return True
 
         except Exception as e:
-            logging.error(f"Charge calculation error: {e}")
+            logging.error(f"Add credit error: {e}")
+            self.balance_cache.invalidate(user_id)
+            return False
+
+    def get_daily_totals(self, since):
+        # revenue (charges less refunds) and deposits recorded since the
+        # given datetime; None if the database cannot be reached
+        conn = self.get_db_connection()
+        if not conn:
+            return None
+        try:
+            with self.pool.release_on_exit(conn):
+                cursor = conn.cursor(dictionary=True)
+                cursor.execute("""
+                    SELECT
+                        COALESCE(SUM(CASE transaction_type
+                            WHEN 'charge' THEN amount
+                            WHEN 'refund' THEN -amount
+                            ELSE 0 END), 0) AS revenue,
+                        COALESCE(SUM(CASE WHEN transaction_type NOT IN ('charge', 'refund')
+                            THEN amount ELSE 0 END), 0) AS deposits
+                    FROM billing
+                    WHERE created_at >= %s
+                """, (since,))
+                result = cursor.fetchone()
+                cursor.close()
+            return {'revenue': float(result['revenue']), 'deposits': float(result['deposits'])}
+        except Exception as e:
+            logging.error(f"Daily totals error: {e}")
             return None
 
-    def get_transaction_history(self, user_id):
+    def get_transaction_history(self, user_id, limit=10, cursor=None):
+        # newest first, one page at a time: pass the cursor returned by
+        # get_transaction_page to continue from the last row seen
+        return self.get_transaction_page(user_id, limit, cursor)['transactions']
+
+    def get_transaction_page(self, user_id, limit=10, cursor=None):
+        # keyset pagination on (created_at, id): each page is an index range
+        # scan from the previous page's last row, however far back it is
+        # a bad limit or cursor raises ValueError for the caller to report
+        limit = max(1, min(int(limit), self.history_config['max_page_size']))
+        after = decode_history_cursor(cursor) if cursor else None
         try:
             conn = self.get_db_connection()
             if conn:
-                cursor = conn.cursor(dictionary=True)
-                cursor.execute("""
-                    SELECT * FROM billing
-                    WHERE user_id = %s
-                    ORDER BY created_at DESC
-                    LIMIT 10
-                """, (user_id,))
+                with self.pool.release_on_exit(conn):
+                    transactions = self._query_transactions(conn, user_id, limit + 1, after)
 
-                transactions = cursor.fetchall()
-                cursor.close()
-                conn.close()
-                return transactions
-
-            return [
-                {
-                    'amount': 10.00,
-                    'description': 'Test transaction 1',
-                    'transaction_type': 'deposit',
-                    'created_at': datetime.now()
-                }
-            ]
+                next_cursor = None
+                if len(transactions) > limit:
+                    transactions = transactions[:limit]
+                    last = transactions[-1]
+                    next_cursor = encode_history_cursor(last['created_at'], last['id'])
+                return {'transactions': transactions, 'next_cursor': next_cursor}
+
+            return {'transactions': self._test_transactions(user_id), 'next_cursor': None}
 
         except Exception as e:
             logging.error(f"Transaction history error: {e}")
-            return []
+            return {'transactions': [], 'next_cursor': None}
+
+    def iter_transactions(self, user_id):
+        # streams a user's whole history, newest first, as keyset pages of
+        # export_batch rows, so memory use does not depend on how long the
+        # history is. Each page borrows a pooled connection only for its
+        # own query: a slow download never pins a connection, and a stream
+        # abandoned part way simply stops asking for pages.
+        batch = self.history_config['export_batch']
+        after = None
+        while True:
+            conn = self.get_db_connection()
+            if not conn:
+                if after is None:
+                    yield from self._test_transactions(user_id)
+                    return
+                raise ConnectionError("Database unavailable part way through an export")
+            with self.pool.release_on_exit(conn):
+                rows = self._query_transactions(conn, user_id, batch, after)
+            yield from rows
+            if len(rows) < batch:
+                return
+            after = (rows[-1]['created_at'], rows[-1]['id'])
+
+    def _query_transactions(self, conn, user_id, limit, after=None):
+        # up to limit rows older than after, a (created_at, id) key
+        query = """
+            SELECT id, user_id, amount, description, transaction_type, created_at
+            FROM billing
+            WHERE user_id = %s
+        """
+        params = [user_id]
+        if after:
+            created_at, last_id = after
+            query += " AND (created_at < %s OR (created_at = %s AND id < %s))"
+            params += [created_at, created_at, last_id]
+        query += " ORDER BY created_at DESC, id DESC LIMIT %s"
+        params.append(limit)
+
+        db_cursor = conn.cursor(dictionary=True)
+        db_cursor.execute(query, params)
+        rows = db_cursor.fetchall()
+        db_cursor.close()
+        return rows
+
+    def _test_transactions(self, user_id):
+        return [
+            {
+                'id': 1,
+                'user_id': user_id,
+                'amount': 10.00,
+                'description': 'Test transaction 1',
+                'transaction_type': 'deposit',
+                'created_at': datetime.now()
+            }
+        ]
+
+
+def encode_history_cursor(created_at, row_id):
+    raw = f"{created_at.isoformat()}|{row_id}".encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip('=')
+
+
+def decode_history_cursor(cursor):
+    # raises ValueError for anything encode_history_cursor did not produce
+    try:
+        raw = base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)).decode()
+        created_at, row_id = raw.rsplit('|', 1)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid history cursor: {cursor}") from e
@@ -0,0 +1,196 @@
+import logging
+import threading
+import time
+from collections import deque
+
+JOB_STATES = {
+    3: 'pending',
+    4: 'held',
+    5: 'processing',
+    6: 'stopped',
+    7: 'canceled',
+    8: 'aborted',
+    9: 'completed'
+}
+FINAL_STATES = ('canceled', 'aborted', 'completed')
+JOB_ATTRIBUTES = ['job-id', 'job-state', 'job-printer-uri', 'job-name', 'job-k-octets']
+
+
+class CupsStateCache:
+    def __init__(self, connect, poll_interval=2.0, printer_ttl=60, keep_finished=1000):
+        # connect() must return a connection owned by this cache's thread
+        self.connect = connect
+        self.poll_interval = poll_interval
+        self.printer_ttl = printer_ttl
+        self.keep_finished = keep_finished
+
+        self._lock = threading.Lock()
+        self._jobs = {}           # CUPS job id -> {'state', 'printer', 'updated_at'}
+        self._active = set()      # job ids CUPS last reported as not completed
+        self._finished = deque()  # finished job ids, oldest first
+        self._printers = {}
+        self._printers_at = 0
+        self._conn = None
+        self._local_conn = threading.local()
+
+        self.metrics = {
+            'polls': 0,
+            'poll_errors': 0,
+            'last_poll_at': 0.0,
+            'last_poll_time': 0.0,
+            'total_poll_time': 0.0,
+            'jobs_added': 0,
+            'jobs_changed': 0,
+            'jobs_finished': 0,
+            'lookup_hits': 0,
+            'lookup_misses': 0,
+            'printer_refreshes': 0
+        }
+
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self.refresh_printers()
+        self.poll()
+        self._thread = threading.Thread(target=self._run, name='cups-state', daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    def get_job_state(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job:
+                self.metrics['lookup_hits'] += 1
+                return job['state']
+            self.metrics['lookup_misses'] += 1
+
+        # a job that finished between polls was never seen as active;
+        # ask CUPS about that one job instead of fetching the whole table
+        try:
+            attrs = self._lookup_connection().getJobAttributes(job_id, requested_attributes=JOB_ATTRIBUTES)
+        except Exception as e:
+            logging.error(f"Job status error: {e}")
+            return 'unknown'
+        with self._lock:
+            if JOB_STATES.get(attrs.get('job-state')) not in FINAL_STATES:
+                # still running: the poller must follow it to a final state
+                self._active.add(job_id)
+            self._store(job_id, attrs, time.time())
+            return self._jobs[job_id]['state']
+
+    def get_printers(self):
+        # refreshed by the poller thread once printer_ttl has passed
+        with self._lock:
+            return dict(self._printers)
+
+    def refresh_printers(self):
+        try:
+            printers = self._poll_connection().getPrinters()
+        except Exception as e:
+            logging.error(f"Printer refresh error: {e}")
+            return False
+        with self._lock:
+            self._printers = printers
+            self._printers_at = time.time()
+            self.metrics['printer_refreshes'] += 1
+        return True
+
+    def poll(self):
+        start = time.monotonic()
+        try:
+            active = self._poll_connection().getJobs(
+                which_jobs='not-completed',
+                requested_attributes=JOB_ATTRIBUTES
+            )
+        except Exception as e:
+            logging.error(f"CUPS poll error: {e}")
+            with self._lock:
+                self.metrics['poll_errors'] += 1
+            self._conn = None
+            return False
+
+        now = time.time()
+        with self._lock:
+            vanished = self._active - set(active)
+            self._active = set(active)
+            for job_id, attrs in active.items():
+                self._store(job_id, attrs, now)
+
+        # jobs that left the not-completed list have reached a final
+        # state; only those are fetched individually
+        finals = {}
+        for job_id in vanished:
+            try:
+                finals[job_id] = self._poll_connection().getJobAttributes(
+                    job_id, requested_attributes=JOB_ATTRIBUTES
+                )
+            except Exception:
+                # it is finished either way; record it without a state
+                finals[job_id] = {}
+
+        elapsed = time.monotonic() - start
+        with self._lock:
+            for job_id, attrs in finals.items():
+                self._store(job_id, attrs, now)
+            self.metrics['polls'] += 1
+            self.metrics['last_poll_at'] = now
+            self.metrics['last_poll_time'] = elapsed
+            self.metrics['total_poll_time'] += elapsed
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['jobs'] = len(self._jobs)
+            stats['active_jobs'] = len(self._active)
+            stats['printers'] = len(self._printers)
+            stats['staleness'] = time.time() - stats['last_poll_at'] if stats['last_poll_at'] else None
+            stats['printer_age'] = time.time() - self._printers_at if self._printers_at else None
+            stats['avg_poll_time'] = stats['total_poll_time'] / stats['polls'] if stats['polls'] else 0.0
+        return stats
+
+    def _store(self, job_id, attrs, now):
+        state = JOB_STATES.get(attrs.get('job-state'), 'unknown')
+        printer = attrs.get('job-printer-uri', '').rsplit('/', 1)[-1] or None
+        job = self._jobs.get(job_id)
+        if job is None:
+            self._jobs[job_id] = {'state': state, 'printer': printer, 'updated_at': now}
+            self.metrics['jobs_added'] += 1
+        elif job['state'] != state:
+            job['state'] = state
+            job['updated_at'] = now
+            self.metrics['jobs_changed'] += 1
+        else:
+            return
+
+        if state in FINAL_STATES or job_id not in self._active:
+            self._finished.append(job_id)
+            self.metrics['jobs_finished'] += 1
+            while len(self._finished) > self.keep_finished:
+                old = self._finished.popleft()
+                if old not in self._active:
+                    self._jobs.pop(old, None)
+
+    def _poll_connection(self):
+        if self._conn is None:
+            self._conn = self.connect()
+        return self._conn
+
+    def _lookup_connection(self):
+        # request threads get their own connection, never the poller's
+        conn = getattr(self._local_conn, 'conn', None)
+        if conn is None:
+            conn = self._local_conn.conn = self.connect()
+        return conn
+
+    def _run(self):
+        while not self._stop.wait(self.poll_interval):
+            self.poll()
+            if time.time() - self._printers_at > self.printer_ttl:
+                self.refresh_printers()
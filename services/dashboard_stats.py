@@ -0,0 +1,182 @@
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import date
+
+
+class DashboardStats:
+    # Admin dashboard figures kept up to date by the events that change
+    # them (logins, sessions, billing transactions, print jobs), so a page
+    # load or a push never runs an aggregate query. reconcile() is called
+    # every reconcile_interval seconds and returns the authoritative values
+    # it can get ({'revenue', 'deposits', 'sessions'}), which overwrite the
+    # incremental ones and bound any drift. price_sessions(rows, now), e.g.
+    # PricingEngine.preview_sessions, gives each active session's cost so far.
+    def __init__(self, reconcile=None, reconcile_interval=300, clock=time.time, price_sessions=None):
+        self.reconcile = reconcile
+        self.reconcile_interval = reconcile_interval
+        self.price_sessions = price_sessions
+        self.clock = clock
+
+        self._lock = threading.Condition()
+        self._version = 0
+        self._day = date.today()
+        self._totals = self._empty_totals()
+        self._sessions = {}  # session id -> dashboard row
+
+        self.metrics = {
+            'events': 0,
+            'reconciles': 0,
+            'reconcile_errors': 0,
+            'last_reconcile_at': 0.0,
+            'last_revenue_drift': 0.0
+        }
+
+        self._stop = threading.Event()
+        self._thread = None
+        if reconcile:
+            self._thread = threading.Thread(target=self._run, name='dashboard-reconcile', daemon=True)
+            self._thread.start()
+
+    def record_login(self, user_id):
+        with self._update():
+            self._totals['logins'] += 1
+
+    def session_started(self, session):
+        with self._update():
+            self._sessions[session['id']] = self._row(session)
+
+    def session_ended(self, session):
+        with self._update():
+            self._sessions.pop(session['id'], None)
+
+    def record_transaction(self, user_id, amount, transaction_type):
+        with self._update():
+            if transaction_type == 'charge':
+                self._totals['revenue'] += amount
+            elif transaction_type == 'refund':
+                self._totals['revenue'] -= amount
+            else:
+                self._totals['deposits'] += amount
+
+    def print_submitted(self, job):
+        with self._update():
+            self._totals['print_jobs'] += 1
+            self._totals['printing'] += 1
+
+    def print_finished(self, job):
+        with self._update():
+            self._totals['printing'] = max(self._totals['printing'] - 1, 0)
+            if job['status'] != 'done':
+                self._totals['print_failures'] += 1
+
+    def snapshot(self):
+        with self._lock:
+            return self._snapshot()
+
+    def wait(self, version, timeout):
+        # the next snapshot newer than version, or None after timeout;
+        # several events in a row are coalesced into one snapshot
+        with self._lock:
+            if self._version == version:
+                self._lock.wait(timeout)
+            if self._version == version:
+                return None
+            return self._snapshot()
+
+    def reconcile_now(self):
+        try:
+            values = self.reconcile()
+        except Exception as e:
+            with self._lock:
+                self.metrics['reconcile_errors'] += 1
+            logging.error(f"Dashboard reconcile error: {e}")
+            return False
+
+        with self._update():
+            if values.get('revenue') is not None:
+                self.metrics['last_revenue_drift'] = round(self._totals['revenue'] - values['revenue'], 2)
+                self._totals['revenue'] = values['revenue']
+            if values.get('deposits') is not None:
+                self._totals['deposits'] = values['deposits']
+            if values.get('sessions') is not None:
+                self._sessions = {session['id']: self._row(session) for session in values['sessions']}
+            self.metrics['reconciles'] += 1
+            self.metrics['last_reconcile_at'] = self.clock()
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['version'] = self._version
+        return stats
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+
+    @contextmanager
+    def _update(self):
+        # applies one event under the lock and wakes every waiting stream
+        with self._lock:
+            self._roll_day()
+            yield
+            self._version += 1
+            self.metrics['events'] += 1
+            self._lock.notify_all()
+
+    def _empty_totals(self):
+        return {
+            'revenue': 0.0,
+            'deposits': 0.0,
+            'logins': 0,
+            'print_jobs': 0,
+            'printing': 0,
+            'print_failures': 0
+        }
+
+    def _roll_day(self):
+        today = date.today()
+        if today != self._day:
+            printing = self._totals['printing']
+            self._day = today
+            self._totals = self._empty_totals()
+            self._totals['printing'] = printing
+
+    def _row(self, session):
+        return {
+            'id': session['id'],
+            'user': session['user_id'],
+            'ip_address': session.get('ip_address'),
+            'started_at': session['started_at']
+        }
+
+    def _snapshot(self):
+        now = self.clock()
+        sessions = sorted(self._sessions.values(), key=lambda row: row['started_at'])
+        costs = self.price_sessions(sessions, now) if self.price_sessions else {}
+        return {
+            'version': self._version,
+            'day': self._day.isoformat(),
+            'active_users': len({row['user'] for row in sessions}),
+            'revenue': round(self._totals['revenue'], 2),
+            'deposits': round(self._totals['deposits'], 2),
+            'logins': self._totals['logins'],
+            'print_jobs': self._totals['print_jobs'],
+            'printing': self._totals['printing'],
+            'print_failures': self._totals['print_failures'],
+            'active_sessions': [
+                dict(
+                    row,
+                    duration_minutes=round((now - row['started_at']) / 60, 1),
+                    cost=round(costs.get(row['id'], 0.0), 2)
+                )
+                for row in sessions
+            ]
+        }
+
+    def _run(self):
+        while not self._stop.wait(self.reconcile_interval):
+            self.reconcile_now()
@@ -0,0 +1,186 @@
+import threading
+import time
+import logging
+from collections import deque
+from contextlib import contextmanager
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool:
+    def __init__(self, connect, size=5, timeout=5.0, max_lifetime=3600, health_check_interval=30):
+        # connect is any zero-argument callable returning a DB-API connection,
+        # so a local stand-in (e.g. sqlite3) can be used instead of MySQL
+        self.connect = connect
+        self.size = size
+        self.timeout = timeout
+        self.max_lifetime = max_lifetime
+        self.health_check_interval = health_check_interval
+
+        self._lock = threading.Condition()
+        self._idle = deque()      # (conn, created_at, last_used)
+        self._born = {}           # id(conn) -> created_at for checked-out conns
+        self._total = 0
+        self._closed = False
+
+        self.metrics = {
+            'created': 0,
+            'recycled': 0,
+            'health_failures': 0,
+            'checkouts': 0,
+            'waits': 0,
+            'wait_time': 0.0,
+            'max_wait_time': 0.0,
+            'timeouts': 0
+        }
+
+    def get_connection(self, timeout=None):
+        if timeout is None:
+            timeout = self.timeout
+        deadline = time.monotonic() + timeout
+        waited = False
+        wait_start = None
+
+        with self._lock:
+            while True:
+                if self._closed:
+                    raise PoolTimeout("Connection pool is closed")
+
+                if self._idle:
+                    conn, created_at, last_used = self._idle.pop()
+                    break
+
+                if self._total < self.size:
+                    # reserve the slot, then connect outside the lock
+                    self._total += 1
+                    conn = None
+                    break
+
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    self.metrics['timeouts'] += 1
+                    raise PoolTimeout(f"No database connection available after {timeout}s")
+                if not waited:
+                    waited = True
+                    wait_start = time.monotonic()
+                    self.metrics['waits'] += 1
+                self._lock.wait(remaining)
+
+            if waited:
+                wait_time = time.monotonic() - wait_start
+                self.metrics['wait_time'] += wait_time
+                self.metrics['max_wait_time'] = max(self.metrics['max_wait_time'], wait_time)
+
+        if conn is not None:
+            now = time.monotonic()
+            if now - created_at > self.max_lifetime:
+                self._count('recycled')
+                self._close_quietly(conn)
+                conn = None
+            elif now - last_used > self.health_check_interval and not self._is_healthy(conn):
+                self._count('health_failures')
+                self._close_quietly(conn)
+                conn = None
+
+        if conn is None:
+            try:
+                conn = self.connect()
+            except Exception:
+                self._forget_slot()
+                raise
+            created_at = time.monotonic()
+            self._count('created')
+
+        with self._lock:
+            self._born[id(conn)] = created_at
+            self.metrics['checkouts'] += 1
+        return conn
+
+    def release(self, conn, discard=False):
+        if not discard:
+            # end any open transaction so the next borrower does not read
+            # from a stale REPEATABLE READ snapshot
+            try:
+                conn.rollback()
+            except Exception as e:
+                logging.error(f"Error resetting database connection: {e}")
+                discard = True
+
+        with self._lock:
+            created_at = self._born.pop(id(conn), None)
+            if created_at is None:
+                return
+            if discard or self._closed:
+                self._total -= 1
+            else:
+                self._idle.append((conn, created_at, time.monotonic()))
+            self._lock.notify()
+
+        if discard or self._closed:
+            self._close_quietly(conn)
+
+    @contextmanager
+    def release_on_exit(self, conn):
+        # a connection that raised mid-transaction is in an unknown state,
+        # so it is thrown away rather than handed to the next caller
+        try:
+            yield conn
+        except Exception:
+            self.release(conn, discard=True)
+            raise
+        self.release(conn)
+
+    @contextmanager
+    def connection(self, timeout=None):
+        conn = self.get_connection(timeout)
+        with self.release_on_exit(conn):
+            yield conn
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['size'] = self.size
+            stats['open'] = self._total
+            stats['idle'] = len(self._idle)
+            stats['in_use'] = len(self._born)
+        return stats
+
+    def close(self):
+        with self._lock:
+            self._closed = True
+            idle = list(self._idle)
+            self._idle.clear()
+            self._total -= len(idle)
+            self._lock.notify_all()
+        for conn, _, _ in idle:
+            self._close_quietly(conn)
+
+    def _count(self, name):
+        with self._lock:
+            self.metrics[name] += 1
+
+    def _forget_slot(self):
+        with self._lock:
+            self._total -= 1
+            self._lock.notify()
+
+    def _is_healthy(self, conn):
+        try:
+            if hasattr(conn, 'is_connected'):
+                return conn.is_connected()
+            cursor = conn.cursor()
+            cursor.execute("SELECT 1")
+            cursor.fetchall()
+            cursor.close()
+            return True
+        except Exception as e:
+            logging.error(f"Database health check failed: {e}")
+            return False
+
+    def _close_quietly(self, conn):
+        try:
+            conn.close()
+        except Exception as e:
+            logging.error(f"Error closing database connection: {e}")
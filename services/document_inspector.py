@@ -0,0 +1,249 @@
+import asyncio
+import logging
+import multiprocessing
+import os
+import re
+import threading
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+try:
+    import pypdf
+except ImportError:
+    pypdf = None
+
+try:
+    from PIL import Image, ImageSequence
+except ImportError:
+    Image = None
+
+IMAGE_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.bmp', '.tif', '.tiff', '.webp')
+
+# colour-setting operators in a PDF content stream: RGB (rg/RG), CMYK (k/K)
+# and generic sc/scn with three or four operands
+RGB_OPERATOR = re.compile(rb'(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+(rg|RG|sc|SC|scn|SCN)\b')
+CMYK_OPERATOR = re.compile(rb'(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+(-?[\d.]+)\s+(k|K|sc|SC|scn|SCN)\b')
+COLOR_IMAGE = re.compile(rb'/ColorSpace\s*/Device(RGB|CMYK)')
+PAGE_OBJECT = re.compile(rb'/Type\s*/Page(?![a-zA-Z])')
+STREAM = re.compile(rb'stream\r?\n(.*?)endstream', re.S)
+
+
+def inspect_document(path):
+    # runs in a worker process; returns page and colour-page counts
+    ext = os.path.splitext(path)[1].lower()
+    with open(path, 'rb') as f:
+        head = f.read(8)
+
+    if head.startswith(b'%PDF') or ext == '.pdf':
+        if pypdf is not None:
+            return _inspect_pdf(path)
+        return _inspect_pdf_raw(path)
+    if ext in IMAGE_EXTENSIONS and Image is not None:
+        return _inspect_image(path)
+    return {'kind': 'unknown', 'pages': 1, 'color_pages': 0}
+
+
+def _has_color(data):
+    for match in RGB_OPERATOR.finditer(data):
+        r, g, b = (float(value) for value in match.groups()[:3])
+        if not (r == g == b):
+            return True
+    for match in CMYK_OPERATOR.finditer(data):
+        c, m, y = (float(value) for value in match.groups()[:3])
+        if c or m or y:
+            return True
+    return bool(COLOR_IMAGE.search(data))
+
+
+def _inspect_pdf(path):
+    reader = pypdf.PdfReader(path)
+    color_pages = 0
+    for page in reader.pages:
+        contents = page.get_contents()
+        data = contents.get_data() if contents is not None else b''
+        color_image = False
+        resources = page.get('/Resources')
+        if resources is not None:
+            xobjects = resources.get_object().get('/XObject')
+            if xobjects is not None:
+                color_image = any(
+                    xobject.get_object().get('/ColorSpace') in ('/DeviceRGB', '/DeviceCMYK')
+                    for xobject in xobjects.get_object().values()
+                )
+        if color_image or _has_color(data):
+            color_pages += 1
+    return {'kind': 'pdf', 'pages': len(reader.pages), 'color_pages': color_pages}
+
+
+def _inspect_pdf_raw(path):
+    # stdlib-only fallback: page objects and colour operators are found by
+    # scanning the file and its inflated streams, so colour is only known
+    # per document, not per page
+    with open(path, 'rb') as f:
+        raw = f.read()
+
+    chunks = [raw]
+    for match in STREAM.finditer(raw):
+        try:
+            chunks.append(zlib.decompress(match.group(1)))
+        except zlib.error:
+            continue
+
+    pages = sum(len(PAGE_OBJECT.findall(chunk)) for chunk in chunks) or 1
+    color = any(_has_color(chunk) for chunk in chunks[1:]) or bool(COLOR_IMAGE.search(raw))
+    return {'kind': 'pdf', 'pages': pages, 'color_pages': pages if color else 0}
+
+
+def _inspect_image(path):
+    pages = 0
+    color_pages = 0
+    with Image.open(path) as image:
+        for frame in ImageSequence.Iterator(image):
+            pages += 1
+            if frame.mode in ('1', 'L', 'LA', 'I', 'F', 'I;16'):
+                continue
+            sample = frame.convert('RGB')
+            sample.thumbnail((64, 64))
+            if any(max(pixel) - min(pixel) > 16 for pixel in sample.getdata()):
+                color_pages += 1
+    return {'kind': 'image', 'pages': pages, 'color_pages': color_pages}
+
+
+class InspectorUnavailable(Exception):
+    pass
+
+
+class DocumentInspector:
+    # The worker pool is forked once, while the process is still single
+    # threaded. A pool that breaks (a worker killed by a hostile document)
+    # is not re-forked: forking a threaded server can deadlock the child,
+    # and spawn/forkserver workers would re-import app.py, which builds
+    # this pool itself. Inspections then raise InspectorUnavailable and
+    # status() reports failed, so /ready takes the process out of rotation
+    # until it is restarted.
+    def __init__(self, workers=2, cache_size=256, timeout=30.0):
+        self.workers = workers
+        self.cache_size = cache_size
+        self.timeout = timeout
+
+        # reentrant: a future that is already done runs its callback
+        # synchronously inside inspect() while the lock is held
+        self._lock = threading.RLock()
+        self._pool = self._start_pool()
+        self._error = None
+        self._cache = OrderedDict()  # content hash -> result
+        self._inflight = {}          # content hash -> future
+
+        self.metrics = {
+            'inspections': 0,
+            'cache_hits': 0,
+            'joined': 0,
+            'errors': 0,
+            'timeouts': 0
+        }
+
+    def submit(self, path, digest):
+        # the analysis runs in a separate process, so a large document only
+        # occupies the request waiting for it, not the server's GIL; the
+        # returned future is already done for a cached document
+        with self._lock:
+            result = self._cache.get(digest)
+            if result is not None:
+                self._cache.move_to_end(digest)
+                self.metrics['cache_hits'] += 1
+                future = Future()
+                future.set_result(result)
+                return future
+
+            future = self._inflight.get(digest)
+            if future is not None:
+                self.metrics['joined'] += 1
+            else:
+                if self._error is not None:
+                    raise InspectorUnavailable(f"Document inspection unavailable: {self._error}")
+                try:
+                    future = self._pool.submit(inspect_document, path)
+                except BrokenProcessPool as e:
+                    self._broken(e)
+                    raise InspectorUnavailable(f"Document inspection unavailable: {e}")
+                self._inflight[digest] = future
+                future.add_done_callback(lambda f: self._store(digest, f))
+                self.metrics['inspections'] += 1
+        return future
+
+    def inspect(self, path, digest):
+        try:
+            return dict(self.submit(path, digest).result(timeout=self.timeout))
+        except TimeoutError:
+            with self._lock:
+                self.metrics['timeouts'] += 1
+            raise
+        except BrokenProcessPool as e:
+            raise InspectorUnavailable(f"Document inspection unavailable: {e}")
+
+    async def inspect_async(self, path, digest):
+        # shielded, so a timeout here does not cancel an inspection that
+        # other requests may have joined
+        future = asyncio.wrap_future(self.submit(path, digest))
+        try:
+            return dict(await asyncio.wait_for(asyncio.shield(future), self.timeout))
+        except TimeoutError:
+            with self._lock:
+                self.metrics['timeouts'] += 1
+            raise
+        except BrokenProcessPool as e:
+            raise InspectorUnavailable(f"Document inspection unavailable: {e}")
+
+    def status(self):
+        with self._lock:
+            if self._error is not None:
+                return {'state': 'failed', 'error': self._error}
+        return {'state': 'ready', 'error': None}
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['cached'] = len(self._cache)
+            stats['inflight'] = len(self._inflight)
+            stats['broken'] = self._error is not None
+        return stats
+
+    def close(self):
+        if self._pool:
+            self._pool.shutdown(wait=False, cancel_futures=True)
+
+    def _start_pool(self):
+        # Workers are forked up front, so build this before the app starts
+        # its background threads. spawn/forkserver would re-run app.py as
+        # __mp_main__ in every worker, starting a second ledger and spool;
+        # only ever called from __init__.
+        pool = ProcessPoolExecutor(
+            max_workers=self.workers,
+            mp_context=multiprocessing.get_context('fork')
+        )
+        pool.submit(os.getpid).result()
+        return pool
+
+    def _store(self, digest, future):
+        with self._lock:
+            self._inflight.pop(digest, None)
+            if future.cancelled():
+                return
+            error = future.exception()
+            if error is not None:
+                if isinstance(error, BrokenProcessPool):
+                    self._broken(error)
+                self.metrics['errors'] += 1
+                logging.error(f"Document inspection error: {error}")
+                return
+            self._cache[digest] = future.result()
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _broken(self, error):
+        with self._lock:
+            if self._error is None:
+                self._error = str(error) or 'worker pool is broken'
+                logging.error(f"Document inspection pool is broken, inspections fail until restart: {error}")
@@ -0,0 +1,134 @@
+import os
+import select
+import sys
+import threading
+from collections import OrderedDict
+
+# key under which a trie node stores its verdict; labels are never empty
+VERDICT = ''
+
+
+class DomainPolicy:
+    # Compiles the proxy's allow/block lists into a trie keyed by reversed
+    # labels ('www.twitter.com' -> com, twitter, www), so a lookup costs one
+    # dict step per label however long the lists get. The most specific
+    # listed suffix wins: blocking twitter.com overrides allowing com, and
+    # allowing api.twitter.com would override that again. Hosts matching no
+    # entry are denied when there is an allow list, allowed otherwise.
+    def __init__(self, allowed_domains=(), blocked_domains=(), cache_size=65536):
+        self.cache_size = cache_size
+        self.default = not allowed_domains
+
+        self._trie = {}
+        for domain in allowed_domains:
+            self._add(domain, True)
+        # added last so a domain on both lists is blocked
+        for domain in blocked_domains:
+            self._add(domain, False)
+
+        self._lock = threading.Lock()
+        self._cache = OrderedDict()  # normalized host -> verdict
+
+        self.metrics = {
+            'lookups': 0,
+            'cache_hits': 0,
+            'allowed': 0,
+            'blocked': 0
+        }
+
+    def is_allowed(self, host):
+        host = normalize(host)
+        with self._lock:
+            self.metrics['lookups'] += 1
+            verdict = self._cache.get(host)
+            if verdict is not None:
+                self._cache.move_to_end(host)
+                self.metrics['cache_hits'] += 1
+            else:
+                verdict = self._match(host)
+                self._cache[host] = verdict
+                if len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+            self.metrics['allowed' if verdict else 'blocked'] += 1
+        return verdict
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['cached'] = len(self._cache)
+        stats['hit_rate'] = stats['cache_hits'] / stats['lookups'] if stats['lookups'] else 0.0
+        return stats
+
+    def _add(self, domain, verdict):
+        node = self._trie
+        for label in reversed(normalize(domain).split('.')):
+            node = node.setdefault(label, {})
+        node[VERDICT] = verdict
+
+    def _match(self, host):
+        verdict = self.default
+        node = self._trie
+        for label in reversed(host.split('.')):
+            node = node.get(label)
+            if node is None:
+                break
+            verdict = node.get(VERDICT, verdict)
+        return verdict
+
+
+def normalize(host):
+    host = host.strip().lower()
+    if host.startswith('['):
+        # bracketed IPv6 literal, maybe with a port
+        return host[1:host.find(']')] if ']' in host else host[1:]
+    if host.count(':') == 1:
+        host = host.split(':', 1)[0]
+    return host.rstrip('.')
+
+
+def serve_squid_helper(policy, stdin=None, stdout=None):
+    # Squid external ACL helper protocol, e.g.
+    #   external_acl_type cafe_domains ttl=60 concurrency=100 %DST python3 services/domain_filter.py
+    # With concurrency > 0 each request line starts with a channel id that
+    # the reply must echo. Squid keeps up to `concurrency` requests in
+    # flight, so every line already waiting on stdin is answered as one
+    # batch and the replies go out in a single write.
+    stdin = stdin or sys.stdin.buffer
+    stdout = stdout or sys.stdout.buffer
+    fd = stdin.fileno()
+    buffer = b''
+    eof = False
+    while not eof:
+        chunk = os.read(fd, 65536)
+        eof = not chunk
+        buffer += chunk
+        while not eof and select.select([fd], [], [], 0)[0]:
+            chunk = os.read(fd, 65536)
+            eof = not chunk
+            buffer += chunk
+
+        lines = buffer.split(b'\n')
+        buffer = b'' if eof else lines.pop()
+        replies = []
+        for line in lines:
+            fields = line.decode('utf-8', 'replace').split()
+            if not fields:
+                continue
+            channel = ''
+            if fields[0].isdigit() and len(fields) > 1:
+                channel = fields.pop(0) + ' '
+            replies.append(f"{channel}{'OK' if policy.is_allowed(fields[0]) else 'ERR'}\n")
+        if replies:
+            stdout.write(''.join(replies).encode())
+            stdout.flush()
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    from config.config import Config
+    proxy = Config.PROXY_CONFIG
+    serve_squid_helper(DomainPolicy(
+        proxy['allowed_domains'],
+        proxy['blocked_domains'],
+        proxy.get('decision_cache_size', 65536)
+    ))
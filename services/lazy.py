@@ -0,0 +1,77 @@
+import logging
+import threading
+import time
+
+
+class ServiceUnavailable(Exception):
+    pass
+
+
+class LazyService:
+    # Stands in for a service object and builds it on first use (or in the
+    # background via warm_up), so importing the app never blocks on the
+    # service's dependencies. A failed build is retried after retry_interval.
+    def __init__(self, name, factory, retry_interval=5.0):
+        self._name = name
+        self._factory = factory
+        self._retry_interval = retry_interval
+        self._lock = threading.Lock()
+        self._instance = None
+        self._state = 'pending'
+        self._error = None
+        self._failed_at = 0
+        self._init_time = None
+
+    def __getattr__(self, attr):
+        return getattr(self.get(), attr)
+
+    def get(self):
+        instance = self._instance
+        if instance is not None:
+            return instance
+
+        with self._lock:
+            if self._instance is not None:
+                return self._instance
+            if self._state == 'failed' and time.monotonic() - self._failed_at < self._retry_interval:
+                raise ServiceUnavailable(f"{self._name} unavailable: {self._error}")
+
+            self._state = 'initializing'
+            start = time.monotonic()
+            try:
+                instance = self._factory()
+            except Exception as e:
+                self._state = 'failed'
+                self._error = str(e)
+                self._failed_at = time.monotonic()
+                logging.error(f"{self._name} initialization error: {e}")
+                raise ServiceUnavailable(f"{self._name} unavailable: {e}")
+
+            self._init_time = time.monotonic() - start
+            self._state = 'ready'
+            self._error = None
+            self._instance = instance
+            return instance
+
+    def warm_up(self):
+        def build():
+            try:
+                self.get()
+            except ServiceUnavailable:
+                pass
+        threading.Thread(target=build, name=f'{self._name}-warmup', daemon=True).start()
+
+    def is_ready(self):
+        return self._instance is not None
+
+    def status(self):
+        return {
+            'state': self._state,
+            'error': self._error,
+            'init_time': self._init_time
+        }
+
+    def close(self):
+        # never builds the service just to shut it down
+        if self._instance is not None and hasattr(self._instance, 'close'):
+            self._instance.close()
@@ -0,0 +1,393 @@
+import fcntl
+import glob
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from collections import deque, defaultdict
+
+
+class LedgerSchemaError(Exception):
+    pass
+
+
+class LedgerWriter:
+    # Each process journals to its own <journal_path>.<id> file, held with
+    # an flock on <file>.lock for as long as the process lives. At startup
+    # a writer adopts every journal whose lock is free (its process has
+    # exited) along with the legacy shared <journal_path>, re-journals
+    # their uncommitted charges as its own and deletes them.
+    #
+    # Every charge carries a ledger_key, stored in the unique
+    # billing.ledger_key column. A batch skips keys already in the table,
+    # so a charge replayed after a crash between the DB commit and the
+    # journal update is not applied twice. The column is checked for at
+    # startup (LedgerSchemaError if it is missing) rather than discovered
+    # by every batch failing; add it with
+    #   ALTER TABLE billing ADD COLUMN ledger_key VARCHAR(64) NULL,
+    #       ADD UNIQUE KEY billing_ledger_key (ledger_key);
+    def __init__(self, pool, journal_path, max_batch=100, max_latency=0.5,
+                 fsync=True, compact_bytes=1024 * 1024):
+        self.pool = pool
+        self.journal_prefix = journal_path
+        self.journal_id = uuid.uuid4().hex
+        self.journal_path = f"{journal_path}.{self.journal_id}"
+        self.max_batch = max_batch
+        self.max_latency = max_latency
+        self.fsync = fsync
+        self.compact_bytes = compact_bytes
+
+        self._lock = threading.Condition()
+        self._commit_lock = threading.Lock()
+        self._queue = deque()              # entries waiting for the DB
+        self._pending = defaultdict(float)  # user_id -> queued charge total
+        self._seq = 0
+        self._committed_seq = 0
+        # even while idle, odd while a batch is being committed; lets
+        # read_through() detect a flush racing with its DB read
+        self._epoch = 0
+        self._flush_target = 0
+        self._closed = False
+        self._backoff = 0
+        self._retry_at = 0
+
+        self.metrics = {
+            'submitted': 0,
+            'committed': 0,
+            'batches': 0,
+            'failures': 0,
+            'replayed': 0,
+            'duplicates': 0,
+            'last_batch_size': 0,
+            'last_flush_time': 0.0
+        }
+
+        self._check_schema()
+
+        journal_dir = os.path.dirname(journal_path)
+        if journal_dir and not os.path.exists(journal_dir):
+            os.makedirs(journal_dir)
+        # taken before the journal exists, so no other writer can adopt it
+        self._journal_lock = try_lock(self.journal_path + '.lock')
+        self._replay()
+        self._journal = open(self.journal_path, 'a')
+
+        self._thread = threading.Thread(target=self._run, name='ledger-writer', daemon=True)
+        self._thread.start()
+
+    def submit(self, user_id, amount, description, transaction_type='charge'):
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Ledger writer is closed")
+            self._seq += 1
+            entry = {
+                'seq': self._seq,
+                'key': f"{self.journal_id}-{self._seq}",
+                'user_id': user_id,
+                'amount': amount,
+                'description': description,
+                'transaction_type': transaction_type,
+                'queued_at': time.time()
+            }
+            self._append(entry)
+            self._enqueue(entry)
+            self.metrics['submitted'] += 1
+            if len(self._queue) >= self.max_batch:
+                self._lock.notify_all()
+            return entry['seq']
+
+    def pending_total(self, user_id):
+        with self._lock:
+            return self._pending.get(user_id, 0.0)
+
+    def read_through(self, user_id, read):
+        # read() returns the committed DB balance; queued charges are
+        # subtracted so callers see their own writes before the flush
+        for _ in range(3):
+            epoch = self._epoch
+            if epoch % 2:
+                time.sleep(0.001)
+                continue
+            balance = read()
+            with self._lock:
+                if self._epoch == epoch:
+                    return self._apply_pending(user_id, balance)
+
+        with self._commit_lock:
+            balance = read()
+            with self._lock:
+                return self._apply_pending(user_id, balance)
+
+    def flush(self, timeout=None):
+        with self._lock:
+            target = self._seq
+            self._flush_target = max(self._flush_target, target)
+            self._lock.notify_all()
+            deadline = None if timeout is None else time.monotonic() + timeout
+            while self._committed_seq < target:
+                remaining = None if deadline is None else deadline - time.monotonic()
+                if remaining is not None and remaining <= 0:
+                    return False
+                self._lock.wait(remaining)
+            return True
+
+    def close(self, timeout=10.0):
+        flushed = self.flush(timeout)
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        self._thread.join(timeout)
+        if not self._thread.is_alive():
+            self._journal.close()
+            if flushed:
+                # nothing left to replay; the lock is released with it
+                os.remove(self.journal_path)
+                os.remove(self.journal_path + '.lock')
+                self._journal_lock.close()
+        if not flushed:
+            logging.error(f"Ledger closed with {len(self._queue)} charges left in {self.journal_path}")
+        return flushed
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['queued'] = len(self._queue)
+            stats['oldest_age'] = time.time() - self._queue[0]['queued_at'] if self._queue else 0.0
+        return stats
+
+    def _apply_pending(self, user_id, balance):
+        if balance is None:
+            return None
+        return balance - self._pending.get(user_id, 0.0)
+
+    def _enqueue(self, entry):
+        self._queue.append(entry)
+        self._pending[entry['user_id']] += entry['amount']
+
+    def _append(self, record):
+        self._journal.write(json.dumps(record) + '\n')
+        self._journal.flush()
+        if self.fsync:
+            os.fsync(self._journal.fileno())
+
+    def _check_schema(self):
+        try:
+            with self.pool.connection() as conn:
+                cursor = conn.cursor()
+                cursor.execute("SELECT ledger_key FROM billing WHERE 1 = 0")
+                cursor.fetchall()
+                cursor.close()
+                conn.rollback()
+        except Exception as e:
+            if 'ledger_key' in str(e):
+                raise LedgerSchemaError(
+                    "billing.ledger_key is missing; run ALTER TABLE billing ADD COLUMN ledger_key "
+                    "VARCHAR(64) NULL, ADD UNIQUE KEY billing_ledger_key (ledger_key)"
+                ) from e
+            # the database is down: charges are journaled until it is back,
+            # and a missing column then shows up as flush errors
+            logging.warning(f"Ledger could not check the billing schema: {e}")
+
+    def _replay(self):
+        # adopts the journals of writers that have exited; their lock is
+        # held until the charges are safely in our own journal
+        entries = {}
+        adopted = []
+        for path in self._orphaned_journals():
+            lock = try_lock(path + '.lock')
+            if lock is None:
+                # its process is still running
+                continue
+            adopted.append((path, lock))
+            for entry in read_journal(path):
+                entries.setdefault(entry['key'], entry)
+
+        for entry in sorted(entries.values(), key=lambda entry: entry['queued_at']):
+            self._seq += 1
+            self._enqueue(dict(entry, seq=self._seq))
+            self.metrics['replayed'] += 1
+        self._rewrite_journal()
+
+        for path, lock in adopted:
+            for stale in (path, path + '.lock'):
+                try:
+                    os.remove(stale)
+                except FileNotFoundError:
+                    pass
+            lock.close()
+        if self.metrics['replayed']:
+            logging.info(f"Ledger replayed {self.metrics['replayed']} uncommitted charges from {len(adopted)} journals")
+
+    def _orphaned_journals(self):
+        prefix = glob.escape(self.journal_prefix)
+        names = glob.glob(prefix) + glob.glob(prefix + '.*')
+        journals = {name[:-len('.lock')] if name.endswith('.lock') else name
+                    for name in names if not name.endswith('.tmp')}
+        journals.discard(self.journal_path)
+        return sorted(journals)
+
+    def _rewrite_journal(self):
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(json.dumps({'committed': self._committed_seq}) + '\n')
+            for entry in self._queue:
+                f.write(json.dumps(entry) + '\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    def _next_batch(self):
+        with self._lock:
+            while True:
+                if self._queue:
+                    age = time.time() - self._queue[0]['queued_at']
+                    due = (len(self._queue) >= self.max_batch or age >= self.max_latency
+                           or self._committed_seq < self._flush_target or self._closed)
+                    backing_off = time.monotonic() < self._retry_at and not self._closed
+                    if due and not backing_off:
+                        return [self._queue[i] for i in range(min(self.max_batch, len(self._queue)))]
+                    if backing_off:
+                        wait = self._retry_at - time.monotonic()
+                    else:
+                        wait = self.max_latency - age
+                    self._lock.wait(max(wait, 0.001))
+                else:
+                    if self._closed:
+                        return None
+                    self._lock.wait()
+
+    def _run(self):
+        while True:
+            batch = self._next_batch()
+            if batch is None:
+                return
+            try:
+                self._commit(batch)
+            except Exception as e:
+                logging.error(f"Ledger flush error: {e}")
+                with self._lock:
+                    self.metrics['failures'] += 1
+                    if self._closed:
+                        # leave the rest in the journal for the next start
+                        return
+                    self._backoff = min(max(self._backoff * 2, 0.5), 30)
+                    self._retry_at = time.monotonic() + self._backoff
+            else:
+                self._backoff = 0
+                self._retry_at = 0
+
+    def _commit(self, batch):
+        keys = [entry['key'] for entry in batch]
+        start = time.monotonic()
+        with self._commit_lock:
+            with self._lock:
+                self._epoch += 1
+            try:
+                with self.pool.connection() as conn:
+                    cursor = conn.cursor()
+                    # charges already committed before a crash are skipped
+                    cursor.execute(f"""
+                        SELECT ledger_key
+                        FROM billing
+                        WHERE ledger_key IN ({', '.join(['%s'] * len(keys))})
+                    """, keys)
+                    done = {row[0] for row in cursor.fetchall()}
+                    fresh = [entry for entry in batch if entry['key'] not in done]
+
+                    totals = defaultdict(float)
+                    rows = []
+                    for entry in fresh:
+                        totals[entry['user_id']] += entry['amount']
+                        rows.append((
+                            entry['user_id'],
+                            entry['amount'],
+                            entry['description'],
+                            entry['transaction_type'],
+                            entry['key']
+                        ))
+
+                    # one UPDATE per user, in id order so concurrent
+                    # writers always take row locks in the same order
+                    if totals:
+                        cursor.executemany("""
+                            UPDATE users
+                            SET credit_balance = credit_balance - %s
+                            WHERE id = %s
+                        """, [(totals[user_id], user_id) for user_id in sorted(totals)])
+
+                    if rows:
+                        cursor.executemany("""
+                            INSERT INTO billing (
+                                user_id,
+                                amount,
+                                description,
+                                transaction_type,
+                                ledger_key
+                            ) VALUES (%s, %s, %s, %s, %s)
+                        """, rows)
+
+                    conn.commit()
+                    cursor.close()
+
+                with self._lock:
+                    for entry in batch:
+                        self._queue.popleft()
+                        self._pending[entry['user_id']] -= entry['amount']
+                        if abs(self._pending[entry['user_id']]) < 1e-9:
+                            del self._pending[entry['user_id']]
+                    self._committed_seq = batch[-1]['seq']
+                    self._append({'committed': self._committed_seq})
+                    if not self._queue:
+                        self._journal.seek(0)
+                        self._journal.truncate()
+                    elif self._journal.tell() > self.compact_bytes:
+                        self._journal.close()
+                        self._rewrite_journal()
+                        self._journal = open(self.journal_path, 'a')
+
+                    self.metrics['committed'] += len(batch)
+                    self.metrics['duplicates'] += len(batch) - len(fresh)
+                    self.metrics['batches'] += 1
+                    self.metrics['last_batch_size'] = len(batch)
+                    self.metrics['last_flush_time'] = time.monotonic() - start
+                    self._lock.notify_all()
+            finally:
+                with self._lock:
+                    self._epoch += 1
+
+
+def try_lock(path):
+    # an open file holding an exclusive flock on path, or None if another
+    # process holds it
+    lock = open(path, 'a')
+    try:
+        fcntl.flock(lock.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+        lock.close()
+        return None
+    return lock
+
+
+def read_journal(path):
+    # the entries of a journal not yet marked committed
+    entries = {}
+    committed = 0
+    try:
+        with open(path) as f:
+            for line in f:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    # torn write from a crash mid-append
+                    continue
+                if 'committed' in record:
+                    committed = max(committed, record['committed'])
+                else:
+                    # entries of the legacy shared journal had no key
+                    record.setdefault('key', f"{os.path.basename(path)}-{record['seq']}-{record['queued_at']}")
+                    entries[record['seq']] = record
+    except FileNotFoundError:
+        return []
+    return [entries[seq] for seq in sorted(entries) if seq > committed]
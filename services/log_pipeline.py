@@ -0,0 +1,211 @@
+import json
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import datetime
+
+
+class NonBlockingHandler(logging.Handler):
+    # Hands records to the writer thread, which applies the formatter; when
+    # the queue is full the record is dropped and counted instead of waiting.
+    def __init__(self, record_queue):
+        super().__init__()
+        self.queue = record_queue
+        self.dropped = 0
+
+    def emit(self, record):
+        try:
+            # the args may be objects the caller changes (or that are not
+            # thread-safe to read) once logging returns, so the message is
+            # merged on the calling thread, as QueueHandler.prepare does
+            record.msg = record.getMessage()
+            record.args = None
+        except Exception:
+            self.handleError(record)
+            return
+        if record.exc_info and not record.exc_text:
+            # tracebacks hold frames that may change before the writer
+            # gets to them, so render those on the calling thread
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            self.dropped += 1
+
+
+class RotatingSink:
+    def __init__(self, path, max_bytes=10 * 1024 * 1024, rotate_interval=86400, backup_count=7):
+        self.path = path
+        self.max_bytes = max_bytes
+        self.rotate_interval = rotate_interval
+        self.backup_count = backup_count
+        self._open()
+
+    def write(self, data):
+        if self._should_rotate(len(data)):
+            self.rotate()
+        self.stream.write(data)
+        self.size += len(data)
+
+    def flush(self):
+        self.stream.flush()
+
+    def close(self):
+        self.stream.close()
+
+    def rotate(self):
+        self.stream.close()
+        if os.path.exists(self.path) and os.path.getsize(self.path):
+            suffix = datetime.now().strftime('%Y%m%d-%H%M%S')
+            target = f"{self.path}.{suffix}"
+            n = 1
+            while os.path.exists(target):
+                target = f"{self.path}.{suffix}.{n}"
+                n += 1
+            os.rename(self.path, target)
+            self._prune()
+        self._open()
+
+    def _open(self):
+        log_dir = os.path.dirname(self.path)
+        if log_dir and not os.path.exists(log_dir):
+            os.makedirs(log_dir)
+        self.stream = open(self.path, 'a', encoding='utf-8')
+        self.size = self.stream.tell()
+        self.next_rollover = time.time() + self.rotate_interval if self.rotate_interval else None
+
+    def _should_rotate(self, incoming):
+        if self.max_bytes and self.size and self.size + incoming > self.max_bytes:
+            return True
+        return self.next_rollover is not None and time.time() >= self.next_rollover
+
+    def _prune(self):
+        if not self.backup_count:
+            return
+        log_dir = os.path.dirname(self.path) or '.'
+        prefix = os.path.basename(self.path) + '.'
+        backups = sorted(
+            name for name in os.listdir(log_dir)
+            if name.startswith(prefix) and name[len(prefix):len(prefix) + 1].isdigit()
+        )
+        for name in backups[:-self.backup_count]:
+            os.remove(os.path.join(log_dir, name))
+
+
+class LogPipeline:
+    def __init__(self, path, activity_path=None, queue_size=10000, batch_size=256,
+                 flush_interval=0.5, max_bytes=10 * 1024 * 1024, rotate_interval=86400,
+                 backup_count=7, fmt='%(asctime)s [%(levelname)s] - %(message)s'):
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.formatter = logging.Formatter(fmt)
+
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.handler = NonBlockingHandler(self.queue)
+
+        sink_options = {
+            'max_bytes': max_bytes,
+            'rotate_interval': rotate_interval,
+            'backup_count': backup_count
+        }
+        self.sink = RotatingSink(path, **sink_options)
+        # activity events go here as JSON lines when a path is configured
+        self.activity_sink = RotatingSink(activity_path, **sink_options) if activity_path else None
+
+        self.metrics = {
+            'written': 0,
+            'batches': 0,
+            'rotations': 0,
+            'write_errors': 0
+        }
+        self._reported_drops = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='log-writer', daemon=True)
+        self._thread.start()
+
+    def install(self, logger=None, level=logging.INFO):
+        logger = logger or logging.getLogger()
+        logger.setLevel(level)
+        for handler in list(logger.handlers):
+            logger.removeHandler(handler)
+        logger.addHandler(self.handler)
+        return self
+
+    def stats(self):
+        stats = dict(self.metrics)
+        stats['queued'] = self.queue.qsize()
+        stats['dropped'] = self.handler.dropped
+        return stats
+
+    def close(self, timeout=5.0):
+        self._stop.set()
+        self._thread.join(timeout)
+
+    def _run(self):
+        while True:
+            batch = self._drain()
+            if batch:
+                self._write(batch)
+            elif self._stop.is_set():
+                break
+        self.sink.close()
+        if self.activity_sink:
+            self.activity_sink.close()
+
+    def _drain(self):
+        try:
+            batch = [self.queue.get(timeout=self.flush_interval)]
+        except queue.Empty:
+            return []
+        while len(batch) < self.batch_size:
+            try:
+                batch.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return batch
+
+    def _write(self, batch):
+        lines = []
+        activity_lines = []
+        for record in batch:
+            try:
+                activity = getattr(record, 'activity', None)
+                if activity is not None and self.activity_sink:
+                    event = dict(activity)
+                    event['ts'] = round(record.created, 3)
+                    activity_lines.append(json.dumps(event, separators=(',', ':')) + '\n')
+                else:
+                    lines.append(self.formatter.format(record) + '\n')
+            except Exception:
+                self.metrics['write_errors'] += 1
+
+        dropped = self.handler.dropped
+        if dropped > self._reported_drops:
+            warning = logging.makeLogRecord({
+                'levelno': logging.WARNING,
+                'levelname': 'WARNING',
+                'msg': f"Log queue overflow: {dropped - self._reported_drops} records dropped"
+            })
+            lines.append(self.formatter.format(warning) + '\n')
+            self._reported_drops = dropped
+
+        try:
+            self._write_sink(self.sink, lines)
+            if activity_lines:
+                self._write_sink(self.activity_sink, activity_lines)
+            self.metrics['written'] += len(batch)
+            self.metrics['batches'] += 1
+        except Exception:
+            self.metrics['write_errors'] += 1
+
+    def _write_sink(self, sink, lines):
+        if not lines:
+            return
+        stream = sink.stream
+        sink.write(''.join(lines))
+        sink.flush()
+        if sink.stream is not stream:
+            self.metrics['rotations'] += 1
@@ -0,0 +1,331 @@
+import json
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+
+# upper bounds in seconds, from a cached balance read to a slow CUPS call
+LATENCY_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+DEFINITIONS = {
+    'cafe_http_request_duration_seconds': ('histogram', "Time to produce a response, by route"),
+    'cafe_http_requests_total': ('counter', "Responses sent, by route and status"),
+    'cafe_http_request_errors_total': ('counter', "Responses with a 5xx status, by route"),
+    'cafe_http_requests_in_flight': ('gauge', "Requests being handled, by route"),
+    'cafe_dependency_duration_seconds': ('histogram', "Time spent in MySQL/CUPS calls, by operation"),
+    'cafe_dependency_errors_total': ('counter', "MySQL/CUPS calls that raised, by operation"),
+    'cafe_dependency_in_flight': ('gauge', "MySQL/CUPS calls in progress")
+}
+
+
+class Metrics:
+    # Latency histograms, counters and gauges kept in process memory, where
+    # recording one costs a bisect and a few increments under a lock.
+    #
+    # Every worker process writes its values to <directory>/<pid>.json every
+    # flush_interval seconds; render() adds up its own live values and the
+    # other processes' files into one Prometheus text exposition, so any
+    # worker can answer a scrape for all of them. Files of processes that
+    # have exited still count towards counters and histograms but not
+    # gauges; those left by a previous run are removed at startup.
+    def __init__(self, directory='logs/metrics', flush_interval=5.0, buckets=LATENCY_BUCKETS):
+        self.directory = directory
+        self.flush_interval = flush_interval
+        self.buckets = tuple(buckets)
+
+        self._lock = threading.Lock()
+        self._histograms = {}  # (name, labels) -> [bucket counts..., +Inf count, sum]
+        self._counters = {}    # (name, labels) -> value
+        self._gauges = {}      # (name, labels) -> value
+        self._call_keys = {}   # (dependency, operation) -> series keys for call()
+        self._stop = threading.Event()
+        self._thread = None
+
+        self.metrics = {
+            'flushes': 0,
+            'flush_errors': 0,
+            'last_flush_time': 0.0
+        }
+
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            self._remove_dead_files()
+        self._start()
+        # a forked worker starts from zero under its own pid; pool
+        # processes that never record anything never write a file
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def observe(self, name, labels, seconds):
+        # labels is a tuple of (name, value) pairs in a fixed order
+        index = bisect_left(self.buckets, seconds)
+        with self._lock:
+            self._observe((name, labels), index, seconds)
+
+    def inc(self, name, labels, amount=1):
+        with self._lock:
+            self._counters[(name, labels)] = self._counters.get((name, labels), 0) + amount
+
+    def add(self, name, labels, amount):
+        with self._lock:
+            self._gauges[(name, labels)] = self._gauges.get((name, labels), 0) + amount
+
+    def call(self, dependency, operation, fn, *args, **kwargs):
+        # runs fn(*args, **kwargs) as one timed call to a dependency
+        keys = self._call_keys.get((dependency, operation)) or self._add_call_keys(dependency, operation)
+        gauge, histogram, errors = keys
+        with self._lock:
+            self._gauges[gauge] = self._gauges.get(gauge, 0) + 1
+        start = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            with self._lock:
+                self._counters[errors] = self._counters.get(errors, 0) + 1
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            index = bisect_left(self.buckets, seconds)
+            with self._lock:
+                self._observe(histogram, index, seconds)
+                self._gauges[gauge] -= 1
+
+    def timed_database(self, connect, dependency='mysql'):
+        # wraps a DB-API connection factory so connects, statements and
+        # commits are timed; statements are labelled by their SQL verb
+        def timed_connect():
+            return TimedConnection(self.call(dependency, 'connect', connect), self, dependency)
+        return timed_connect
+
+    def timed_client(self, connect, dependency):
+        # wraps a factory for a client object (e.g. a pycups Connection)
+        # so every method call is timed, labelled by method name
+        def timed_connect():
+            return TimedClient(self.call(dependency, 'connect', connect), self, dependency)
+        return timed_connect
+
+    def render(self):
+        histograms, counters, gauges = self._merged()
+        families = {}
+        for (name, labels), series in histograms.items():
+            lines = families.setdefault(name, [])
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float('inf'),), series):
+                cumulative += count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{name}_bucket{format_labels(labels + (('le', le),))} {cumulative}")
+            lines.append(f"{name}_sum{format_labels(labels)} {series[-1]}")
+            lines.append(f"{name}_count{format_labels(labels)} {cumulative}")
+        for values in (counters, gauges):
+            for (name, labels), value in values.items():
+                families.setdefault(name, []).append(f"{name}{format_labels(labels)} {value}")
+
+        output = []
+        for name in sorted(families):
+            kind, description = DEFINITIONS.get(name, ('untyped', name))
+            output.append(f"# HELP {name} {description}")
+            output.append(f"# TYPE {name} {kind}")
+            output.extend(families[name])
+        return '\n'.join(output) + '\n'
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['series'] = len(self._histograms) + len(self._counters) + len(self._gauges)
+            stats['observations'] = sum(sum(series[:-1]) for series in self._histograms.values())
+        return stats
+
+    def close(self):
+        self._stop.set()
+        if self._thread:
+            self._thread.join()
+        self.flush()
+
+    def flush(self):
+        if not self.directory:
+            return
+        start = time.monotonic()
+        with self._lock:
+            data = {
+                'pid': os.getpid(),
+                'buckets': self.buckets,
+                'histograms': [[name, labels, list(series)] for (name, labels), series in self._histograms.items()],
+                'counters': [[name, labels, value] for (name, labels), value in self._counters.items()],
+                'gauges': [[name, labels, value] for (name, labels), value in self._gauges.items()]
+            }
+        if not (data['histograms'] or data['counters'] or data['gauges']):
+            return
+        path = os.path.join(self.directory, f"{data['pid']}.json")
+        try:
+            with open(path + '.tmp', 'w') as f:
+                json.dump(data, f)
+            os.replace(path + '.tmp', path)
+            with self._lock:
+                self.metrics['flushes'] += 1
+                self.metrics['last_flush_time'] = time.monotonic() - start
+        except OSError as e:
+            with self._lock:
+                self.metrics['flush_errors'] += 1
+            logging.error(f"Metrics flush error: {e}")
+
+    def _add_call_keys(self, dependency, operation):
+        labels = (('dependency', dependency), ('operation', operation))
+        keys = self._call_keys[(dependency, operation)] = (
+            ('cafe_dependency_in_flight', (('dependency', dependency),)),
+            ('cafe_dependency_duration_seconds', labels),
+            ('cafe_dependency_errors_total', labels)
+        )
+        return keys
+
+    def _observe(self, key, index, seconds):
+        series = self._histograms.get(key)
+        if series is None:
+            series = self._histograms[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[index] += 1
+        series[-1] += seconds
+
+    def _merged(self):
+        with self._lock:
+            histograms = {key: list(series) for key, series in self._histograms.items()}
+            counters = dict(self._counters)
+            gauges = dict(self._gauges)
+
+        for data in self._other_processes():
+            if tuple(data['buckets']) != self.buckets:
+                continue
+            for name, labels, series in data['histograms']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                if key in histograms:
+                    histograms[key] = [a + b for a, b in zip(histograms[key], series)]
+                else:
+                    histograms[key] = series
+            for name, labels, value in data['counters']:
+                key = (name, tuple(tuple(pair) for pair in labels))
+                counters[key] = counters.get(key, 0) + value
+            if pid_alive(data['pid']):
+                for name, labels, value in data['gauges']:
+                    key = (name, tuple(tuple(pair) for pair in labels))
+                    gauges[key] = gauges.get(key, 0) + value
+        return histograms, counters, gauges
+
+    def _other_processes(self):
+        if not self.directory:
+            return
+        own = f"{os.getpid()}.json"
+        for filename in os.listdir(self.directory):
+            if not filename.endswith('.json') or filename == own:
+                continue
+            try:
+                with open(os.path.join(self.directory, filename)) as f:
+                    yield json.load(f)
+            except (OSError, ValueError) as e:
+                # removed or replaced between listing and reading
+                logging.debug(f"Skipping metrics file {filename}: {e}")
+
+    def _remove_dead_files(self):
+        for filename in os.listdir(self.directory):
+            pid = filename.split('.', 1)[0]
+            if pid.isdigit() and not pid_alive(int(pid)):
+                try:
+                    os.remove(os.path.join(self.directory, filename))
+                except OSError:
+                    pass
+
+    def _start(self):
+        if self.directory and self.flush_interval:
+            self._stop = threading.Event()
+            self._thread = threading.Thread(target=self._run, name='metrics-flush', daemon=True)
+            self._thread.start()
+
+    def _after_fork(self):
+        self._lock = threading.Lock()
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._thread = None
+        self._start()
+
+    def _run(self):
+        while not self._stop.wait(self.flush_interval):
+            self.flush()
+
+
+class TimedConnection:
+    # DB-API connection proxy; anything not timed is passed through
+    def __init__(self, conn, metrics, dependency):
+        self._conn = conn
+        self._metrics = metrics
+        self._dependency = dependency
+
+    def cursor(self, *args, **kwargs):
+        return TimedCursor(self._conn.cursor(*args, **kwargs), self._metrics, self._dependency)
+
+    def commit(self):
+        return self._metrics.call(self._dependency, 'commit', self._conn.commit)
+
+    def __getattr__(self, name):
+        return getattr(self._conn, name)
+
+
+class TimedCursor:
+    def __init__(self, cursor, metrics, dependency):
+        self._cursor = cursor
+        self._metrics = metrics
+        self._dependency = dependency
+        # bound here so the per-row calls skip __getattr__
+        self.fetchone = cursor.fetchone
+        self.fetchall = cursor.fetchall
+        self.fetchmany = cursor.fetchmany
+
+    def execute(self, query, *args, **kwargs):
+        return self._metrics.call(self._dependency, sql_verb(query), self._cursor.execute, query, *args, **kwargs)
+
+    def executemany(self, query, *args, **kwargs):
+        return self._metrics.call(self._dependency, sql_verb(query), self._cursor.executemany, query, *args, **kwargs)
+
+    def __iter__(self):
+        return iter(self._cursor)
+
+    def __getattr__(self, name):
+        return getattr(self._cursor, name)
+
+
+class TimedClient:
+    def __init__(self, client, metrics, dependency):
+        self._client = client
+        self._metrics = metrics
+        self._dependency = dependency
+
+    def __getattr__(self, name):
+        attr = getattr(self._client, name)
+        if not callable(attr):
+            return attr
+        def timed(*args, **kwargs):
+            return self._metrics.call(self._dependency, name, attr, *args, **kwargs)
+        return timed
+
+
+def sql_verb(query):
+    # 'select', 'insert', ... keeps the operation label set small
+    words = query.split(None, 1)
+    return words[0].lower() if words else 'unknown'
+
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{key}="{escape_label(str(value))}"' for key, value in labels) + '}'
+
+
+def escape_label(value):
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
@@ -0,0 +1,90 @@
+import time
+import numpy as np
+
+MINUTES_PER_DAY = 24 * 60
+
+
+class PricingEngine:
+    def __init__(self, rates, tariff=None, utc_offset=None):
+        self.per_minute = rates['internet']['per_minute']
+        self.per_hour = rates['internet']['per_hour']
+        self.per_day = rates['internet']['per_day']
+
+        # tariff: list of (start_hour, end_hour, multiplier); hours may be
+        # fractional and a band may wrap past midnight, e.g. (22, 6, 0.8)
+        if tariff is None:
+            tariff = rates['internet'].get('time_of_day', [])
+        self.tariff = list(tariff)
+        self.utc_offset = time.localtime().tm_gmtoff if utc_offset is None else utc_offset
+
+        multipliers = np.ones(MINUTES_PER_DAY)
+        for start_hour, end_hour, multiplier in self.tariff:
+            start = int(round(start_hour * 60)) % MINUTES_PER_DAY
+            end = int(round(end_hour * 60)) % MINUTES_PER_DAY
+            if start < end:
+                multipliers[start:end] = multiplier
+            else:
+                multipliers[start:] = multiplier
+                multipliers[:end] = multiplier
+        self.multipliers = multipliers
+        # cumulative multiplier-minutes since midnight, so the weight of any
+        # interval is two lookups instead of a walk over the bands
+        self._cumulative = np.concatenate(([0.0], np.cumsum(multipliers)))
+
+    def price(self, duration_minutes):
+        # scalar path, ignoring time-of-day bands; equal to price_batch
+        # without start_times
+        hours = duration_minutes / 60
+        if hours >= 24:
+            return self.per_day * (hours / 24)
+        elif hours >= 1:
+            return self.per_hour * hours
+        return self.per_minute * duration_minutes
+
+    def price_batch(self, durations, start_times=None):
+        minutes = np.asarray(durations, dtype=np.float64)
+        hours = minutes / 60
+        costs = np.where(
+            hours >= 24,
+            self.per_day * (hours / 24),
+            np.where(hours >= 1, self.per_hour * hours, self.per_minute * minutes)
+        )
+        if start_times is None or not self.tariff:
+            return costs
+        return costs * self.average_multiplier(minutes, start_times)
+
+    def average_multiplier(self, durations, start_times):
+        minutes = np.asarray(durations, dtype=np.float64)
+        starts = np.asarray(start_times, dtype=np.float64)
+        start_of_day = ((starts + self.utc_offset) / 60) % MINUTES_PER_DAY
+        end = start_of_day + minutes
+
+        full_days, end_of_day = np.divmod(end, MINUTES_PER_DAY)
+        weight = (full_days * self._cumulative[-1]
+                  + self._weight_until(end_of_day)
+                  - self._weight_until(start_of_day))
+
+        at_start = self.multipliers[start_of_day.astype(np.int64) % MINUTES_PER_DAY]
+        safe_minutes = np.where(minutes > 0, minutes, 1)
+        return np.where(minutes > 0, weight / safe_minutes, at_start)
+
+    def price_by_user(self, user_ids, durations, start_times=None):
+        costs = self.price_batch(durations, start_times)
+        users, index = np.unique(np.asarray(user_ids), return_inverse=True)
+        totals = np.bincount(index, weights=costs, minlength=len(users))
+        return dict(zip(users.tolist(), totals.tolist()))
+
+    def preview_sessions(self, sessions, now=None):
+        # live cost of SessionRegistry.active_sessions() entries
+        if now is None:
+            now = time.time()
+        if not sessions:
+            return {}
+        starts = np.array([session['started_at'] for session in sessions], dtype=np.float64)
+        costs = self.price_batch((now - starts) / 60, starts)
+        return {session['id']: cost for session, cost in zip(sessions, costs.tolist())}
+
+    def _weight_until(self, minute_of_day):
+        # integral of the multiplier from midnight to minute_of_day
+        whole = np.minimum(minute_of_day.astype(np.int64), MINUTES_PER_DAY - 1)
+        return self._cumulative[whole] + (minute_of_day - whole) * self.multipliers[whole]
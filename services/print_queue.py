@@ -0,0 +1,207 @@
+import heapq
+import itertools
+import logging
+import secrets
+import threading
+import time
+from collections import deque
+
+
+class PrintQueue:
+    def __init__(self, print_service, workers=4, max_attempts=3, retry_backoff=2.0,
+                 max_retry_delay=60, keep_finished=1000):
+        self.print_service = print_service
+        self.max_attempts = max_attempts
+        self.retry_backoff = retry_backoff
+        self.max_retry_delay = max_retry_delay
+        self.keep_finished = keep_finished
+
+        self._lock = threading.Condition()
+        self._jobs = {}       # job id -> job dict
+        self._lanes = {}      # printer -> heap of (-priority, seq, job id)
+        self._busy = set()    # printers with a job in flight
+        self._finished = deque()  # job ids in completion order, for pruning
+        self._callbacks = {}  # job id -> on_finish
+        self._seq = itertools.count()
+        self._closed = False
+
+        self.metrics = {
+            'submitted': 0,
+            'printed': 0,
+            'failed': 0,
+            'retries': 0
+        }
+
+        self._workers = []
+        for i in range(workers):
+            worker = threading.Thread(target=self._work, name=f'print-worker-{i}', daemon=True)
+            worker.start()
+            self._workers.append(worker)
+
+    def submit(self, user_id, file_path, printer, options=None, priority=0, on_finish=None):
+        # returns immediately; on_finish(job) runs on the worker once the
+        # job is done or has failed for good
+        job = {
+            'id': secrets.token_hex(8),
+            'user_id': user_id,
+            'printer': printer,
+            'file_path': file_path,
+            'options': options,
+            'priority': priority,
+            'status': 'queued',
+            'attempts': 0,
+            'cups_job_id': None,
+            'error': None,
+            'submitted_at': time.time(),
+            'not_before': 0,
+            'finished_at': None
+        }
+        with self._lock:
+            if self._closed:
+                raise RuntimeError("Print queue is closed")
+            self._jobs[job['id']] = job
+            if on_finish:
+                self._callbacks[job['id']] = on_finish
+            self._push(job)
+            self.metrics['submitted'] += 1
+        return self._public(job)
+
+    def get_job(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return self._public(job) if job else None
+
+    def cancel(self, job_id):
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if not job or job['status'] not in ('queued', 'retrying'):
+                return False
+            # the heap entry is skipped lazily when it reaches the top
+            self._finish(job, 'cancelled')
+        self._run_callback(job)
+        return True
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['queued'] = sum(1 for job in self._jobs.values() if job['status'] in ('queued', 'retrying'))
+            stats['printing'] = len(self._busy)
+            stats['lanes'] = {printer: len(lane) for printer, lane in self._lanes.items() if lane}
+        return stats
+
+    def close(self, timeout=10.0):
+        with self._lock:
+            self._closed = True
+            self._lock.notify_all()
+        for worker in self._workers:
+            worker.join(timeout)
+
+    def _push(self, job):
+        lane = self._lanes.setdefault(job['printer'], [])
+        heapq.heappush(lane, (-job['priority'], next(self._seq), job['id']))
+        self._lock.notify()
+
+    def _next_job(self):
+        # picks the most urgent ready job among printers that are idle;
+        # returns (job, None) or (None, seconds until a retry is due)
+        now = time.time()
+        best = None
+        wait = None
+        for printer, lane in self._lanes.items():
+            if printer in self._busy:
+                continue
+            while lane and self._jobs.get(lane[0][2], {}).get('status') not in ('queued', 'retrying'):
+                heapq.heappop(lane)
+            if not lane:
+                continue
+            head = lane[0]
+            job = self._jobs[head[2]]
+            if job['not_before'] > now:
+                # a backing-off job holds its lane so jobs stay in order
+                delay = job['not_before'] - now
+                wait = delay if wait is None else min(wait, delay)
+                continue
+            if best is None or head < best[0]:
+                best = (head, printer)
+
+        if best is None:
+            return None, wait
+        head, printer = best
+        heapq.heappop(self._lanes[printer])
+        self._busy.add(printer)
+        return self._jobs[head[2]], None
+
+    def _work(self):
+        while True:
+            with self._lock:
+                while True:
+                    if self._closed:
+                        return
+                    job, wait = self._next_job()
+                    if job:
+                        break
+                    self._lock.wait(wait)
+                job['status'] = 'printing'
+                job['attempts'] += 1
+
+            try:
+                cups_job_id = self.print_service.print_file(
+                    job['user_id'],
+                    job['file_path'],
+                    job['printer'],
+                    job['options']
+                )
+                error = None if cups_job_id else 'CUPS returned no job id'
+            except Exception as e:
+                cups_job_id = None
+                error = str(e)
+
+            finished = False
+            with self._lock:
+                self._busy.discard(job['printer'])
+                if not error:
+                    job['cups_job_id'] = cups_job_id
+                    self._finish(job, 'done')
+                    self.metrics['printed'] += 1
+                    finished = True
+                elif job['attempts'] < self.max_attempts:
+                    delay = min(self.retry_backoff * 2 ** (job['attempts'] - 1), self.max_retry_delay)
+                    job['status'] = 'retrying'
+                    job['error'] = error
+                    job['not_before'] = time.time() + delay
+                    self.metrics['retries'] += 1
+                    self._push(job)
+                else:
+                    job['error'] = error
+                    self._finish(job, 'failed')
+                    self.metrics['failed'] += 1
+                    finished = True
+                self._lock.notify_all()
+
+            if error:
+                logging.error(f"Print job {job['id']} on {job['printer']} attempt {job['attempts']} failed: {error}")
+            if finished:
+                self._run_callback(job)
+
+    def _finish(self, job, status):
+        job['status'] = status
+        job['finished_at'] = time.time()
+        self._finished.append(job['id'])
+        while len(self._finished) > self.keep_finished:
+            self._jobs.pop(self._finished.popleft(), None)
+
+    def _run_callback(self, job):
+        with self._lock:
+            callback = self._callbacks.pop(job['id'], None)
+        if callback:
+            try:
+                callback(self._public(job))
+            except Exception as e:
+                logging.error(f"Print job callback error: {e}")
+
+    def _public(self, job):
+        public = dict(job)
+        del public['file_path']
+        del public['options']
+        del public['not_before']
+        return public
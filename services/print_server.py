@@ -1,32 +1,75 @@
-import cups
+import logging
+import threading
+from services.cups_state import CupsStateCache, JOB_STATES
 
 class PrintService:
-    def __init__(self):
-        self.conn = cups.Connection()
+    def __init__(self, conn=None, connect=None, metrics=None):
+        # conn can be any object with the pycups Connection interface; a
+        # pycups connection must not be shared between threads, so worker
+        # threads open their own through connect()
+        if connect is None and conn:
+            connect = lambda: conn
+        elif connect is None:
+            # imported here, when app.py's LazyService first builds the
+            # service, so importing the app does not need pycups
+            import cups
+            connect = cups.Connection
+        if metrics:
+            # every CUPS call, including the state cache's polls, is timed
+            connect = metrics.timed_client(connect, 'cups')
+        self.connect = connect
+        self._local = threading.local()
+        self.conn = self._connection()
         self.printers = self.conn.getPrinters()
+        self.state_cache = None
+
+    def _connection(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._local.conn = self.connect()
+        return conn
+
+    def start_state_cache(self, poll_interval=2.0, printer_ttl=60):
+        # job status and printer lookups are then served from memory
+        self.state_cache = CupsStateCache(
+            self.connect,
+            poll_interval=poll_interval,
+            printer_ttl=printer_ttl
+        ).start()
+        return self.state_cache
+
+    def close(self):
+        if self.state_cache:
+            self.state_cache.close()
 
     def get_printers(self):
+        if self.state_cache:
+            return list(self.state_cache.get_printers().keys())
         return list(self.printers.keys())
 
+    def print_file(self, user_id, file_path, printer_name, options=None):
+        if not options:
+            options = {'media': 'A4', 'copies': '1'}
+        return self._connection().printFile(
+            printer_name,
+            file_path,
+            "Print Job from " + str(user_id),
+            options
+        )
+
     def submit_print_job(self, user_id, file_path, printer_name, options=None):
         try:
-            if not options:
-                options = {'media': 'A4', 'copies': '1'}
-            job_id = self.conn.printFile(
-                printer_name,
-                file_path,
-                "Print Job from " + str(user_id),
-                options
-            )
-            return job_id
+            return self.print_file(user_id, file_path, printer_name, options)
         except Exception as e:
             logging.error(f"Print error: {e}")
             return None
 
     def get_job_status(self, job_id):
+        if self.state_cache:
+            return self.state_cache.get_job_state(job_id)
         try:
-            jobs = self.conn.getJobs()
-            return jobs.get(job_id, {}).get('state', 'unknown')
+            jobs = self._connection().getJobs(which_jobs='all', requested_attributes=['job-state'])
+            return JOB_STATES.get(jobs.get(job_id, {}).get('job-state'), 'unknown')
         except Exception as e:
             logging.error(f"Job status error: {e}")
             return 'error'
@@ -0,0 +1,212 @@
+import fcntl
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from contextlib import contextmanager
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.utils import secure_filename
+
+
+class SpoolUpload:
+    # Writable stream handed to the multipart parser: every chunk is
+    # hashed and size-checked as it arrives, so an oversized upload is
+    # rejected mid-stream instead of after it has been written out.
+    def __init__(self, spool_dir, max_size, on_reject=None):
+        self.max_size = max_size
+        self.on_reject = on_reject
+        self.size = 0
+        self.hash = hashlib.sha256()
+        fd, self.temp_path = tempfile.mkstemp(dir=spool_dir, suffix='.part')
+        self.file = os.fdopen(fd, 'w+b')
+
+    def write(self, data):
+        self.size += len(data)
+        if self.max_size and self.size > self.max_size:
+            self.discard()
+            if self.on_reject:
+                self.on_reject()
+            raise RequestEntityTooLarge(f"File exceeds {self.max_size} bytes")
+        self.hash.update(data)
+        return self.file.write(data)
+
+    def discard(self):
+        if not self.file.closed:
+            self.file.close()
+        if os.path.exists(self.temp_path):
+            os.remove(self.temp_path)
+
+    def __getattr__(self, name):
+        # read/seek/tell/flush/close are served by the temp file
+        return getattr(self.file, name)
+
+
+class PrintSpool:
+    # The spool directory is shared by every worker process. A process
+    # keeps a shared flock on each spool file it still references, and
+    # the file's mtime records its last use. purge() deletes only files
+    # nobody has used for retention seconds and no process holds, and
+    # takes each one with an exclusive flock first. Commits and purges
+    # run under a spool-wide lock file, so a commit never dedupes
+    # against a file that is being deleted.
+    def __init__(self, spool_dir, max_file_size=50 * 1024 * 1024, dedup_window=60, retention=600,
+                 purge_interval=30):
+        self.spool_dir = spool_dir
+        self.max_file_size = max_file_size
+        self.dedup_window = dedup_window
+        self.retention = retention
+        self.purge_interval = purge_interval
+
+        if not os.path.exists(spool_dir):
+            os.makedirs(spool_dir)
+
+        self._lock = threading.Lock()
+        self._lock_file = open(os.path.join(spool_dir, '.lock'), 'a')
+        self._files = {}   # spool path -> {'refs', 'fd'}, fd holding a shared flock
+        self._recent = {}  # (user_id, digest, printer) -> (job_id, submitted_at)
+        self._next_purge = 0
+
+        self.metrics = {
+            'stored': 0,
+            'deduplicated': 0,
+            'bytes_stored': 0,
+            'rejected': 0,
+            'resubmissions': 0,
+            'purged': 0
+        }
+        # also clears partial uploads left behind by a crash
+        self.purge()
+
+    def open_upload(self):
+        return SpoolUpload(self.spool_dir, self.max_file_size, on_reject=self._rejected)
+
+    def commit(self, upload, filename):
+        # moves a finished upload to its content-addressed name and takes a
+        # reference on it; returns (path, digest)
+        digest = upload.hash.hexdigest()
+        ext = os.path.splitext(secure_filename(filename or ''))[1].lower()
+        path = os.path.join(self.spool_dir, digest + ext)
+
+        upload.file.flush()
+        upload.file.close()
+        with self._spool_locked():
+            entry = self._files.get(path)
+            fd = entry['fd'] if entry else _open_shared(path)
+            if fd is not None:
+                os.remove(upload.temp_path)
+                self.metrics['deduplicated'] += 1
+            else:
+                os.replace(upload.temp_path, path)
+                fd = _open_shared(path)
+                self.metrics['stored'] += 1
+                self.metrics['bytes_stored'] += upload.size
+
+            if entry is None:
+                entry = self._files[path] = {'refs': 0, 'fd': fd}
+            entry['refs'] += 1
+            os.utime(path)
+
+        if time.time() >= self._next_purge:
+            self.purge()
+        return path, digest
+
+    def _rejected(self):
+        with self._lock:
+            self.metrics['rejected'] += 1
+
+    def release(self, path):
+        with self._lock:
+            entry = self._files.get(path)
+            if entry:
+                entry['refs'] -= 1
+                if entry['refs'] <= 0:
+                    # the retention period starts now, for every process
+                    del self._files[path]
+                    try:
+                        os.utime(path)
+                    except OSError as e:
+                        logging.error(f"Spool release error: {e}")
+                    os.close(entry['fd'])
+
+    def recent_job(self, user_id, digest, printer):
+        with self._lock:
+            recent = self._recent.get((user_id, digest, printer))
+            if recent and time.time() - recent[1] < self.dedup_window:
+                self.metrics['resubmissions'] += 1
+                return recent[0]
+            return None
+
+    def remember_job(self, user_id, digest, printer, job_id):
+        with self._lock:
+            self._recent[(user_id, digest, printer)] = (job_id, time.time())
+
+    def purge(self):
+        now = time.time()
+        with self._spool_locked():
+            for name in os.listdir(self.spool_dir):
+                path = os.path.join(self.spool_dir, name)
+                if name.startswith('.') or path in self._files:
+                    continue
+                if self._purge_file(path, now):
+                    self.metrics['purged'] += 1
+            self._next_purge = now + self.purge_interval
+            self._recent = {
+                key: value for key, value in self._recent.items()
+                if now - value[1] < self.dedup_window
+            }
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            # spool files this process holds open, and the jobs holding them
+            # (deduplicated uploads share a file)
+            stats['in_use'] = sum(1 for entry in self._files.values() if entry['refs'] > 0)
+            stats['references'] = sum(entry['refs'] for entry in self._files.values())
+        return stats
+
+    @contextmanager
+    def _spool_locked(self):
+        # this process's threads, then the other processes
+        with self._lock:
+            fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(self._lock_file.fileno(), fcntl.LOCK_UN)
+
+    def _purge_file(self, path, now):
+        # True if path was unused for retention seconds, held by no process
+        # and has been deleted; partial uploads age by their last write
+        try:
+            if now - os.stat(path).st_mtime <= self.retention:
+                return False
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return False
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            # released by its last holder after the stat above
+            if now - os.fstat(fd).st_mtime <= self.retention:
+                return False
+            os.remove(path)
+            return True
+        except BlockingIOError:
+            return False
+        except OSError as e:
+            logging.error(f"Spool purge error: {e}")
+            return False
+        finally:
+            os.close(fd)
+
+
+def _open_shared(path):
+    # a descriptor holding a shared flock on path, or None if it is gone;
+    # never blocks, purges take their exclusive lock under the spool lock
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except FileNotFoundError:
+        return None
+    fcntl.flock(fd, fcntl.LOCK_SH)
+    return fd
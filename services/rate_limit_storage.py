@@ -0,0 +1,53 @@
+from limits.storage import MovingWindowSupport, Storage
+
+from services.shared_window import SharedWindowTable
+
+
+class SharedMemoryStorage(Storage, MovingWindowSupport):
+    # limits storage backend for RATELIMIT_STORAGE_URL = "shm://<path>".
+    # Counters live in a SharedWindowTable, so every worker process on the
+    # host enforces the same limits instead of keeping its own memory://
+    # counts. Importing this module registers the scheme.
+    #
+    # The moving-window strategy is served by a sliding window counter
+    # (current window plus the weighted previous one) rather than a log of
+    # hit timestamps, which keeps each key to one fixed-size slot.
+    STORAGE_SCHEME = ['shm']
+
+    def __init__(self, uri=None, slots=65536, stripe_size=64, **options):
+        path = uri.split('://', 1)[1] if uri and '://' in uri else ''
+        self.table = SharedWindowTable(path or 'logs/ratelimit.shm', slots, stripe_size)
+        super().__init__(uri, **options)
+
+    @property
+    def base_exceptions(self):
+        return OSError
+
+    def incr(self, key, expiry, elastic_expiry=False, amount=1):
+        count = self.table.hit(key, expiry, amount, elastic=elastic_expiry)
+        # None: the key's stripe is full, and a count over any limit denies it
+        return count if count is not None else float('inf')
+
+    def get(self, key):
+        return self.table.get(key)
+
+    def get_expiry(self, key):
+        return self.table.get_expiry(key)
+
+    def acquire_entry(self, key, limit, expiry, amount=1):
+        return self.table.acquire(key, expiry, limit, amount)
+
+    def get_moving_window(self, key, limit, expiry):
+        return self.table.window(key, expiry)
+
+    def check(self):
+        return not self.table.closed
+
+    def reset(self):
+        return self.table.reset()
+
+    def clear(self, key):
+        self.table.clear(key)
+
+    def stats(self):
+        return self.table.stats()
@@ -0,0 +1,250 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from decimal import Decimal
+
+# signed amount of a billing row: charges reduce the balance, deposits
+# and refunds add to it (same convention as BillingService.get_daily_totals)
+SIGNED_AMOUNT = "CASE transaction_type WHEN 'charge' THEN -amount ELSE amount END"
+
+_worker_conn = None
+
+
+def _worker_init(connect):
+    global _worker_conn
+    _worker_conn = connect()
+
+
+def sum_chunk(start, end):
+    # runs in a worker process: per-user signed totals for billing rows
+    # with start <= id < end
+    cursor = _worker_conn.cursor()
+    cursor.execute(f"""
+        SELECT user_id, SUM({SIGNED_AMOUNT}), COUNT(*)
+        FROM billing
+        WHERE id >= %s AND id < %s
+        GROUP BY user_id
+    """, (start, end))
+    totals = {}
+    rows = 0
+    for user_id, total, count in cursor.fetchall():
+        totals[user_id] = str(total)
+        rows += count
+    cursor.close()
+    # end the read so the next chunk sees its own snapshot
+    _worker_conn.rollback()
+    return start, totals, rows
+
+
+class Reconciliation:
+    # Recomputes every user's balance from the billing table and compares
+    # it with users.credit_balance, assuming all credit enters through
+    # billing rows (balances start at zero).
+    #
+    # The id range up to the largest id seen at the start is split into
+    # chunks summed in parallel by a process pool. Progress (chunks done and
+    # running totals) is checkpointed to a JSON file after every chunk, so
+    # an interrupted run resumes where it stopped. The chunk totals only
+    # pick the suspects: a charge can commit a row below the largest id
+    # after its chunk was summed, so each suspect's full billing history is
+    # summed again under its row lock before it is reported or corrected,
+    # and a busy ledger does not show up as drift.
+    def __init__(self, connect, checkpoint_path, workers=4, chunk_size=50000, fix_batch=500):
+        self.connect = connect
+        self.checkpoint_path = checkpoint_path
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self.fix_batch = fix_batch
+        self.state = None
+
+    def run(self, fix=False, resume=True, tolerance=Decimal('0.005')):
+        start_time = time.monotonic()
+        self.state = self._load_checkpoint() if resume else None
+        if self.state is None:
+            self.state = self._new_state()
+            self._save_checkpoint()
+
+        chunks = [
+            start for start in range(self.state['min_id'], self.state['max_id'] + 1, self.state['chunk_size'])
+            if str(start) not in self.state['done']
+        ]
+        if chunks:
+            self._scan(chunks)
+
+        totals = {int(user_id): Decimal(total) for user_id, total in self.state['totals'].items()}
+        drift = self._compare(totals, tolerance, fix)
+
+        report = {
+            'max_id': self.state['max_id'],
+            'rows': self.state['rows'],
+            'users_checked': len(drift['checked']),
+            'drifted_users': len(drift['drifted']),
+            'total_drift': str(sum((item['drift'] for item in drift['drifted']), Decimal(0))),
+            'corrected': drift['corrected'],
+            'drifted': [
+                {key: str(value) if isinstance(value, Decimal) else value for key, value in item.items()}
+                for item in sorted(drift['drifted'], key=lambda item: -abs(item['drift']))
+            ],
+            'elapsed': round(time.monotonic() - start_time, 2)
+        }
+        os.remove(self.checkpoint_path)
+        return report
+
+    def _new_state(self):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT COALESCE(MIN(id), 1), COALESCE(MAX(id), 0) FROM billing")
+            min_id, max_id = cursor.fetchone()
+            cursor.close()
+        finally:
+            conn.close()
+        return {
+            'min_id': int(min_id),
+            'max_id': int(max_id),
+            'chunk_size': self.chunk_size,
+            'done': [],
+            'rows': 0,
+            'totals': {},
+            'started_at': time.time()
+        }
+
+    def _scan(self, chunks):
+        with ProcessPoolExecutor(max_workers=self.workers, initializer=_worker_init,
+                                 initargs=(self.connect,)) as pool:
+            futures = [
+                pool.submit(sum_chunk, start, min(start + self.state['chunk_size'], self.state['max_id'] + 1))
+                for start in chunks
+            ]
+            for future in as_completed(futures):
+                start, totals, rows = future.result()
+                for user_id, total in totals.items():
+                    key = str(user_id)
+                    self.state['totals'][key] = str(Decimal(self.state['totals'].get(key, '0')) + Decimal(total))
+                self.state['done'].append(str(start))
+                self.state['rows'] += rows
+                self._save_checkpoint()
+                logging.info(f"Reconciliation: {len(self.state['done'])} chunks done")
+
+    def _compare(self, totals, tolerance, fix):
+        conn = self.connect()
+        result = {'checked': set(), 'drifted': [], 'corrected': 0}
+        try:
+            cursor = conn.cursor()
+            cursor.execute("SELECT id, credit_balance FROM users")
+            balances = {user_id: Decimal(balance) for user_id, balance in cursor.fetchall()}
+            conn.rollback()
+            result['checked'] = set(balances) | set(totals)
+
+            suspects = [
+                user_id for user_id in result['checked']
+                if abs(balances.get(user_id, Decimal(0)) - totals.get(user_id, Decimal(0))) > tolerance
+            ]
+            for i in range(0, len(suspects), self.fix_batch):
+                batch = suspects[i:i + self.fix_batch]
+                drifted = self._recheck(conn, cursor, batch, tolerance)
+                # users with billing rows but no users row are only reported
+                corrections = [(item['expected'], item['user_id']) for item in drifted if item['balance'] is not None]
+                if fix and corrections:
+                    cursor.executemany("UPDATE users SET credit_balance = %s WHERE id = %s", corrections)
+                    conn.commit()
+                    result['corrected'] += len(corrections)
+                else:
+                    conn.rollback()
+                result['drifted'] += drifted
+            cursor.close()
+        finally:
+            conn.close()
+        return result
+
+    def _recheck(self, conn, cursor, batch, tolerance):
+        # inside one transaction: lock the rows, then sum each user's whole
+        # billing history. Charges update the users row and insert their
+        # billing row in one transaction, so once the lock is held every
+        # charge for these users has either committed or not started, and
+        # the sum (read after the lock, with a fresh snapshot) matches it
+        placeholders = ', '.join(['%s'] * len(batch))
+        cursor.execute(
+            f"SELECT id, credit_balance FROM users WHERE id IN ({placeholders}) FOR UPDATE",
+            batch
+        )
+        balances = {user_id: Decimal(balance) for user_id, balance in cursor.fetchall()}
+        cursor.execute(f"""
+            SELECT user_id, SUM({SIGNED_AMOUNT})
+            FROM billing
+            WHERE user_id IN ({placeholders})
+            GROUP BY user_id
+        """, batch)
+        totals = {user_id: Decimal(total) for user_id, total in cursor.fetchall()}
+
+        drifted = []
+        for user_id in batch:
+            expected = totals.get(user_id, Decimal(0))
+            actual = balances.get(user_id)
+            if actual is None or abs(actual - expected) > tolerance:
+                drifted.append({
+                    'user_id': user_id,
+                    'balance': actual,
+                    'expected': expected,
+                    'drift': (actual or Decimal(0)) - expected
+                })
+        return drifted
+
+    def _load_checkpoint(self):
+        if not os.path.exists(self.checkpoint_path):
+            return None
+        with open(self.checkpoint_path) as f:
+            state = json.load(f)
+        if state['chunk_size'] != self.chunk_size:
+            logging.warning("Reconciliation checkpoint uses a different chunk size; resuming with it")
+        logging.info(f"Resuming reconciliation: {len(state['done'])} chunks already done")
+        return state
+
+    def _save_checkpoint(self):
+        # written to a temporary file and renamed, so a crash mid-write
+        # leaves the previous checkpoint intact
+        directory = os.path.dirname(self.checkpoint_path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        temp_path = self.checkpoint_path + '.tmp'
+        with open(temp_path, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, self.checkpoint_path)
+
+
+def connect_database():
+    import mysql.connector
+    from config.config import Config
+    return mysql.connector.connect(**Config.DB_CONFIG)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recompute user balances from billing rows and report drift")
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--chunk-size', type=int, default=50000)
+    parser.add_argument('--checkpoint', default='logs/reconciliation.checkpoint')
+    parser.add_argument('--fix', action='store_true', help="write corrected balances")
+    parser.add_argument('--fresh', action='store_true', help="ignore an existing checkpoint")
+    parser.add_argument('--report', help="also write the JSON report to this file")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(message)s')
+    reconciliation = Reconciliation(connect_database, args.checkpoint, args.workers, args.chunk_size)
+    report = reconciliation.run(fix=args.fix, resume=not args.fresh)
+    output = json.dumps(report, indent=2)
+    if args.report:
+        with open(args.report, 'w') as f:
+            f.write(output)
+    print(output)
+    sys.exit(1 if report['drifted_users'] and not args.fix else 0)
+
+
+if __name__ == '__main__':
+    sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    main()
@@ -0,0 +1,238 @@
+import itertools
+import logging
+import secrets
+import threading
+import time
+from services.timing_wheel import TimingWheel
+
+
+class SessionChargeFailed(Exception):
+    # raised by end() for a session that ended but could not be billed;
+    # the charge is kept and retried by the sweeper
+    def __init__(self, session):
+        super().__init__(f"Session {session['id']} ended but was not charged")
+        self.session = session
+
+
+class SessionRegistry:
+    # An ended or expired session leaves the active tables before it is
+    # charged. A charge that fails keeps the session in _unbilled, and the
+    # sweeper retries it every retry_interval seconds with the duration it
+    # had when it ended, so minutes are never dropped.
+    def __init__(self, billing_service, lifetime=3600, idle_timeout=900, tick=1.0,
+                 retry_interval=30.0, clock=time.time, start_sweeper=True, on_start=None, on_end=None):
+        self.billing_service = billing_service
+        # on_start(session) / on_end(session) run outside the lock with a
+        # copy of the session; on_end also fires for expired sessions
+        self.on_start = on_start
+        self.on_end = on_end
+        self.lifetime = lifetime
+        self.idle_timeout = idle_timeout
+        self.tick = tick
+        self.retry_interval = retry_interval
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._sessions = {}   # session_id -> session dict
+        self._by_user = {}    # user_id -> session_id
+        self._wheel = TimingWheel(clock(), tick=tick)
+        self._unbilled = {}   # session_id -> ended session awaiting its charge
+        self._next_retry = 0
+
+        # random per-process prefix plus a counter: unique within the
+        # process and not guessable across restarts
+        self._id_prefix = secrets.token_hex(6)
+        self._id_counter = itertools.count(1)
+
+        self.metrics = {
+            'started': 0,
+            'ended': 0,
+            'expired': 0,
+            'charge_failures': 0,
+            'charges_retried': 0
+        }
+
+        self._stop = threading.Event()
+        self._sweeper = None
+        if start_sweeper:
+            self._sweeper = threading.Thread(target=self._sweep_loop, name='session-sweeper', daemon=True)
+            self._sweeper.start()
+
+    def start(self, user_id, ip_address=None):
+        now = self.clock()
+        with self._lock:
+            session_id = self._by_user.get(user_id)
+            if session_id:
+                # a second start from the same user resumes the open session
+                session = self._sessions[session_id]
+                session['last_seen'] = now
+                return dict(session)
+
+            session_id = f"{self._id_prefix}-{next(self._id_counter)}"
+            session = {
+                'id': session_id,
+                'user_id': user_id,
+                'ip_address': ip_address,
+                'started_at': now,
+                'last_seen': now
+            }
+            self._sessions[session_id] = session
+            self._by_user[user_id] = session_id
+            self._wheel.schedule(session_id, self._deadline(session))
+            self.metrics['started'] += 1
+            session = dict(session)
+        self._notify(self.on_start, session)
+        return session
+
+    def touch(self, user_id):
+        # idle deadlines are re-checked lazily when the timer fires, so a
+        # touch is just a timestamp update
+        with self._lock:
+            session_id = self._by_user.get(user_id)
+            if not session_id:
+                return False
+            self._sessions[session_id]['last_seen'] = self.clock()
+            return True
+
+    def get(self, session_id):
+        with self._lock:
+            session = self._sessions.get(session_id)
+            return dict(session) if session else None
+
+    def get_by_user(self, user_id):
+        with self._lock:
+            session_id = self._by_user.get(user_id)
+            return dict(self._sessions[session_id]) if session_id else None
+
+    def active_sessions(self):
+        with self._lock:
+            return [dict(session) for session in self._sessions.values()]
+
+    def end(self, user_id):
+        with self._lock:
+            session = self._remove(self._by_user.get(user_id))
+            if session:
+                self.metrics['ended'] += 1
+        if not session:
+            return None
+        charged = self._charge(session, self.clock())
+        self._notify(self.on_end, dict(session))
+        if not charged:
+            raise SessionChargeFailed(dict(session))
+        return session
+
+    def sweep(self, now=None):
+        if now is None:
+            now = self.clock()
+
+        expired = []
+        with self._lock:
+            for session_id in self._wheel.advance(now):
+                session = self._sessions[session_id]
+                deadline = self._deadline(session)
+                if deadline > now:
+                    # touched since the timer was armed
+                    self._wheel.schedule(session_id, deadline)
+                    continue
+                self._remove(session_id)
+                self.metrics['expired'] += 1
+                expired.append((session, deadline))
+
+        for session, deadline in expired:
+            # each on its own: one failure must not strand the rest, which
+            # are already out of the active tables
+            try:
+                logging.info(f"Session {session['id']} for user {session['user_id']} expired")
+                self._charge(session, deadline)
+                self._notify(self.on_end, dict(session))
+            except Exception as e:
+                logging.error(f"Session expiry error for {session['id']}: {e}")
+
+        if now >= self._next_retry:
+            self._next_retry = now + self.retry_interval
+            self.retry_charges()
+        return [session for session, _ in expired]
+
+    def retry_charges(self):
+        # returns the number of sessions still unbilled
+        with self._lock:
+            pending = list(self._unbilled.values())
+            self._unbilled.clear()
+        for session in pending:
+            with self._lock:
+                self.metrics['charges_retried'] += 1
+            if self._bill(session):
+                logging.info(f"Session {session['id']} charged on retry")
+        with self._lock:
+            return len(self._unbilled)
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['active'] = len(self._sessions)
+            stats['timers'] = len(self._wheel)
+            stats['unbilled'] = len(self._unbilled)
+        return stats
+
+    def close(self):
+        self._stop.set()
+        if self._sweeper:
+            self._sweeper.join()
+        if self._unbilled and self.retry_charges():
+            for session in self._unbilled.values():
+                logging.error(
+                    f"Session {session['id']} for user {session['user_id']} left unbilled: "
+                    f"{session['duration_minutes']} minutes ending {session['ended_at']}"
+                )
+
+    def _deadline(self, session):
+        return min(
+            session['started_at'] + self.lifetime,
+            session['last_seen'] + self.idle_timeout
+        )
+
+    def _remove(self, session_id):
+        if not session_id:
+            return None
+        session = self._sessions.pop(session_id, None)
+        if session:
+            del self._by_user[session['user_id']]
+            self._wheel.cancel(session_id)
+        return session
+
+    def _charge(self, session, ended_at):
+        session['ended_at'] = ended_at
+        session['duration_minutes'] = round(max(ended_at - session['started_at'], 0) / 60, 2)
+        return self._bill(session)
+
+    def _bill(self, session):
+        # True once charged; otherwise the session is kept for a retry
+        try:
+            session['cost'] = self.billing_service.charge_session(
+                session['user_id'],
+                session['duration_minutes'],
+                session['started_at']
+            )
+        except Exception as e:
+            logging.error(f"Session charge error for {session['id']}: {e}")
+            session['cost'] = None
+        if session['cost'] is not None:
+            return True
+        with self._lock:
+            self._unbilled[session['id']] = session
+            self.metrics['charge_failures'] += 1
+        return False
+
+    def _notify(self, callback, session):
+        if callback:
+            try:
+                callback(session)
+            except Exception as e:
+                logging.error(f"Session callback error: {e}")
+
+    def _sweep_loop(self):
+        while not self._stop.wait(self.tick):
+            try:
+                self.sweep()
+            except Exception as e:
+                logging.error(f"Session sweep error: {e}")
@@ -0,0 +1,254 @@
+import fcntl
+import hashlib
+import mmap
+import os
+import struct
+import threading
+import time
+from contextlib import contextmanager
+
+MAGIC = b'CAFEWIN1'
+HEADER = struct.Struct('<8sII')
+HEADER_SIZE = 64
+# seq, current count, previous count, unused, key hash, window start, window length
+SLOT = struct.Struct('<IIIIQdd')
+SEQ = struct.Struct('<I')
+BODY = struct.Struct('<IIIQdd')  # everything after seq
+READ_RETRIES = 3
+
+
+class SharedWindowTable:
+    # Fixed-size hash table of window counters in an mmap'd file, so every
+    # process on the host that opens the same path shares the counts.
+    #
+    # Slots are grouped into stripes; a key only ever probes the slots of
+    # its own stripe, so one lock per stripe (a threading lock within the
+    # process plus an fcntl byte-range lock across processes) serialises
+    # all writers that could touch a slot. Readers take no lock: each slot
+    # carries a sequence number that writers make odd while they update it,
+    # and a reader that sees it odd or changed simply reads again.
+    #
+    # A key whose stripe has no free or expired slot is denied rather than
+    # evicting another key's live counter, which would hand that key a
+    # fresh budget. A file laid out for a different slots/stripe_size is
+    # refused (ValueError) instead of being wiped under the processes that
+    # still use it; remove it once they have stopped.
+    def __init__(self, path, slots=65536, stripe_size=64):
+        if slots % stripe_size:
+            raise ValueError("slots must be a multiple of stripe_size")
+        self.path = path
+        self.slots = slots
+        self.stripe_size = stripe_size
+        self.stripes = slots // stripe_size
+        self._locks = [threading.Lock() for _ in range(self.stripes)]
+        self.metrics = {'stripe_full': 0}
+
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory, exist_ok=True)
+        self._fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        size = HEADER_SIZE + slots * SLOT.size
+        # byte 0 of the lock space guards initialisation, byte 1 + n stripe n
+        fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 0)
+        try:
+            header = os.pread(self._fd, HEADER.size, 0)
+            if len(header) < HEADER.size or not header.strip(b'\0'):
+                # new file (or one whose creator died before the header)
+                os.ftruncate(self._fd, size)
+                os.pwrite(self._fd, HEADER.pack(MAGIC, slots, stripe_size), 0)
+            elif HEADER.unpack(header) != (MAGIC, slots, stripe_size) or os.fstat(self._fd).st_size != size:
+                raise ValueError(
+                    f"{path} is not a counter table with slots={slots}, stripe_size={stripe_size}; "
+                    "remove it once no process is using it"
+                )
+        except BaseException:
+            # closing the file drops the lock too
+            os.close(self._fd)
+            raise
+        fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 0)
+        self._mm = mmap.mmap(self._fd, size)
+
+    def hit(self, key, window, amount=1, limit=None, elastic=False):
+        # fixed window starting at the first hit; returns the new count, or
+        # None if limit is given and the hit would exceed it or the key's
+        # stripe is full
+        now = time.time()
+        with self._locked(key) as (offset, key_hash):
+            if offset is None:
+                return None
+            current, _, start, length = self._load(offset, key_hash)
+            if now >= start + length:
+                current, start = 0, now
+            if limit is not None and current + amount > limit:
+                return None
+            self._store(offset, current + amount, 0, key_hash, now if elastic else start, window)
+            return current + amount
+
+    def acquire(self, key, window, limit, amount=1):
+        # sliding window counter: the previous window's count is weighted by
+        # how much of it still overlaps the sliding window
+        now = time.time()
+        with self._locked(key) as (offset, key_hash):
+            if offset is None:
+                return False
+            current, previous, start, _ = self._load(offset, key_hash)
+            current, previous, start = self._roll(current, previous, start, window, now)
+            if self._estimate(current, previous, start, window, now) + amount > limit:
+                return False
+            self._store(offset, current + amount, previous, key_hash, start, window)
+            return True
+
+    def get(self, key):
+        # count in the current fixed window
+        slot = self._read(key)
+        if slot is None:
+            return 0
+        current, _, start, length = slot
+        return current if time.time() < start + length else 0
+
+    def get_expiry(self, key):
+        slot = self._read(key)
+        if slot is None:
+            return time.time()
+        return slot[2] + slot[3]
+
+    def window(self, key, window):
+        # (start of the current window, estimated hits in the sliding window)
+        now = time.time()
+        slot = self._read(key)
+        if slot is None:
+            return now, 0
+        current, previous, start = self._roll(slot[0], slot[1], slot[2], window, now)
+        return start, int(self._estimate(current, previous, start, window, now))
+
+    def clear(self, key):
+        with self._locked(key) as (offset, key_hash):
+            if offset is not None and self._key_at(offset) == key_hash:
+                self._store(offset, 0, 0, key_hash, 0.0, 0.0)
+
+    def reset(self):
+        # drops every counter; returns how many keys were held
+        cleared = 0
+        for stripe in range(self.stripes):
+            with self._stripe_lock(stripe):
+                for index in range(self.stripe_size):
+                    offset = self._slot_offset(stripe, index)
+                    if self._key_at(offset):
+                        cleared += 1
+                        self._store(offset, 0, 0, 0, 0.0, 0.0)
+        return cleared
+
+    def stats(self):
+        now = time.time()
+        used = live = 0
+        for index in range(self.slots):
+            _, _, _, _, key_hash, start, length = SLOT.unpack_from(self._mm, HEADER_SIZE + index * SLOT.size)
+            if key_hash:
+                used += 1
+                if now < start + 2 * length:
+                    live += 1
+        return dict(self.metrics, slots=self.slots, used=used, live=live, path=self.path)
+
+    @property
+    def closed(self):
+        return self._mm.closed
+
+    def close(self):
+        self._mm.close()
+        os.close(self._fd)
+
+    def _hash(self, key):
+        digest = hashlib.blake2b(key.encode(), digest_size=8).digest()
+        # zero marks an empty slot
+        return int.from_bytes(digest, 'little') or 1
+
+    def _slot_offset(self, stripe, index):
+        return HEADER_SIZE + (stripe * self.stripe_size + index) * SLOT.size
+
+    def _probe(self, key_hash):
+        stripe = key_hash % self.stripes
+        home = (key_hash // self.stripes) % self.stripe_size
+        for step in range(self.stripe_size):
+            yield self._slot_offset(stripe, (home + step) % self.stripe_size)
+
+    def _key_at(self, offset):
+        return struct.unpack_from('<Q', self._mm, offset + 16)[0]
+
+    def _read_slot(self, offset):
+        for _ in range(READ_RETRIES):
+            seq, current, previous, _, key_hash, start, length = SLOT.unpack_from(self._mm, offset)
+            if not seq & 1 and SEQ.unpack_from(self._mm, offset)[0] == seq:
+                return key_hash, (current, previous, start, length)
+        # a writer kept the slot busy; wait for it
+        stripe = (offset - HEADER_SIZE) // SLOT.size // self.stripe_size
+        with self._stripe_lock(stripe):
+            _, current, previous, _, key_hash, start, length = SLOT.unpack_from(self._mm, offset)
+        return key_hash, (current, previous, start, length)
+
+    def _read(self, key):
+        key_hash = self._hash(key)
+        for offset in self._probe(key_hash):
+            slot_hash, slot = self._read_slot(offset)
+            if slot_hash == key_hash:
+                return slot
+            if not slot_hash:
+                return None
+        return None
+
+    @contextmanager
+    def _locked(self, key):
+        # yields (slot offset, key hash) with the key's stripe locked; the
+        # offset is None when the stripe has no slot for the key
+        key_hash = self._hash(key)
+        with self._stripe_lock(key_hash % self.stripes):
+            yield self._find(key_hash, time.time()), key_hash
+
+    @contextmanager
+    def _stripe_lock(self, stripe):
+        with self._locks[stripe]:
+            fcntl.lockf(self._fd, fcntl.LOCK_EX, 1, 1 + stripe)
+            try:
+                yield
+            finally:
+                fcntl.lockf(self._fd, fcntl.LOCK_UN, 1, 1 + stripe)
+
+    def _find(self, key_hash, now):
+        # the key's slot, else the first empty or expired one, else None:
+        # every slot of the stripe holds a live counter
+        reusable = None
+        for offset in self._probe(key_hash):
+            _, _, _, _, slot_hash, start, length = SLOT.unpack_from(self._mm, offset)
+            if slot_hash == key_hash:
+                return offset
+            if not slot_hash:
+                return reusable if reusable is not None else offset
+            if reusable is None and now >= start + 2 * length:
+                reusable = offset
+        if reusable is None:
+            self.metrics['stripe_full'] += 1
+        return reusable
+
+    def _load(self, offset, key_hash):
+        _, current, previous, _, slot_hash, start, length = SLOT.unpack_from(self._mm, offset)
+        if slot_hash != key_hash:
+            return 0, 0, 0.0, 0.0
+        return current, previous, start, length
+
+    def _store(self, offset, current, previous, key_hash, start, length):
+        seq = SEQ.unpack_from(self._mm, offset)[0]
+        SEQ.pack_into(self._mm, offset, (seq + 1) & 0xFFFFFFFF)
+        BODY.pack_into(self._mm, offset + SEQ.size, current, previous, 0, key_hash, start, length)
+        SEQ.pack_into(self._mm, offset, (seq + 2) & 0xFFFFFFFF)
+
+    def _roll(self, current, previous, start, window, now):
+        # windows are aligned to multiples of their length
+        if now < start + window:
+            return current, previous, start
+        aligned = now - now % window
+        if now < start + 2 * window:
+            return 0, current, aligned
+        return 0, 0, aligned
+
+    def _estimate(self, current, previous, start, window, now):
+        overlap = 1.0 - (now - start) / window
+        return current + previous * max(overlap, 0.0)
@@ -0,0 +1,251 @@
+import hashlib
+import hmac
+import threading
+import time
+from collections import deque
+
+
+class StationTableFull(Exception):
+    pass
+
+
+class StationThrottled(StationTableFull):
+    pass
+
+
+class StationUnverified(Exception):
+    pass
+
+
+class Station:
+    __slots__ = (
+        'id', 'ip', 'user_id', 'boot', 'seq', 'session_id', 'session_active', 'elapsed',
+        'first_seen', 'last_seen', 'interval', 'last_event_id', 'events', 'heartbeats'
+    )
+
+    def __init__(self, station_id, now, recent_events):
+        self.id = station_id
+        self.ip = None
+        self.user_id = None
+        self.boot = None
+        self.seq = 0
+        self.session_id = None
+        self.session_active = False
+        self.elapsed = 0.0
+        self.first_seen = now
+        self.last_seen = now
+        self.interval = 0.0
+        self.last_event_id = 0
+        self.events = deque(maxlen=recent_events)
+        self.heartbeats = 0
+
+
+class StationTable:
+    # Live view of the stations, folded from their heartbeats. A heartbeat
+    #   {'boot': str, 'seq': int,
+    #    'session': {'active': bool, 'id': str, 'elapsed': seconds},
+    #    'events': [[event_id, type, timestamp, data], ...]}
+    # costs one dict lookup and a few attribute writes under a lock; there
+    # are no per-station timers, a station counts as offline once it has
+    # missed offline_after of the intervals it was given.
+    #
+    # boot identifies one run of the client, seq orders its heartbeats and
+    # event ids increase within a boot. Events are delivered at least once:
+    # the reply acks the last event id applied and the client resends the
+    # rest, so a lost reply never applies an event twice.
+    #
+    # The interval handed back keeps the total heartbeat rate near budget
+    # per second however many stations are online. New stations are let in
+    # at new_station_rate per second after a burst of new_station_burst, so
+    # a client making up ids cannot fill the table in one go.
+    #
+    # A heartbeat that did not prove its station id (verified=False) is
+    # bound to the address the station was registered from: it can create
+    # a station or update one from that address, but not take over a
+    # station heartbeating from elsewhere. A verified one may move it.
+    def __init__(self, budget=50.0, min_interval=5.0, max_interval=120.0, offline_after=3,
+                 forget_after=86400, max_stations=2000, max_events=20, recent_events=10,
+                 sweep_interval=5.0, new_station_rate=10.0, new_station_burst=100,
+                 on_event=None, clock=time.time):
+        self.budget = budget
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.offline_after = offline_after
+        self.forget_after = forget_after
+        self.max_stations = max_stations
+        self.max_events = max_events
+        self.recent_events = recent_events
+        self.sweep_interval = sweep_interval
+        self.new_station_rate = new_station_rate
+        self.new_station_burst = new_station_burst
+        # on_event(station_id, user_id, event) runs outside the lock for
+        # each newly applied event
+        self.on_event = on_event
+        self.clock = clock
+
+        self._lock = threading.Lock()
+        self._stations = {}  # station id -> Station
+        self._online = 0
+        self._interval = min_interval
+        self._next_sweep = 0
+        self._admissions = float(new_station_burst)
+        self._admitted_at = clock()
+
+        self.metrics = {
+            'heartbeats': 0,
+            'stale_heartbeats': 0,
+            'events': 0,
+            'duplicate_events': 0,
+            'rejected': 0,
+            'throttled': 0,
+            'unverified': 0,
+            'forgotten': 0
+        }
+
+    def heartbeat(self, station_id, ip, user_id, beat, verified=True):
+        # returns {'ack', 'interval'}; raises ValueError for a malformed
+        # heartbeat, StationTableFull for a new station over the limit,
+        # StationThrottled for one arriving faster than new_station_rate and
+        # StationUnverified for an unverified one from another address
+        boot, seq, session, events = parse_heartbeat(beat, self.max_events)
+        now = self.clock()
+        applied = []
+        with self._lock:
+            station = self._stations.get(station_id)
+            if station is not None and not verified and station.ip != ip:
+                self.metrics['unverified'] += 1
+                raise StationUnverified(f"Station {station_id} is registered from another address")
+            if station is None:
+                if len(self._stations) >= self.max_stations:
+                    self.metrics['rejected'] += 1
+                    raise StationTableFull(f"Station table is full ({self.max_stations})")
+                self._admissions = min(
+                    self.new_station_burst,
+                    self._admissions + (now - self._admitted_at) * self.new_station_rate
+                )
+                self._admitted_at = now
+                if self._admissions < 1:
+                    self.metrics['throttled'] += 1
+                    raise StationThrottled("New stations are arriving too fast")
+                self._admissions -= 1
+                station = self._stations[station_id] = Station(station_id, now, self.recent_events)
+                self._online += 1
+            if station.boot != boot:
+                # the client restarted: its counters start over
+                station.boot = boot
+                station.seq = 0
+                station.last_event_id = 0
+
+            station.last_seen = now
+            station.ip = ip
+            station.heartbeats += 1
+            self.metrics['heartbeats'] += 1
+            if seq > station.seq:
+                station.seq = seq
+                station.user_id = user_id
+                station.session_active = session['active']
+                station.session_id = session['id']
+                station.elapsed = session['elapsed']
+            else:
+                # overtaken by a later heartbeat; only its events count
+                self.metrics['stale_heartbeats'] += 1
+
+            for event in events:
+                if event[0] <= station.last_event_id:
+                    self.metrics['duplicate_events'] += 1
+                    continue
+                station.last_event_id = event[0]
+                station.events.append(event)
+                applied.append(event)
+            self.metrics['events'] += len(applied)
+
+            if now >= self._next_sweep:
+                self._sweep(now)
+            station.interval = self._interval
+            reply = {'ack': station.last_event_id, 'interval': self._interval}
+
+        if self.on_event:
+            for event in applied:
+                self.on_event(station_id, user_id, event)
+        return reply
+
+    def snapshot(self):
+        now = self.clock()
+        with self._lock:
+            return [self._public(station, now) for station in self._stations.values()]
+
+    def get(self, station_id):
+        now = self.clock()
+        with self._lock:
+            station = self._stations.get(station_id)
+            return self._public(station, now) if station else None
+
+    def stats(self):
+        with self._lock:
+            stats = dict(self.metrics)
+            stats['stations'] = len(self._stations)
+            stats['online'] = self._online
+            stats['interval'] = self._interval
+        return stats
+
+    def _sweep(self, now):
+        # O(stations) once per sweep_interval: recount the online stations,
+        # drop long-gone ones and re-derive the interval from the budget
+        online = 0
+        for station_id, station in list(self._stations.items()):
+            if now - station.last_seen > self.forget_after:
+                del self._stations[station_id]
+                self.metrics['forgotten'] += 1
+            elif self._is_online(station, now):
+                online += 1
+        self._online = online
+        self._interval = round(min(self.max_interval, max(self.min_interval, online / self.budget)), 1)
+        self._next_sweep = now + self.sweep_interval
+
+    def _is_online(self, station, now):
+        return now - station.last_seen <= self.offline_after * max(station.interval, self.min_interval)
+
+    def _public(self, station, now):
+        return {
+            'id': station.id,
+            'ip': station.ip,
+            'user_id': station.user_id,
+            'online': self._is_online(station, now),
+            'last_seen': station.last_seen,
+            'session_active': station.session_active,
+            'session_id': station.session_id,
+            'elapsed': station.elapsed,
+            'heartbeats': station.heartbeats,
+            'events': [
+                {'id': event[0], 'type': event[1], 'at': event[2], 'data': event[3]}
+                for event in station.events
+            ]
+        }
+
+
+def parse_heartbeat(beat, max_events):
+    try:
+        boot = str(beat['boot'])
+        seq = int(beat['seq'])
+        session = beat.get('session') or {}
+        session = {
+            'active': bool(session.get('active')),
+            'id': session.get('id'),
+            'elapsed': float(session.get('elapsed') or 0)
+        }
+        events = beat.get('events') or []
+        if len(events) > max_events:
+            raise ValueError(f"At most {max_events} events per heartbeat")
+        events = [
+            (int(event[0]), str(event[1]), float(event[2]), event[3] if len(event) > 3 else None)
+            for event in events
+        ]
+    except (KeyError, TypeError, IndexError, AttributeError) as e:
+        raise ValueError(f"Malformed heartbeat: {e}")
+    return boot, seq, session, events
+
+
+def station_token(key, station_id):
+    # what a station sends as 'token' to prove its id; provisioned into the
+    # client's [Station] token from the server's STATION_KEY
+    return hmac.new(key.encode(), station_id.encode(), hashlib.sha256).hexdigest()
@@ -0,0 +1,73 @@
+import math
+
+
+class TimingWheel:
+    # Hierarchical timing wheel: level 0 holds timers due within `slots`
+    # ticks, level 1 within slots**2 ticks and so on. Timers cascade down a
+    # level when the wheel below wraps, so schedule, cancel and each tick
+    # are O(1) regardless of how many timers are pending.
+    def __init__(self, now, tick=1.0, slots=60, levels=3):
+        self.tick = tick
+        self.slots = slots
+        self.levels = levels
+        self.current = int(now // tick)
+        self.wheels = [[set() for _ in range(slots)] for _ in range(levels)]
+        self.timers = {}  # key -> (due_tick, level, slot)
+
+    def __len__(self):
+        return len(self.timers)
+
+    def __contains__(self, key):
+        return key in self.timers
+
+    def schedule(self, key, deadline):
+        self.cancel(key)
+        due = max(int(math.ceil(deadline / self.tick)), self.current + 1)
+        self._place(key, due)
+
+    def cancel(self, key):
+        timer = self.timers.pop(key, None)
+        if timer is None:
+            return False
+        _, level, slot = timer
+        self.wheels[level][slot].discard(key)
+        return True
+
+    def advance(self, now):
+        # returns the keys whose deadline has passed, in tick order
+        target = int(now // self.tick)
+        expired = []
+        while self.current < target:
+            self.current += 1
+
+            for level in range(1, self.levels):
+                span = self.slots ** level
+                if self.current % span:
+                    break
+                slot = (self.current // span) % self.slots
+                bucket = self.wheels[level][slot]
+                self.wheels[level][slot] = set()
+                for key in bucket:
+                    self._place(key, self.timers[key][0])
+
+            slot = self.current % self.slots
+            bucket = self.wheels[0][slot]
+            self.wheels[0][slot] = set()
+            for key in bucket:
+                due = self.timers[key][0]
+                if due <= self.current:
+                    del self.timers[key]
+                    expired.append(key)
+                else:
+                    # parked on the top level beyond the wheel's horizon
+                    self._place(key, due)
+        return expired
+
+    def _place(self, key, due):
+        delta = due - self.current
+        for level in range(self.levels):
+            if delta < self.slots ** (level + 1) or level == self.levels - 1:
+                break
+        slot = (due // self.slots ** level) % self.slots
+        self.wheels[level][slot].add(key)
+        self.timers[key] = (due, level, slot)
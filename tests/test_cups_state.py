@@ -0,0 +1,59 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.cups_state import CupsStateCache
+
+
+class FakeCups:
+    # job id -> IPP job-state; getJobs only lists the not-completed ones
+    def __init__(self, jobs):
+        self.jobs = jobs
+
+    def getPrinters(self):
+        return {}
+
+    def getJobs(self, which_jobs, requested_attributes):
+        return {
+            job_id: self._attrs(job_id)
+            for job_id, state in self.jobs.items() if state < 7
+        }
+
+    def getJobAttributes(self, job_id, requested_attributes):
+        return self._attrs(job_id)
+
+    def _attrs(self, job_id):
+        return {'job-id': job_id, 'job-state': self.jobs[job_id], 'job-printer-uri': 'ipp://localhost/printers/p1'}
+
+
+class CupsStateCacheTest(unittest.TestCase):
+    def test_job_fetched_on_miss_is_followed_to_final_state(self):
+        cups = FakeCups({})
+        cache = CupsStateCache(lambda: cups)
+        cache.poll()
+
+        # submitted after the last poll: the lookup misses and finds it pending
+        cups.jobs[42] = 3
+        self.assertEqual(cache.get_job_state(42), 'pending')
+        self.assertEqual(cache.stats()['active_jobs'], 1)
+
+        # it finishes before the next poll ever lists it
+        cups.jobs[42] = 9
+        cache.poll()
+        self.assertEqual(cache.get_job_state(42), 'completed')
+        self.assertEqual(cache.stats()['active_jobs'], 0)
+
+    def test_finished_job_fetched_on_miss_is_not_tracked(self):
+        cups = FakeCups({7: 9})
+        cache = CupsStateCache(lambda: cups)
+        cache.poll()
+
+        self.assertEqual(cache.get_job_state(7), 'completed')
+        self.assertEqual(cache.stats()['active_jobs'], 0)
+        self.assertEqual(cache.stats()['jobs_finished'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
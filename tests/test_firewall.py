@@ -0,0 +1,181 @@
+import json
+import os
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from security.firewall import Firewall
+
+# Stand-in iptables-save, iptables-restore and ipset, installed on PATH
+# under those names. The filter table (chain -> rule specs) and the ipsets
+# are kept in JSON files next to the scripts; every call is logged.
+FAKE_TOOLS = r'''
+import json, os, sys
+
+here = os.path.dirname(os.path.abspath(__file__))
+tool = os.path.basename(sys.argv[0])
+args = sys.argv[1:]
+
+
+def load(name, default):
+    try:
+        with open(os.path.join(here, name)) as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def store(name, value):
+    with open(os.path.join(here, name), 'w') as f:
+        json.dump(value, f)
+
+
+with open(os.path.join(here, 'calls.log'), 'a') as f:
+    f.write(json.dumps([tool] + args) + '\n')
+
+table = load('filter.json', {'INPUT': [], 'FORWARD': [], 'OUTPUT': []})
+if tool == 'iptables-save':
+    print('*filter')
+    for chain in table:
+        policy = 'ACCEPT' if chain in ('INPUT', 'FORWARD', 'OUTPUT') else '-'
+        print(f':{chain} {policy} [0:0]')
+    for chain, specs in table.items():
+        for spec in specs:
+            print(f'-A {chain} {spec}')
+    print('COMMIT')
+
+elif tool == 'iptables-restore':
+    assert args == ['--noflush'], args
+    for line in sys.stdin.read().splitlines():
+        if line in ('*filter', 'COMMIT'):
+            continue
+        if line.startswith(':'):
+            # declaring a user chain creates or flushes it
+            table[line[1:].split()[0]] = []
+            continue
+        op, chain, rest = line.split(None, 2)
+        if op == '-A':
+            table[chain].append(rest)
+        elif op == '-D':
+            table[chain].remove(rest)
+        elif op == '-I':
+            position, spec = rest.split(None, 1)
+            table[chain].insert(int(position) - 1, spec)
+        else:
+            sys.exit(f'unsupported: {line}')
+    store('filter.json', table)
+
+elif tool == 'ipset':
+    sets = load('ipsets.json', {})
+    commands = [args] if args[0] != 'restore' else [line.split() for line in sys.stdin.read().splitlines()]
+    for command in commands:
+        if command[0] == 'create':
+            sets.setdefault(command[1], [])
+        elif command[0] == 'add' and command[2] not in sets[command[1]]:
+            sets[command[1]].append(command[2])
+        elif command[0] == 'del' and command[2] in sets[command[1]]:
+            sets[command[1]].remove(command[2])
+        elif command[0] == 'save':
+            for member in sets[command[1]]:
+                print(f'add {command[1]} {member}')
+    store('ipsets.json', sets)
+'''
+
+
+class FirewallTest(unittest.TestCase):
+    def setUp(self):
+        self.bin = tempfile.TemporaryDirectory()
+        for tool in ('iptables-save', 'iptables-restore', 'ipset'):
+            path = os.path.join(self.bin.name, tool)
+            with open(path, 'w') as f:
+                f.write(f'#!{sys.executable}\n' + FAKE_TOOLS)
+            os.chmod(path, 0o755)
+        # a rule the firewall does not manage, which must survive every apply
+        self.write_table({'INPUT': ['-p tcp -m tcp --dport 22 -j ACCEPT'], 'FORWARD': [], 'OUTPUT': []})
+
+        self.path = os.environ['PATH']
+        os.environ['PATH'] = self.bin.name + os.pathsep + self.path
+        self.firewall = Firewall(sudo=False)
+
+    def tearDown(self):
+        os.environ['PATH'] = self.path
+        self.bin.cleanup()
+
+    def table(self):
+        with open(os.path.join(self.bin.name, 'filter.json')) as f:
+            return json.load(f)
+
+    def write_table(self, table):
+        with open(os.path.join(self.bin.name, 'filter.json'), 'w') as f:
+            json.dump(table, f)
+
+    def restores(self):
+        with open(os.path.join(self.bin.name, 'calls.log')) as f:
+            return sum(1 for line in f if json.loads(line)[0] == 'iptables-restore')
+
+    def test_reapplying_unchanged_rules_is_a_noop(self):
+        self.assertTrue(self.firewall.setup_basic_rules())
+        table = self.table()
+        self.assertEqual(table['INPUT'], ['-j CAFE_INPUT', '-p tcp -m tcp --dport 22 -j ACCEPT'])
+        self.assertEqual(table['CAFE_INPUT'][0], '-i lo -j ACCEPT')
+        self.assertEqual(table['CAFE_INPUT'][-1], '-j DROP')
+
+        result = self.firewall.apply()
+        self.assertTrue(result['ok'])
+        self.assertFalse(result['changed'])
+        self.assertEqual(self.restores(), 1)
+        self.assertEqual(self.firewall.stats()['noop_applies'], 1)
+
+    def test_add_and_remove_rule(self):
+        self.firewall.setup_basic_rules()
+        rule = 'OUTPUT -p tcp -m tcp --dport 25 -j DROP'
+
+        self.assertTrue(self.firewall.add_rule(rule))
+        table = self.table()
+        self.assertEqual(table['OUTPUT'], ['-j CAFE_OUTPUT'])
+        self.assertEqual(table['CAFE_OUTPUT'], ['-p tcp -m tcp --dport 25 -j DROP'])
+
+        self.assertTrue(self.firewall.remove_rule(rule))
+        table = self.table()
+        self.assertEqual(table['OUTPUT'], [])
+        self.assertEqual(table['CAFE_OUTPUT'], [])
+        self.assertEqual(table['INPUT'][0], '-j CAFE_INPUT')
+        self.assertIn('-p tcp -m tcp --dport 22 -j ACCEPT', table['INPUT'])
+
+        self.assertFalse(self.firewall.apply()['changed'])
+        self.assertEqual(self.restores(), 3)
+
+    def test_stale_jump_to_an_undesired_chain_is_removed(self):
+        self.firewall.setup_basic_rules()
+        self.firewall.add_rule('OUTPUT -p tcp -m tcp --dport 25 -j DROP')
+        self.firewall.remove_rule('OUTPUT -p tcp -m tcp --dport 25 -j DROP')
+        # a jump put back by hand (or left by an older version)
+        table = self.table()
+        table['OUTPUT'].append('-j CAFE_OUTPUT')
+        self.write_table(table)
+
+        result = self.firewall.apply()
+        self.assertTrue(result['changed'])
+        self.assertEqual(self.table()['OUTPUT'], [])
+        self.assertFalse(self.firewall.apply()['changed'])
+
+    def test_duplicate_jump_is_collapsed(self):
+        self.firewall.setup_basic_rules()
+        table = self.table()
+        table['INPUT'].append('-j CAFE_INPUT')
+        self.write_table(table)
+
+        self.assertTrue(self.firewall.apply()['changed'])
+        self.assertEqual(self.table()['INPUT'].count('-j CAFE_INPUT'), 1)
+
+    def test_sync_stations(self):
+        self.assertTrue(self.firewall.allow_station('10.0.0.5'))
+        self.assertTrue(self.firewall.sync_stations(['10.0.0.6', '10.0.0.7']))
+        with open(os.path.join(self.bin.name, 'ipsets.json')) as f:
+            self.assertEqual(sorted(json.load(f)['cafe_stations']), ['10.0.0.6', '10.0.0.7'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,109 @@
+import json
+import os
+import sqlite3
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.standins import StandInDatabase
+from services.db_pool import ConnectionPool
+from services.ledger import LedgerSchemaError, LedgerWriter
+
+
+class LedgerReplayTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.db_path = os.path.join(self.workdir.name, 'billing.db')
+        self.journal = os.path.join(self.workdir.name, 'ledger.journal')
+        self.database = StandInDatabase(self.db_path, users=[1, 2], balance=100.0)
+        self.pool = ConnectionPool(self.database.connect, size=2)
+
+    def tearDown(self):
+        self.pool.close()
+        self.workdir.cleanup()
+
+    def query(self, sql):
+        conn = sqlite3.connect(self.db_path)
+        try:
+            return conn.execute(sql).fetchall()
+        finally:
+            conn.close()
+
+    def write_orphan(self, journal_id, entries, committed=0):
+        # the journal a writer left behind when its process died
+        with open(f"{self.journal}.{journal_id}", 'w') as f:
+            f.write(json.dumps({'committed': committed}) + '\n')
+            for seq, (user_id, amount) in enumerate(entries, 1):
+                f.write(json.dumps({
+                    'seq': seq,
+                    'key': f"{journal_id}-{seq}",
+                    'user_id': user_id,
+                    'amount': amount,
+                    'description': 'Internet usage',
+                    'transaction_type': 'charge',
+                    'queued_at': time.time()
+                }) + '\n')
+
+    def test_replayed_charges_already_in_billing_are_skipped(self):
+        self.write_orphan('dead', [(1, 2.5), (2, 1.0)])
+        # the first charge reached the database before the crash, the
+        # journal just never recorded it as committed
+        conn = sqlite3.connect(self.db_path)
+        conn.execute("UPDATE users SET credit_balance = credit_balance - 2.5 WHERE id = 1")
+        conn.execute(
+            "INSERT INTO billing (user_id, amount, description, transaction_type, ledger_key) "
+            "VALUES (1, 2.5, 'Internet usage', 'charge', 'dead-1')"
+        )
+        conn.commit()
+        conn.close()
+
+        ledger = LedgerWriter(self.pool, self.journal, max_latency=0.01, fsync=False)
+        try:
+            self.assertTrue(ledger.flush(timeout=5))
+            stats = ledger.stats()
+        finally:
+            ledger.close()
+
+        self.assertEqual(stats['replayed'], 2)
+        self.assertEqual(stats['duplicates'], 1)
+        self.assertEqual(
+            self.query("SELECT ledger_key, COUNT(*) FROM billing GROUP BY ledger_key ORDER BY ledger_key"),
+            [('dead-1', 1), ('dead-2', 1)]
+        )
+        self.assertEqual(self.query("SELECT id, credit_balance FROM users ORDER BY id"), [(1, 97.5), (2, 99)])
+        self.assertFalse(os.path.exists(f"{self.journal}.dead"))
+
+    def test_committed_entries_are_not_replayed(self):
+        self.write_orphan('dead', [(1, 2.5), (2, 1.0)], committed=1)
+        ledger = LedgerWriter(self.pool, self.journal, max_latency=0.01, fsync=False)
+        try:
+            self.assertTrue(ledger.flush(timeout=5))
+            self.assertEqual(ledger.stats()['replayed'], 1)
+        finally:
+            ledger.close()
+        self.assertEqual(self.query("SELECT ledger_key FROM billing"), [('dead-2',)])
+
+    def test_missing_ledger_key_column_fails_at_startup(self):
+        conn = sqlite3.connect(self.db_path)
+        conn.executescript("""
+            DROP TABLE billing;
+            CREATE TABLE billing (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                user_id INTEGER NOT NULL,
+                amount NUMERIC NOT NULL,
+                description TEXT,
+                transaction_type TEXT
+            );
+        """)
+        conn.close()
+        with self.assertRaises(LedgerSchemaError):
+            LedgerWriter(self.pool, self.journal, fsync=False)
+        # refused before a journal was opened
+        self.assertEqual([name for name in os.listdir(self.workdir.name) if name.startswith('ledger')], [])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,78 @@
+import os
+import sqlite3
+import sys
+import tempfile
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from benchmarks.standins import StandInDatabase
+from config.config import Config
+from services.billing import BillingService
+from services.pricing import PricingEngine
+
+DAY_START = 1700006400  # midnight UTC
+
+
+class SessionCostTest(unittest.TestCase):
+    # BillingService on the sqlite stand-in, so no MySQL driver is needed
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.workdir = tempfile.TemporaryDirectory()
+        os.chdir(self.workdir.name)
+        self.db_path = os.path.join(self.workdir.name, 'billing.db')
+        database = StandInDatabase(self.db_path, users=[1], balance=100.0)
+        self.pricing = PricingEngine(Config.BILLING_RATES, tariff=[(22, 6, 0.8), (17, 22, 1.25)], utc_offset=0)
+        self.billing = BillingService(connect=database.connect, pricing=self.pricing)
+
+    def tearDown(self):
+        self.billing.close()
+        os.chdir(self.cwd)
+        self.workdir.cleanup()
+
+    def test_charge_matches_live_preview(self):
+        # per-minute, hourly and daily tiers, starting inside and across bands
+        for start_hour, minutes in [(3, 25), (16.5, 45), (21, 150), (12, 1500)]:
+            started_at = DAY_START + start_hour * 3600
+            preview = self.billing.preview_session_costs(
+                [{'id': 'abc', 'started_at': started_at}], started_at + minutes * 60
+            )
+            self.assertAlmostEqual(self.billing.calculate_session_cost(minutes, started_at), preview['abc'])
+
+    def test_bands_apply_to_charges(self):
+        evening = DAY_START + 18 * 3600
+        self.assertAlmostEqual(
+            self.billing.calculate_session_cost(30, evening),
+            1.25 * self.billing.calculate_session_cost(30)
+        )
+
+    def test_charge_session_bills_the_banded_price(self):
+        evening = DAY_START + 18 * 3600
+        cost = self.billing.charge_session(1, 30, evening)
+        self.assertAlmostEqual(cost, 1.25 * 30 * 0.05)
+        self.assertTrue(self.billing.flush_ledger(timeout=5))
+
+        conn = sqlite3.connect(self.db_path)
+        try:
+            rows = conn.execute("SELECT amount, transaction_type FROM billing").fetchall()
+            balance = conn.execute("SELECT credit_balance FROM users WHERE id = 1").fetchone()[0]
+        finally:
+            conn.close()
+        self.assertEqual(len(rows), 1)
+        self.assertAlmostEqual(rows[0][0], cost)
+        self.assertEqual(rows[0][1], 'charge')
+        self.assertAlmostEqual(balance, 100.0 - cost)
+        self.assertAlmostEqual(self.billing.get_balance(1), 100.0 - cost)
+
+    def test_default_engine_uses_configured_flat_rates(self):
+        billing = BillingService(connect=self.billing.pool.connect)
+        try:
+            self.assertIs(billing.rates, Config.BILLING_RATES)
+            per_hour = Config.BILLING_RATES['internet']['per_hour']
+            self.assertEqual(billing.calculate_session_cost(90, DAY_START), per_hour * 1.5)
+        finally:
+            billing.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,99 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.session_registry import SessionChargeFailed, SessionRegistry
+
+
+class Clock:
+    def __init__(self, now=1000.0):
+        self.now = now
+
+    def __call__(self):
+        return self.now
+
+
+class FakeBilling:
+    # charge_session() fails (returns None, like BillingService) while down
+    def __init__(self):
+        self.down = False
+        self.charges = []
+
+    def charge_session(self, user_id, duration_minutes, started_at=None):
+        if self.down == 'raise':
+            raise RuntimeError("billing unavailable")
+        if self.down:
+            return None
+        self.charges.append((user_id, duration_minutes))
+        return duration_minutes * 0.05
+
+
+class SessionRegistryTest(unittest.TestCase):
+    def setUp(self):
+        self.clock = Clock()
+        self.billing = FakeBilling()
+        self.ended = []
+        self.registry = SessionRegistry(
+            self.billing, lifetime=3600, idle_timeout=600, retry_interval=30,
+            clock=self.clock, start_sweeper=False, on_end=self.ended.append
+        )
+
+    def test_end_charges_the_session(self):
+        self.registry.start(1)
+        self.clock.now += 120
+        session = self.registry.end(1)
+        self.assertEqual(session['duration_minutes'], 2.0)
+        self.assertAlmostEqual(session['cost'], 0.1)
+        self.assertEqual(self.billing.charges, [(1, 2.0)])
+
+    def test_failed_charge_on_end_is_reported_and_retried(self):
+        self.registry.start(1)
+        self.clock.now += 300
+        self.billing.down = True
+        with self.assertRaises(SessionChargeFailed) as failure:
+            self.registry.end(1)
+        self.assertEqual(failure.exception.session['duration_minutes'], 5.0)
+        self.assertIsNone(self.registry.get_by_user(1))
+        self.assertEqual(self.registry.stats()['unbilled'], 1)
+
+        # the retry bills the minutes the session had when it ended
+        self.billing.down = False
+        self.clock.now += 600
+        self.registry.sweep()
+        self.assertEqual(self.billing.charges, [(1, 5.0)])
+        self.assertEqual(self.registry.stats()['unbilled'], 0)
+
+    def test_one_failed_expiry_does_not_strand_the_others(self):
+        for user_id in (1, 2, 3):
+            self.registry.start(user_id)
+        self.billing.down = 'raise'
+        self.clock.now += 601
+        expired = self.registry.sweep()
+
+        self.assertEqual(len(expired), 3)
+        self.assertEqual(len(self.ended), 3)
+        self.assertEqual(self.registry.stats()['unbilled'], 3)
+
+        self.billing.down = False
+        self.clock.now += 30
+        self.registry.sweep()
+        self.assertEqual(sorted(self.billing.charges), [(1, 10.0), (2, 10.0), (3, 10.0)])
+        self.assertEqual(self.registry.stats()['unbilled'], 0)
+
+    def test_touch_postpones_idle_expiry(self):
+        self.registry.start(1)
+        self.clock.now += 500
+        self.registry.touch(1)
+        self.clock.now += 200
+        self.assertEqual(self.registry.sweep(), [])
+        self.assertIsNotNone(self.registry.get_by_user(1))
+
+        self.clock.now += 401
+        self.assertEqual([session['user_id'] for session in self.registry.sweep()], [1])
+        self.assertEqual(self.billing.charges, [(1, 18.33)])
+
+
+if __name__ == '__main__':
+    unittest.main()
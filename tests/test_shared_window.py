@@ -0,0 +1,91 @@
+import os
+import sys
+import tempfile
+import time
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.shared_window import SharedWindowTable
+
+
+class SharedWindowTableTest(unittest.TestCase):
+    def setUp(self):
+        self.workdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.workdir.name, 'ratelimit.shm')
+        self.tables = []
+
+    def tearDown(self):
+        for table in self.tables:
+            if not table.closed:
+                table.close()
+        self.workdir.cleanup()
+
+    def open(self, slots=64, stripe_size=8):
+        table = SharedWindowTable(self.path, slots, stripe_size)
+        self.tables.append(table)
+        return table
+
+    def test_counts_are_shared_through_the_file(self):
+        first, second = self.open(), self.open()
+        self.assertEqual(first.hit('a', 60), 1)
+        self.assertEqual(second.hit('a', 60), 2)
+        self.assertEqual(first.get('a'), 2)
+        self.assertIsNone(second.hit('a', 60, limit=2))
+
+        self.assertTrue(first.acquire('b', 60, limit=2))
+        self.assertTrue(second.acquire('b', 60, limit=2))
+        self.assertFalse(first.acquire('b', 60, limit=2))
+
+    def test_full_stripe_denies_instead_of_evicting(self):
+        table = self.open(slots=4, stripe_size=4)
+        for key in 'abcd':
+            self.assertTrue(table.acquire(key, 60, limit=5))
+
+        self.assertFalse(table.acquire('e', 60, limit=5))
+        self.assertIsNone(table.hit('e', 60))
+        self.assertEqual(table.stats()['stripe_full'], 2)
+        # the live counters were left alone
+        for key in 'abcd':
+            self.assertEqual(table.window(key, 60)[1], 1)
+
+    def test_expired_slot_is_reused_when_the_stripe_is_full(self):
+        table = self.open(slots=4, stripe_size=4)
+        for key in 'abc':
+            table.acquire(key, 60, limit=5)
+        table.acquire('short', 0.05, limit=5)
+        self.assertFalse(table.acquire('e', 60, limit=5))
+
+        time.sleep(0.11)
+        self.assertTrue(table.acquire('e', 60, limit=5))
+        self.assertEqual(table.window('short', 0.05)[1], 0)
+
+    def test_different_geometry_is_refused_and_left_intact(self):
+        table = self.open(slots=64, stripe_size=8)
+        table.hit('a', 60)
+
+        with self.assertRaises(ValueError):
+            SharedWindowTable(self.path, 128, 8)
+        with self.assertRaises(ValueError):
+            SharedWindowTable(self.path, 64, 16)
+
+        self.assertEqual(table.get('a'), 1)
+        self.assertEqual(self.open(slots=64, stripe_size=8).get('a'), 1)
+
+    def test_foreign_file_is_refused(self):
+        with open(self.path, 'wb') as f:
+            f.write(b'not a counter table' * 10)
+        with self.assertRaises(ValueError):
+            self.open()
+
+    def test_file_without_a_header_is_initialised(self):
+        # left behind by a process that died while creating the table
+        with open(self.path, 'wb') as f:
+            f.write(b'\0' * 100)
+        table = self.open()
+        self.assertEqual(table.hit('a', 60), 1)
+        self.assertEqual(table.stats()['slots'], 64)
+
+
+if __name__ == '__main__':
+    unittest.main()
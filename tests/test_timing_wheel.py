@@ -0,0 +1,69 @@
+import os
+import sys
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from services.timing_wheel import TimingWheel
+
+
+class TimingWheelTest(unittest.TestCase):
+    def test_timer_expires_at_its_deadline(self):
+        wheel = TimingWheel(0, tick=1.0, slots=8, levels=3)
+        wheel.schedule('a', 5)
+        self.assertEqual(wheel.advance(4), [])
+        self.assertEqual(wheel.advance(5), ['a'])
+        self.assertNotIn('a', wheel)
+        self.assertEqual(len(wheel), 0)
+
+    def test_fractional_deadline_rounds_up_to_the_next_tick(self):
+        wheel = TimingWheel(0, tick=1.0, slots=8, levels=3)
+        wheel.schedule('a', 2.5)
+        self.assertEqual(wheel.advance(2.9), [])
+        self.assertEqual(wheel.advance(3), ['a'])
+
+    def test_reschedule_moves_the_timer(self):
+        wheel = TimingWheel(0, tick=1.0, slots=8, levels=3)
+        wheel.schedule('a', 5)
+        wheel.schedule('a', 20)
+        self.assertEqual(wheel.advance(19), [])
+        self.assertEqual(wheel.advance(20), ['a'])
+
+    def test_cancel(self):
+        wheel = TimingWheel(0, tick=1.0, slots=8, levels=3)
+        wheel.schedule('a', 5)
+        self.assertTrue(wheel.cancel('a'))
+        self.assertFalse(wheel.cancel('a'))
+        self.assertEqual(wheel.advance(10), [])
+
+    def test_timers_cascade_down_the_levels(self):
+        # 8 slots: level 0 covers 8 ticks, level 1 64, level 2 512
+        wheel = TimingWheel(0, tick=1.0, slots=8, levels=3)
+        deadlines = {'level0': 7, 'level1': 30, 'level2': 300, 'edge': 64}
+        for key, deadline in deadlines.items():
+            wheel.schedule(key, deadline)
+        self.assertEqual(wheel.timers['level1'][1], 1)
+        self.assertEqual(wheel.timers['level2'][1], 2)
+
+        fired = {}
+        for now in range(1, 400):
+            for key in wheel.advance(now):
+                fired[key] = now
+        self.assertEqual(fired, deadlines)
+
+    def test_deadline_beyond_the_horizon_waits_on_the_top_level(self):
+        wheel = TimingWheel(0, tick=1.0, slots=4, levels=2)  # horizon of 16 ticks
+        wheel.schedule('far', 50)
+        fired = [now for now in range(1, 60) if wheel.advance(now)]
+        self.assertEqual(fired, [50])
+
+    def test_large_jump_expires_in_tick_order(self):
+        wheel = TimingWheel(0, tick=1.0, slots=8, levels=3)
+        wheel.schedule('late', 100)
+        wheel.schedule('early', 3)
+        wheel.schedule('middle', 40)
+        self.assertEqual(wheel.advance(1000), ['early', 'middle', 'late'])
+
+
+if __name__ == '__main__':
+    unittest.main()